@@ -22,6 +22,15 @@ env.read_env(os.path.join(BASE_DIR, ".env"))
 SECRET_KEY = env('SECRET_KEY')
 
 TEST_STRIPE_SECRET_KEY = env('TEST_STRIPE_SECRET_KEY')
+# Signing secret of the checkout.session.completed webhook endpoint
+STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET', default='')
+# 'live' talks to the Stripe API, 'fake' uses the in-process stand-in for load testing
+STRIPE_BACKEND = env('STRIPE_BACKEND', default='live')
+FAKE_STRIPE_LATENCY_MS = env.float('FAKE_STRIPE_LATENCY_MS', default=0)
+# Keep each user's captained teams in their session between requests
+CAPABILITIES_SESSION_CACHE = env.bool('CAPABILITIES_SESSION_CACHE', default=True)
+# Pending team invitations older than this are expired by the expire_invitations command
+INVITATION_EXPIRY_DAYS = env.int('INVITATION_EXPIRY_DAYS', default=14)
 STRIPE_LATE_FEE_PRICE_ID = 'price_1QR3hBA4CECRU4aHgeNYJLTf'
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -51,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'sportsSignUp.middleware.CapabilitiesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -69,6 +79,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'sportsSignUp.context_processors.capabilities',
+                'sportsSignUp.context_processors.notifications',
             ],
         },
     },
@@ -91,6 +103,14 @@ DATABASES = {
     }
 }
 
+# Lookup and price caches are invalidated through version counters kept in
+# the cache, so production needs a backend shared by all workers (e.g.
+# redis://host:6379/0); production settings refuse anything else. The
+# default only suits a single process.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
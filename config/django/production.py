@@ -1,6 +1,16 @@
+from django.core.exceptions import ImproperlyConfigured
+
 from .base import *
 from config.env import env
 DEBUG = env.bool('DJANGO_DEBUG', default=False)
 ENGINE = env.str('ENGINE', default='django.db.backends.postgresql_psycopg2')
 ALLOWED_HOSTS = env.list("ALLOWED_HOSTS", default=[])
 CSRF_TRUSTED_ORIGINS = env.list("CSRF_TRUSTED_ORIGINS", default=[""])
+
+# Lookup, catalog, snapshot, capability and badge caches are keyed on
+# version counters kept in the cache, so every worker must share it
+CACHES = {
+    'default': env.cache('CACHE_URL'),
+}
+if CACHES['default']['BACKEND'].endswith(('LocMemCache', 'DummyCache')):
+    raise ImproperlyConfigured("CACHE_URL must point at a cache shared by all workers, e.g. redis://host:6379/0")
@@ -1,21 +1,168 @@
+from django import forms
 from django.contrib import admin
-from .models import Sport, Team, Player, Division , CustomUser, League, StripeProduct, StripePrice, TeamCaptain, Registration, DynamicForm, FormField, FormResponse
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ValidationError
+from django.utils.html import format_html, format_html_join
+from .models import Sport, Team, Player, Division , CustomUser, League, StripeProduct, StripePrice, TeamCaptain, Registration, DynamicForm, FormField, FormResponse, BulkOperationLog
 from django.urls import path
 from django.shortcuts import redirect
 from django.contrib import messages
-from .services import sync_stripe_products
+from .services import (
+    bulk_deactivate_players, bulk_mark_paid, bulk_merge_teams, bulk_move_division, bulk_refund,
+    sync_stripe_products,
+)
+
+# Relations each model's __str__ reads. Anything that lists these models
+# (changelists, FK dropdowns, filter sidebars) joins them in up front instead
+# of running a query per row.
+STR_RELATED = {
+    Division: ('sport',),
+    League: ('sport',),
+    Team: ('league', 'division'),
+    Player: ('team',),
+    Registration: ('player', 'league'),
+    DynamicForm: ('league',),
+    FormResponse: ('form__league', 'user'),
+    Permission: ('content_type',),
+}
+
+
+def str_queryset(model):
+    return model._default_manager.select_related(*STR_RELATED.get(model, ()))
+
+
+class RelatedChoicesListFilter(admin.RelatedFieldListFilter):
+    """RelatedFieldListFilter that loads its choices' labels in one query"""
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        queryset = str_queryset(field.related_model)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return [(obj.pk, str(obj)) for obj in queryset]
+
+
+class StrRelatedAdminMixin:
+    """
+    Select the relations behind __str__ for the admin's own queryset (edit
+    pages, autocomplete results) and for its FK/M2M dropdowns.
+    """
+    def get_queryset(self, request):
+        # The changelist skips list_select_related once the queryset selects
+        # anything, so it has to be folded in here
+        related = STR_RELATED.get(self.model, ())
+        if isinstance(self.list_select_related, (list, tuple)):
+            related = (*related, *self.list_select_related)
+        return super().get_queryset(request).select_related(*related)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name not in self.raw_id_fields and db_field.name not in self.get_autocomplete_fields(request):
+            kwargs.setdefault('queryset', str_queryset(db_field.related_model))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name not in self.raw_id_fields and db_field.name not in self.get_autocomplete_fields(request):
+            kwargs.setdefault('queryset', str_queryset(db_field.related_model))
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class BulkActionsMixin:
+    """Run a services.bulk_* operation for an admin action and report the outcome"""
+    def action_form_value(self, request, name):
+        form = self.action_form(request.POST)
+        form.is_valid()
+        return form.cleaned_data.get(name)
+
+    def run_bulk_operation(self, request, operation, *args, success_message):
+        try:
+            log = operation(*args, performed_by=request.user)
+        except ValidationError as e:
+            self.message_user(request, ' '.join(e.messages), messages.ERROR)
+            return
+        self.message_user(request, success_message.format(count=log.affected_count), messages.SUCCESS)
+
+
+class RegistrationActionForm(ActionForm):
+    division = forms.ModelChoiceField(
+        queryset=str_queryset(Division), required=False,
+        help_text="Target of “Move to division”",
+    )
+
+
+class TeamActionForm(ActionForm):
+    target_team = forms.ModelChoiceField(
+        queryset=Team.objects.select_related('league'), required=False,
+        widget=forms.NumberInput, label='Target team ID',
+        help_text="Team that “Merge into target team” merges the selection into",
+    )
+
 
 admin.site.register(Sport)
-admin.site.register(Player)
-admin.site.register(Division)
-admin.site.register(CustomUser)
-admin.site.register(League)
-admin.site.register(Registration)
+
+
+@admin.register(Division)
+class DivisionAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'sport', 'skill_level', 'age_group')
+    list_select_related = ('sport',)
+    list_filter = ('sport',)
+    search_fields = ('name', 'sport__name')
+    ordering = ('name',)
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
+    list_display = ('username', 'email', 'first_name', 'last_name', 'user_type', 'is_staff')
+    list_filter = ('user_type', 'is_staff', 'is_active')
+    search_fields = ('username', 'email', 'first_name', 'last_name')
+
+
+@admin.register(League)
+class LeagueAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'sport', 'registration_start_date', 'registration_end_date')
+    list_select_related = ('sport',)
+    list_filter = ('sport',)
+    search_fields = ('name', 'sport__name')
+    ordering = ('name',)
+    filter_horizontal = ('available_divisions',)
+
+
+@admin.register(Registration)
+class RegistrationAdmin(BulkActionsMixin, StrRelatedAdminMixin, admin.ModelAdmin):
+    list_display = ('player', 'league', 'division', 'payment_status', 'registered_at')
+    list_select_related = ('player__team', 'league__sport', 'division__sport')
+    list_filter = ('payment_status', ('league', RelatedChoicesListFilter), ('division', RelatedChoicesListFilter))
+    search_fields = ('player__first_name', 'player__last_name', 'player__email', 'stripe_checkout_session')
+    raw_id_fields = ('player',)
+    autocomplete_fields = ('league', 'division')
+    action_form = RegistrationActionForm
+    actions = ['mark_paid', 'refund', 'move_division']
+
+    @admin.action(description='Mark selected registrations paid')
+    def mark_paid(self, request, queryset):
+        self.run_bulk_operation(request, bulk_mark_paid, queryset,
+                                success_message="Marked {count} registrations paid.")
+
+    @admin.action(description='Mark selected registrations refunded')
+    def refund(self, request, queryset):
+        self.run_bulk_operation(request, bulk_refund, queryset,
+                                success_message="Marked {count} paid registrations refunded. "
+                                                "Issue the refunds in Stripe.")
+
+    @admin.action(description='Move selected registrations to division')
+    def move_division(self, request, queryset):
+        division = self.action_form_value(request, 'division')
+        if division is None:
+            self.message_user(request, "Choose a division to move the registrations to.", messages.ERROR)
+            return
+        self.run_bulk_operation(request, bulk_move_division, queryset, division,
+                                success_message=f"Moved {{count}} registrations to {division.name}.")
 
 @admin.register(TeamCaptain)
-class TeamCaptainAdmin(admin.ModelAdmin):
+class TeamCaptainAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'email', 'phone_number')
     search_fields = ('first_name', 'last_name', 'email')
+    ordering = ('last_name', 'first_name')
+    raw_id_fields = ('user',)
 
 class PlayerInline(admin.TabularInline):  # You could also use admin.StackedInline for a different layout
     model = Player
@@ -23,20 +170,41 @@ class PlayerInline(admin.TabularInline):  # You could also use admin.StackedInli
     fields = ('first_name', 'last_name', 'email', 'phone_number', 'is_active')
 
 @admin.register(Team)
-class TeamAdmin(admin.ModelAdmin):
+class TeamAdmin(BulkActionsMixin, StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'league', 'division', 'captain', 'needs_real_captain')
-    list_filter = ('league', 'division')
+    list_select_related = ('league__sport', 'division__sport', 'captain')
+    list_filter = (('league', RelatedChoicesListFilter), ('division', RelatedChoicesListFilter))
     search_fields = ('name', 'captain__first_name', 'captain__last_name')
+    ordering = ('name',)
+    autocomplete_fields = ('league', 'division', 'captain')
     inlines = [PlayerInline]
+    action_form = TeamActionForm
+    actions = ['merge_teams']
+
+    @admin.action(description='Merge selected teams into target team')
+    def merge_teams(self, request, queryset):
+        target = self.action_form_value(request, 'target_team')
+        if target is None:
+            self.message_user(request, "Enter the ID of the team to merge into.", messages.ERROR)
+            return
+        self.run_bulk_operation(request, bulk_merge_teams, queryset, target,
+                                success_message=f"Merged the selected teams into {target.name}, "
+                                                f"moving {{count}} players.")
 
     def needs_real_captain(self, obj):
         return obj.captain.is_system_captain
     needs_real_captain.boolean = True
     needs_real_captain.short_description = 'Needs Captain'
-class PlayerAdmin(admin.ModelAdmin):
+
+@admin.register(Player)
+class PlayerAdmin(BulkActionsMixin, StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'email', 'team', 'membership_number', 'is_member')
-    list_filter = ('is_member', 'is_active', 'team')
+    list_select_related = ('team__league', 'team__division')
+    list_filter = ('is_member', 'is_active', ('team__league', RelatedChoicesListFilter))
     search_fields = ('first_name', 'last_name', 'email', 'membership_number', 'parent_name')
+    autocomplete_fields = ('team',)
+    raw_id_fields = ('user',)
+    actions = ['deactivate_players']
     fieldsets = (
         ('Personal Information', {
             'fields': ('first_name', 'last_name', 'email', 'phone_number', 'date_of_birth', 'parent_name')
@@ -45,13 +213,32 @@ class PlayerAdmin(admin.ModelAdmin):
             'fields': ('membership_number', 'is_member')
         }),
         ('Team Information', {
-            'fields': ('team', 'jersey_number', 'position', 'is_active')
+            'fields': ('team', 'is_active')
         }),
         ('User Account', {
             'fields': ('user',),
             'classes': ('collapse',)  # Makes this section collapsible in admin
         })
     )
+
+    @admin.action(description='Deactivate selected players')
+    def deactivate_players(self, request, queryset):
+        self.run_bulk_operation(request, bulk_deactivate_players, queryset,
+                                success_message="Deactivated {count} players.")
+
+@admin.register(BulkOperationLog)
+class BulkOperationLogAdmin(admin.ModelAdmin):
+    list_display = ('operation', 'affected_count', 'performed_by', 'created_at')
+    list_select_related = ('performed_by',)
+    list_filter = ('operation', 'created_at')
+    readonly_fields = ('operation', 'performed_by', 'parameters', 'affected_count', 'previous_values', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # stripe section 
 class StripePriceInline(admin.TabularInline):
     model = StripePrice
@@ -62,7 +249,7 @@ class StripePriceInline(admin.TabularInline):
     max_num = 0
 
 @admin.register(StripeProduct)
-class StripeProductAdmin(admin.ModelAdmin):
+class StripeProductAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'stripe_id', 'active', 'created_at')
     readonly_fields = ('stripe_id', 'metadata', 'created_at', 'updated_at')
     inlines = [StripePriceInline]
@@ -81,10 +268,11 @@ class StripeProductAdmin(admin.ModelAdmin):
             return redirect('admin:sportsSignUp_stripeproduct_changelist')
 
         try:
-            products_synced, prices_synced = sync_stripe_products()
+            result = sync_stripe_products()
             messages.success(
                 request, 
-                f'Successfully synced {products_synced} new products and {prices_synced} new prices from Stripe.'
+                f'Successfully synced {result.products_created} new products and {result.prices_created} new prices from Stripe '
+                f'({result.products_updated + result.prices_updated} updated, {result.deactivated} deactivated).'
             )
         except Exception as e:
             messages.error(request, f'Error syncing from Stripe: {str(e)}')
@@ -92,8 +280,9 @@ class StripeProductAdmin(admin.ModelAdmin):
         return redirect('admin:sportsSignUp_stripeproduct_changelist')
 
 @admin.register(StripePrice)
-class StripePriceAdmin(admin.ModelAdmin):
+class StripePriceAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('__str__', 'stripe_id', 'product', 'active')
+    list_select_related = ('product',)
     readonly_fields = ('stripe_id', 'product', 'currency', 'unit_amount', 
                       'recurring', 'recurring_interval', 'recurring_interval_count',
                       'metadata', 'created_at', 'updated_at')
@@ -106,18 +295,26 @@ class FormFieldInline(admin.TabularInline):
     ordering = ['order']
 
 @admin.register(DynamicForm)
-class DynamicFormAdmin(admin.ModelAdmin):
+class DynamicFormAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'league', 'is_active', 'created_at')
-    list_filter = ('is_active', 'league')
+    list_select_related = ('league__sport',)
+    list_filter = ('is_active', ('league', RelatedChoicesListFilter))
     search_fields = ('title', 'league__name')
+    autocomplete_fields = ('league',)
     inlines = [FormFieldInline]
 
 @admin.register(FormResponse)
-class FormResponseAdmin(admin.ModelAdmin):
+class FormResponseAdmin(StrRelatedAdminMixin, admin.ModelAdmin):
     list_display = ('get_user_name', 'get_league_name', 'created_at')
-    list_filter = ('form__league', 'created_at')
+    list_select_related = ('user', 'form__league')
+    list_filter = (('form__league', RelatedChoicesListFilter), 'created_at')
     search_fields = ('user__email', 'user__username', 'form__league__name')
-    readonly_fields = ('form', 'user', 'registration', 'responses', 'created_at')
+    readonly_fields = ('form', 'user', 'registration', 'responses', 'response_details', 'created_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'registration__player__team', 'registration__league'
+        ).prefetch_related('form__fields')
 
     def get_user_name(self, obj):
         return f"{obj.user.get_full_name()} ({obj.user.email})"
@@ -135,13 +332,10 @@ class FormResponseAdmin(admin.ModelAdmin):
 
     def response_details(self, obj):
         """Custom method to display response details in a readable format"""
-        html = ['<table style="width:100%">']
-        for field in obj.form.fields.all():
-            value = obj.responses.get(f'field_{field.id}', 'No response')
-            html.append(f'<tr><th style="text-align:left;padding:8px;background:#f5f5f5;">{field.label}</th>')
-            html.append(f'<td style="padding:8px;">{value}</td></tr>')
-        html.append('</table>')
-        return ''.join(html)
-    response_details.allow_tags = True
-
-    readonly_fields = ('response_details',)
\ No newline at end of file
+        rows = format_html_join(
+            '',
+            '<tr><th style="text-align:left;padding:8px;background:#f5f5f5;">{}</th><td style="padding:8px;">{}</td></tr>',
+            ((field.label, obj.responses.get(f'field_{field.id}', 'No response')) for field in obj.form.fields.all())
+        )
+        return format_html('<table style="width:100%">{}</table>', rows)
+    response_details.short_description = 'Responses'
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Age groups.
+
+Division.age_group is free text such as "U12", "12U", "Under 14", "10-12",
+"18+" or "O35". parse_age_group turns the forms it recognises into an
+inclusive (min_age, max_age) range, and birth_date_range turns that into
+the date_of_birth bounds of players that age on a given day, so age
+filters become plain range lookups the database can serve from an index.
+Labels like "Adult" or "Open" carry no range and return None.
+"""
+import re
+
+_UNDER = re.compile(r'^(?:u|under)\s*-?\s*(\d{1,2})$|^(\d{1,2})\s*-?\s*u$')
+_OVER = re.compile(r'^(?:o|over)\s*-?\s*(\d{1,2})$|^(\d{1,2})\s*(?:\+|and over|& over)$')
+_BETWEEN = re.compile(r'^(\d{1,2})\s*(?:-|to|–)\s*(\d{1,2})$')
+
+
+def parse_age_group(age_group):
+    """Return (min_age, max_age) for age_group, either end may be None"""
+    text = (age_group or '').strip().lower()
+    if match := _UNDER.match(text):
+        return None, int(match.group(1) or match.group(2)) - 1
+    if match := _OVER.match(text):
+        return int(match.group(1) or match.group(2)), None
+    if match := _BETWEEN.match(text):
+        low, high = sorted((int(match.group(1)), int(match.group(2))))
+        return low, high
+    return None
+
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        # Feb 29 in a non-leap year
+        return day.replace(year=day.year - years, day=28)
+
+
+def birth_date_range(age_group, on_date):
+    """
+    (born_after, born_on_or_before) for players in age_group on on_date,
+    e.g. U12 on 2025-09-01 is born after 2013-09-01. Returns None for
+    age groups that parse_age_group does not understand.
+    """
+    ages = parse_age_group(age_group)
+    if ages is None:
+        return None
+    min_age, max_age = ages
+    born_on_or_before = _years_before(on_date, min_age) if min_age is not None else None
+    born_after = _years_before(on_date, max_age + 1) if max_age is not None else None
+    return born_after, born_on_or_before
+
+
+def birth_date_filter(age_group, on_date, field='date_of_birth'):
+    """Filter kwargs for birth_date_range, or None if age_group has no range"""
+    bounds = birth_date_range(age_group, on_date)
+    if bounds is None:
+        return None
+    born_after, born_on_or_before = bounds
+    filters = {}
+    if born_after is not None:
+        filters[f'{field}__gt'] = born_after
+    if born_on_or_before is not None:
+        filters[f'{field}__lte'] = born_on_or_before
+    return filters
@@ -0,0 +1,110 @@
+"""
+Per-request roles and capabilities.
+
+get_capabilities(request) answers "is this user a captain / admin, and of
+which teams" from a single query, memoized on the request and, when
+CAPABILITIES_SESSION_CACHE is on, kept in the session until a captain or
+team changes (see signals). CapabilitiesMiddleware exposes it lazily as
+request.capabilities and the context processor as {{ capabilities }}.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db.models import Q
+
+from .lookups import bump_version, get_version
+from .models import TeamCaptain
+
+SESSION_KEY = '_capabilities'
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    is_authenticated: bool = False
+    is_staff: bool = False
+    is_admin: bool = False
+    # Has a TeamCaptain record, linked or still claimable by email
+    is_captain: bool = False
+    # team id -> league id, for teams whose captain is linked to the user
+    captained_teams: dict = field(default_factory=dict)
+    # team id -> league id, for teams whose unlinked captain has the user's email
+    claimable_teams: dict = field(default_factory=dict)
+
+    @property
+    def captained_team_ids(self):
+        return set(self.captained_teams)
+
+    def captained_team_ids_in_league(self, league_id):
+        return {team_id for team_id, team_league_id in self.captained_teams.items()
+                if team_league_id == league_id}
+
+    def can_manage_team(self, team_id):
+        return team_id in self.captained_teams or team_id in self.claimable_teams
+
+
+ANONYMOUS = Capabilities()
+
+
+def bump_captains_version():
+    bump_version('captains', 'all')
+
+
+def _load_captain_data(user):
+    """Captain records and their teams for user, in one LEFT JOIN query"""
+    rows = TeamCaptain.objects.filter(
+        Q(user=user) | Q(email=user.email, user__isnull=True)
+    ).values_list('user_id', 'captained_teams__id', 'captained_teams__league_id')
+
+    data = {'is_captain': False, 'captained_teams': {}, 'claimable_teams': {}}
+    for user_id, team_id, league_id in rows:
+        data['is_captain'] = True
+        if team_id is None:
+            continue
+        target = 'captained_teams' if user_id == user.pk else 'claimable_teams'
+        data[target][team_id] = league_id
+    return data
+
+
+def _session_captain_data(request):
+    version = get_version('captains', 'all')
+    cached = request.session.get(SESSION_KEY)
+    if cached and cached['version'] == version and cached['user_id'] == request.user.pk \
+            and cached['email'] == request.user.email:
+        data = cached['data']
+        # Sessions serialize to JSON, which turns integer keys into strings
+        return {
+            'is_captain': data['is_captain'],
+            'captained_teams': {int(k): v for k, v in data['captained_teams'].items()},
+            'claimable_teams': {int(k): v for k, v in data['claimable_teams'].items()},
+        }
+
+    data = _load_captain_data(request.user)
+    request.session[SESSION_KEY] = {
+        'version': version,
+        'user_id': request.user.pk,
+        'email': request.user.email,
+        'data': data,
+    }
+    return data
+
+
+def get_capabilities(request):
+    if hasattr(request, '_capabilities'):
+        return request._capabilities
+
+    user = request.user
+    if not user.is_authenticated:
+        capabilities = ANONYMOUS
+    else:
+        if getattr(settings, 'CAPABILITIES_SESSION_CACHE', True) and hasattr(request, 'session'):
+            data = _session_captain_data(request)
+        else:
+            data = _load_captain_data(user)
+        capabilities = Capabilities(
+            is_authenticated=True,
+            is_staff=user.is_staff,
+            is_admin=user.is_admin(),
+            **data,
+        )
+    request._capabilities = capabilities
+    return capabilities
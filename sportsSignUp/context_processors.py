@@ -0,0 +1,17 @@
+from django.utils.functional import SimpleLazyObject
+
+from .capabilities import get_capabilities
+from .notifications import unread_count
+
+
+def capabilities(request):
+    """Expose the user's capabilities to templates without resolving them up front"""
+    lazy = getattr(request, 'capabilities', None)
+    if lazy is None:
+        lazy = SimpleLazyObject(lambda: get_capabilities(request))
+    return {'capabilities': lazy}
+
+
+def notifications(request):
+    """Unread notification badge; reads the cache or the already loaded user, never the database"""
+    return {'unread_notifications': unread_count(request.user)}
@@ -0,0 +1,177 @@
+"""
+Streaming registration exports.
+
+Rows are read with QuerySet.iterator() and written out as they arrive, so
+memory stays flat however large the league is. CSV uses the csv module
+with a pseudo-buffer; XLSX is a minimal workbook (one sheet, inline
+strings) streamed through zipfile, which needs no extra dependency.
+"""
+import csv
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from .models import FormField, Registration
+from .services import filter_registrations
+
+EXPORT_CHUNK_SIZE = 2000
+
+# (header, values_list path) for the fixed columns
+EXPORT_COLUMNS = [
+    ('Registration ID', 'id'),
+    ('Registered At', 'registered_at'),
+    ('League', 'league__name'),
+    ('Division', 'division__name'),
+    ('Payment Status', 'payment_status'),
+    ('Late Registration', 'is_late_registration'),
+    ('First Name', 'player__first_name'),
+    ('Last Name', 'player__last_name'),
+    ('Parent Name', 'player__parent_name'),
+    ('Email', 'player__email'),
+    ('Phone', 'player__phone_number'),
+    ('Date of Birth', 'player__date_of_birth'),
+    ('Member', 'player__is_member'),
+    ('Membership Number', 'player__membership_number'),
+    ('Team', 'player__team__name'),
+    ('Notes', 'notes'),
+]
+
+
+def export_queryset(params):
+    """Registrations selected by the management page filters, in page order"""
+    queryset = filter_registrations(Registration.objects.all(), params)
+    if params.get('scope') == 'rosters':
+        queryset = queryset.filter(player__team__isnull=False)
+    return queryset.order_by(
+        'division_id', Coalesce('player__team_id', Value(0)), 'player__last_name', 'id'
+    )
+
+
+def custom_fields(queryset):
+    """Registration form fields of the leagues in queryset, as export columns"""
+    return list(FormField.objects.filter(
+        form__league__in=queryset.values('league_id')
+    ).order_by('form__league__name', 'order', 'id').values_list('id', 'label'))
+
+
+def export_rows(queryset):
+    """Yield the header row and then one flat row per registration"""
+    fields = custom_fields(queryset)
+    yield [header for header, _ in EXPORT_COLUMNS] + [label for _, label in fields]
+
+    paths = [path for _, path in EXPORT_COLUMNS] + ['form_response__responses']
+    for values in queryset.values_list(*paths).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        responses = values[-1] or {}
+        yield list(values[:-1]) + [responses.get(f'field_{field_id}') for field_id, _ in fields]
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, (list, tuple)):
+        return ', '.join(_cell_text(item) for item in value)
+    return str(value)
+
+
+class Echo:
+    """File-like object that hands back what is written to it"""
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow([_cell_text(value) for value in row])
+
+
+class _ZipStream:
+    """Write-only, unseekable file that collects zip output until it is drained"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Characters XML 1.0 does not allow, even escaped
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Registrations" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML_CHARS.sub('', _cell_text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def stream_xlsx(rows, flush_every=500):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_STATIC_PARTS.items():
+            workbook.writestr(name, content)
+        yield stream.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            for count, row in enumerate(rows, 1):
+                sheet.write(('<row>' + ''.join(_xlsx_cell(v) for v in row) + '</row>').encode('utf-8'))
+                if count % flush_every == 0:
+                    yield stream.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield stream.drain()
@@ -0,0 +1,240 @@
+"""
+In-process stand-in for the parts of the Stripe API this app uses.
+
+FakeStripe mirrors the stripe module's namespaces (Product, Price,
+checkout.Session, PaymentIntent, Event, Webhook, error) so it can be
+returned by get_stripe_client() in place of the real library. Nothing
+leaves the process; an optional per-call latency simulates API round-trips.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import stripe
+
+
+def _stripe_object(data):
+    return stripe.StripeObject.construct_from(data, 'sk_fake')
+
+
+def _metadata(metadata):
+    # Stripe stores metadata values as strings
+    result = {}
+    for key, value in (metadata or {}).items():
+        if value is None:
+            value = ''
+        elif isinstance(value, bool):
+            value = str(value).lower()
+        result[key] = str(value)
+    return result
+
+
+class FakeList:
+    def __init__(self, items, limit=None):
+        self._items = items
+        self.data = items[:limit] if limit else items
+        self.has_more = len(self.data) < len(items)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def auto_paging_iter(self):
+        return iter(self._items)
+
+
+class FakeStripe:
+    error = stripe.error
+
+    def __init__(self, latency=0.0, webhook_secret=''):
+        self.latency = latency
+        self.webhook_secret = webhook_secret
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.products = {}
+        self.prices = {}
+        self.sessions = {}
+        self.payment_intents = {}
+        self.events = []
+
+        self.Product = SimpleNamespace(list=self._list_products, create=self.add_product)
+        self.Price = SimpleNamespace(
+            list=self._list_prices, create=self.add_price, retrieve=self._retrieve_price
+        )
+        self.checkout = SimpleNamespace(Session=SimpleNamespace(
+            create=self._create_session, retrieve=self._retrieve_session
+        ))
+        self.PaymentIntent = SimpleNamespace(retrieve=self._retrieve_payment_intent)
+        self.Event = SimpleNamespace(list=self._list_events)
+        self.Webhook = stripe.Webhook
+
+    # Helpers for seeding and driving the fake
+
+    def add_product(self, name, id=None, active=True, description='', metadata=None):
+        self._simulate_latency()
+        with self._lock:
+            product = {
+                'id': id or self._new_id('prod'),
+                'object': 'product',
+                'name': name,
+                'description': description,
+                'active': active,
+                'metadata': _metadata(metadata),
+            }
+            self.products[product['id']] = product
+            self._record_event('product.created', product)
+        return _stripe_object(product)
+
+    def add_price(self, product, unit_amount, id=None, currency='usd', active=True,
+                  nickname=None, recurring=None, metadata=None):
+        self._simulate_latency()
+        with self._lock:
+            price = {
+                'id': id or self._new_id('price'),
+                'object': 'price',
+                'product': product,
+                'unit_amount': unit_amount,
+                'currency': currency,
+                'active': active,
+                'nickname': nickname,
+                'recurring': recurring,
+                'metadata': _metadata(metadata),
+            }
+            self.prices[price['id']] = price
+            self._record_event('price.created', price)
+        return _stripe_object(price)
+
+    def delete_price(self, id):
+        """Remove a price, as deleting or archiving it in the dashboard would"""
+        with self._lock:
+            price = self.prices.pop(id)
+            self._record_event('price.deleted', price)
+
+    def complete_checkout_session(self, session_id):
+        """
+        Simulate the customer paying for a checkout session.
+        Returns the (payload, signature header) of the signed
+        checkout.session.completed webhook Stripe would deliver.
+        """
+        with self._lock:
+            session = self._get(self.sessions, session_id)
+            payment_intent = {
+                'id': self._new_id('pi'),
+                'object': 'payment_intent',
+                'amount': session['amount_total'],
+                'currency': session['currency'],
+                'status': 'succeeded',
+                'metadata': session['metadata'],
+            }
+            self.payment_intents[payment_intent['id']] = payment_intent
+            session.update({
+                'status': 'complete',
+                'payment_status': 'paid',
+                'payment_intent': payment_intent['id'],
+            })
+            event = self._record_event('checkout.session.completed', session)
+        return self.sign_event(event)
+
+    def sign_event(self, event):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            self.webhook_secret.encode('utf-8'),
+            f"{timestamp}.{payload}".encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest()
+        return payload, f"t={timestamp},v1={signature}"
+
+    # Stripe API surface
+
+    def _list_products(self, active=None, limit=None, **kwargs):
+        self._simulate_latency()
+        products = [p for p in self.products.values() if active is None or p['active'] == active]
+        return FakeList([_stripe_object(p) for p in products], limit)
+
+    def _list_prices(self, active=None, product=None, limit=None, **kwargs):
+        self._simulate_latency()
+        prices = [
+            p for p in self.prices.values()
+            if (active is None or p['active'] == active) and (product is None or p['product'] == product)
+        ]
+        return FakeList([_stripe_object(p) for p in prices], limit)
+
+    def _retrieve_price(self, id, **kwargs):
+        self._simulate_latency()
+        return _stripe_object(self._get(self.prices, id))
+
+    def _create_session(self, line_items, success_url, cancel_url, metadata=None, mode='payment', **kwargs):
+        self._simulate_latency()
+        with self._lock:
+            amount_total = 0
+            currency = 'usd'
+            for item in line_items:
+                price = self._get(self.prices, item['price'])
+                amount_total += price['unit_amount'] * item.get('quantity', 1)
+                currency = price['currency']
+
+            session_id = self._new_id('cs_test')
+            session = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'url': f"https://checkout.stripe.fake/c/pay/{session_id}",
+                'mode': mode,
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'payment_intent': None,
+                'amount_total': amount_total,
+                'currency': currency,
+                'line_items': line_items,
+                'success_url': success_url.replace('{CHECKOUT_SESSION_ID}', session_id),
+                'cancel_url': cancel_url,
+                'metadata': _metadata(metadata),
+            }
+            self.sessions[session_id] = session
+        return _stripe_object(session)
+
+    def _retrieve_session(self, id, **kwargs):
+        self._simulate_latency()
+        return _stripe_object(self._get(self.sessions, id))
+
+    def _retrieve_payment_intent(self, id, **kwargs):
+        self._simulate_latency()
+        return _stripe_object(self._get(self.payment_intents, id))
+
+    def _list_events(self, types=None, created=None, limit=None, **kwargs):
+        self._simulate_latency()
+        since = (created or {}).get('gte', 0)
+        events = [
+            e for e in reversed(self.events)
+            if (types is None or e['type'] in types) and e['created'] >= since
+        ]
+        return FakeList([_stripe_object(e) for e in events], limit)
+
+    # Internals
+
+    def _simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _new_id(self, prefix):
+        return f"{prefix}_fake{next(self._ids):014d}"
+
+    def _get(self, store, id):
+        try:
+            return store[id]
+        except KeyError:
+            raise stripe.error.InvalidRequestError(f"No such object: '{id}'", 'id')
+
+    def _record_event(self, event_type, obj):
+        event = {
+            'id': self._new_id('evt'),
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': dict(obj)},
+        }
+        self.events.append(event)
+        return event
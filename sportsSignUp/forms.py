@@ -85,6 +85,9 @@ class TeamSignupForm(forms.ModelForm):
         self.fields['parent_name'].required = False
         self.fields['membership_number'].required = False
         self.fields['is_member'].required = False
+
+    def clean_email(self):
+        return self.cleaned_data['email'].strip().lower()
         
                     
 class CustomUserCreationForm(UserCreationForm):
@@ -0,0 +1,83 @@
+"""
+HTTP caching for public, read-mostly pages.
+
+Anonymous GETs with no session state or pending messages get an ETag and
+Last-Modified derived from the league catalog version (see lookups) and
+today's date, since which leagues are open changes daily, plus
+Cache-Control, and are answered with 304 when the client already has the
+current version. Everything else is marked private and rendered as usual.
+Responses always vary on Cookie, since logging in or picking up a flash
+message changes the page.
+"""
+import hashlib
+from datetime import datetime, time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .lookups import get_catalog_version
+
+
+def _is_cacheable(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated or not request.session.is_empty():
+        return False
+    # len() does not mark the messages as used, so they still get displayed
+    return len(messages.get_messages(request)) == 0
+
+
+def catalog_cache(max_age=60, private=False, extra_version=None):
+    """
+    Cache a public page until the league catalog changes.
+
+    private pages (e.g. ones with a CSRF token in a form) are only cached by
+    the browser, and their ETag includes the CSRF cookie so a new cookie
+    never revalidates a stale token. extra_version(request, *args, **kwargs)
+    can add view-specific state to the ETag; return None for a 404.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                response = view_func(request, *args, **kwargs)
+                patch_cache_control(response, private=True)
+                patch_vary_headers(response, ('Cookie',))
+                return response
+
+            catalog_version = get_catalog_version()
+            today = timezone.localdate()
+            parts = [f"catalog-{catalog_version}", today.isoformat()]
+            start_of_day = timezone.make_aware(datetime.combine(today, time.min)).timestamp()
+            last_modified = int(max(catalog_version // 1_000_000_000, start_of_day))
+            if extra_version is not None:
+                extra = extra_version(request, *args, **kwargs)
+                if extra is None:
+                    return view_func(request, *args, **kwargs)
+                parts.append(str(extra))
+                # Only the ETag knows about the extra state
+                last_modified = None
+            if private:
+                csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+                parts.append(hashlib.sha1(csrf_cookie.encode('utf-8')).hexdigest()[:12])
+            etag = quote_etag('-'.join(parts))
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                if last_modified is not None:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified))
+                if private:
+                    patch_cache_control(response, private=True, no_cache=True)
+                else:
+                    patch_cache_control(response, public=True, max_age=max_age)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
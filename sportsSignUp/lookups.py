@@ -0,0 +1,149 @@
+"""
+Cached league/division/team lookups for the admin dropdowns, and the
+version counters other caches key on.
+
+Every cached value is keyed on a version counter for the league or
+division it describes. Signals bump the counter when the underlying rows
+change, which orphans the old entries instead of deleting them, so a hit
+costs no queries and a miss costs one grouped query.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import FilteredRelation, Q
+
+from .models import Division, League, Team
+
+LOOKUP_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _version_key(scope, pk):
+    return f'lookups:{scope}:{pk}:version'
+
+
+def get_version(scope, pk):
+    key = _version_key(scope, pk)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so an evicted counter never reuses an old version
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(scope, pk):
+    key = _version_key(scope, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def bump_league_versions(league_ids):
+    for league_id in set(league_ids):
+        bump_version('league', league_id)
+
+
+def bump_division_versions(division_ids):
+    """Bump the divisions and every league that offers them"""
+    division_ids = set(division_ids)
+    for division_id in division_ids:
+        bump_version('division', division_id)
+    bump_league_versions(League.available_divisions.through.objects.filter(
+        division_id__in=division_ids
+    ).values_list('league_id', flat=True))
+
+
+def get_registrations_version(league_id):
+    return get_version('registrations', league_id)
+
+
+def bump_registrations_versions(league_ids):
+    """
+    Bump the leagues' registrations versions now, so a request holding the
+    league row lock sees the change, and again on commit, so nothing cached
+    from the old rows while the transaction was open outlives it.
+    """
+    league_ids = set(league_ids)
+
+    def bump():
+        for league_id in league_ids:
+            bump_version('registrations', league_id)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_catalog_version():
+    """
+    Version of the public league catalog (sports, leagues, divisions). The
+    value is the time of the last change in nanoseconds, so it doubles as a
+    Last-Modified date.
+    """
+    return get_version('catalog', 'all')
+
+
+def bump_catalog_version():
+    cache.set(_version_key('catalog', 'all'), time.time_ns(), None)
+
+
+def _cached(name, scope, pk, compute):
+    key = f'lookups:{name}:{scope}:{pk}:v{get_version(scope, pk)}'
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, LOOKUP_CACHE_TIMEOUT)
+    return value
+
+
+def _group_teams(rows, team_prefix):
+    """Fold (division, team) rows from a LEFT JOIN into divisions with team lists"""
+    divisions = {}
+    for row in rows:
+        division = divisions.setdefault(row['id'], {'id': row['id'], 'name': row['name'], 'teams': []})
+        if row[f'{team_prefix}__id'] is not None:
+            division['teams'].append({'id': row[f'{team_prefix}__id'], 'name': row[f'{team_prefix}__name']})
+    return list(divisions.values())
+
+
+def divisions_by_league(league_id):
+    return _cached('divisions', 'league', league_id, lambda: list(
+        Division.objects.filter(league_sessions__id=league_id).order_by('name', 'id').values('id', 'name')
+    ))
+
+
+def divisions_and_teams_by_league(league_id):
+    """The league's divisions, each with every team in that division"""
+    return _cached('divisions_and_teams', 'league', league_id, lambda: _group_teams(
+        Division.objects.filter(league_sessions__id=league_id)
+        .order_by('name', 'id', 'teams__name', 'teams__id')
+        .values('id', 'name', 'teams__id', 'teams__name'),
+        'teams'
+    ))
+
+
+def teams_by_league(league_id):
+    """
+    The league's divisions, each with the league's own teams in it.
+    Returns None if the league does not exist.
+    """
+    def compute():
+        rows = list(
+            Division.objects.filter(league_sessions__id=league_id)
+            .annotate(league_teams=FilteredRelation('teams', condition=Q(teams__league_id=league_id)))
+            .order_by('name', 'id', 'league_teams__name', 'league_teams__id')
+            .values('id', 'name', 'league_teams__id', 'league_teams__name')
+        )
+        if not rows and not League.objects.filter(pk=league_id).exists():
+            return None
+        return _group_teams(rows, 'league_teams')
+
+    return _cached('teams', 'league', league_id, compute)
+
+
+def teams_by_division(division_id):
+    return _cached('teams', 'division', division_id, lambda: list(
+        Team.objects.filter(division_id=division_id).order_by('name', 'id').values('id', 'name')
+    ))
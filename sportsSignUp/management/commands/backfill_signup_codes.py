@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sportsSignUp.models import Team
+
+
+class Command(BaseCommand):
+    help = "Give a signup code to every team that has none (e.g. rows written with update() or raw SQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        filled = Team.objects.assign_missing_signup_codes(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Assigned signup codes to {filled} teams"))
@@ -0,0 +1,62 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from sportsSignUp.models import Division, Player, Registration, Team
+from sportsSignUp.services import (
+    bulk_deactivate_players, bulk_mark_paid, bulk_merge_teams, bulk_move_division, bulk_refund,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a bulk operation as one UPDATE, logged to BulkOperationLog. --ids are registration ids "
+        "for mark_paid/refund/move_division, player ids for deactivate_players and team ids for merge_teams"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation', choices=[
+            'mark_paid', 'refund', 'move_division', 'deactivate_players', 'merge_teams',
+        ])
+        parser.add_argument('--ids', type=int, nargs='+', help="Rows to change")
+        parser.add_argument('--league', type=int, help="Every row in this league instead of --ids")
+        parser.add_argument('--division', type=int, help="Target division for move_division")
+        parser.add_argument('--into', type=int, help="Target team for merge_teams")
+
+    def handle(self, *args, operation, ids, league, **options):
+        if not ids and not league:
+            raise CommandError("Pass --ids or --league")
+
+        def select(queryset, league_lookup):
+            if ids:
+                queryset = queryset.filter(pk__in=ids)
+            if league:
+                queryset = queryset.filter(**{league_lookup: league})
+            return queryset
+
+        registrations = select(Registration.objects.all(), 'league_id')
+        try:
+            if operation == 'mark_paid':
+                log = bulk_mark_paid(registrations)
+            elif operation == 'refund':
+                log = bulk_refund(registrations)
+            elif operation == 'move_division':
+                log = bulk_move_division(registrations, self.get_target(Division, options['division'], '--division'))
+            elif operation == 'deactivate_players':
+                log = bulk_deactivate_players(select(Player.objects.all(), 'registrations__league_id'))
+            else:
+                log = bulk_merge_teams(select(Team.objects.all(), 'league_id'),
+                                       self.get_target(Team, options['into'], '--into'))
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{log.get_operation_display()}: {log.affected_count} rows changed (log #{log.pk})"
+        ))
+
+    def get_target(self, model, pk, option):
+        if pk is None:
+            raise CommandError(f"{option} is required for this operation")
+        try:
+            return model.objects.get(pk=pk)
+        except model.DoesNotExist:
+            raise CommandError(f"{model._meta.verbose_name.capitalize()} {pk} not found")
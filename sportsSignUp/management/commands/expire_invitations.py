@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sportsSignUp.services import EXPIRY_BATCH_SIZE, expire_invitations
+
+
+class Command(BaseCommand):
+    help = (
+        "Expire pending team invitations older than INVITATION_EXPIRY_DAYS and put their free agents "
+        "back in the pool. Works in small batches, so it is safe to run every few minutes from cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.INVITATION_EXPIRY_DAYS,
+                            help="Expire invitations pending for longer than this")
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this many batches; the next run picks up the rest")
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--days and --batch-size must be positive")
+
+        result = expire_invitations(
+            timezone.now() - timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        rate = result.expired / result.seconds if result.seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {result.expired} invitations and reset {result.agents_reset} free agents "
+            f"in {result.batches} batches, {result.seconds:.2f}s ({rate:.0f} invitations/s)"
+        ))
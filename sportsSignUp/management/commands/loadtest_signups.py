@@ -0,0 +1,134 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from sportsSignUp.fake_stripe import FakeStripe
+from sportsSignUp.models import League, Team
+from sportsSignUp.services import price_from_stripe, product_from_stripe
+from sportsSignUp.stripe_client import use_stripe_client
+
+STEPS = ('signup_page', 'checkout', 'webhook', 'success_page')
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive simulated team signups end-to-end (signup page, checkout, webhook, "
+        "success page) against the in-process fake Stripe. Writes players and "
+        "registrations, so run it against a scratch database with STRIPE_BACKEND=fake."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('signup_code', help="Signup code of the team to sign players up to")
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--latency-ms', type=float, default=0, help="Simulated Stripe API latency")
+
+    def handle(self, *args, **options):
+        if settings.STRIPE_BACKEND != 'fake':
+            raise CommandError("Refusing to run unless STRIPE_BACKEND is 'fake'")
+        try:
+            team = Team.objects.select_related('league').get(signup_code=options['signup_code'])
+        except Team.DoesNotExist:
+            raise CommandError(f"No team with signup code {options['signup_code']}")
+
+        fake = FakeStripe(latency=options['latency_ms'] / 1000)
+        with use_stripe_client(fake), self.settings_for_fake(fake):
+            created_product = self.prepare_catalog(fake, team.league)
+            try:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                    results = list(pool.map(
+                        lambda i: self.run_signup(fake, team, i),
+                        range(options['count'])
+                    ))
+                elapsed = time.perf_counter() - started
+            finally:
+                if created_product is not None:
+                    League.objects.filter(pk=team.league_id).update(stripe_product=None)
+                    created_product.delete()
+
+        failures = [r for r in results if r['error']]
+        self.stdout.write(f"{len(results)} signups in {elapsed:.2f}s "
+                          f"({len(results) / elapsed:.1f} signups/s), {len(failures)} failed")
+        for step in STEPS:
+            timings = sorted(r[step] for r in results if step in r)
+            if timings:
+                p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+                self.stdout.write(f"  {step:<13} avg {sum(timings) / len(timings) * 1000:7.1f}ms  "
+                                  f"p95 {p95 * 1000:7.1f}ms")
+        for failure in failures[:5]:
+            self.stderr.write(f"  #{failure['index']}: {failure['error']}")
+
+    def settings_for_fake(self, fake):
+        # The fake signs webhooks with this secret and the test client needs a valid host
+        fake.webhook_secret = 'whsec_loadtest'
+        return override_settings(STRIPE_WEBHOOK_SECRET=fake.webhook_secret, ALLOWED_HOSTS=['*'])
+
+    def prepare_catalog(self, fake, league):
+        """
+        Mirror the league's local prices into the fake. A league without a
+        catalog gets a temporary one, built row by row rather than synced so
+        the real catalog and the sync cursor are never touched; it is
+        returned so handle() can remove it afterwards.
+        """
+        if league.stripe_product is None:
+            stripe_product = fake.add_product(name=f"{league.name} registration")
+            product = product_from_stripe(stripe_product)
+            product.save()
+            for unit_amount, is_member in ((10000, False), (8000, True)):
+                price_from_stripe(
+                    fake.add_price(stripe_product.id, unit_amount, metadata={'is_member': is_member}),
+                    product.pk,
+                ).save()
+            League.objects.filter(pk=league.pk).update(stripe_product=product)
+            league.stripe_product = product
+            return product
+
+        product = league.stripe_product
+        fake.add_product(name=product.name, id=product.stripe_id)
+        for price in product.prices.filter(active=True):
+            fake.add_price(product.stripe_id, price.unit_amount, id=price.stripe_id,
+                           currency=price.currency, metadata=price.metadata)
+        return None
+
+    def run_signup(self, fake, team, index):
+        client = Client()
+        result = {'index': index, 'error': None}
+        signup_url = reverse('sportsSignUp:team_signup', kwargs={'signup_code': team.signup_code})
+        try:
+            started = time.perf_counter()
+            client.get(signup_url)
+            result['signup_page'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            response = client.post(signup_url, {
+                'first_name': 'Load',
+                'last_name': f'Test {index}',
+                'email': f'loadtest{index}@example.com',
+                'phone_number': '555-0100',
+                'date_of_birth': '2010-01-01',
+                'is_member': index % 2 == 0,
+            })
+            result['checkout'] = time.perf_counter() - started
+            session_id = response.get('Location', '').rsplit('/', 1)[-1]
+            if not session_id.startswith('cs_'):
+                raise RuntimeError(f"Signup did not redirect to checkout (status {response.status_code})")
+
+            payload, signature = fake.complete_checkout_session(session_id)
+            started = time.perf_counter()
+            response = client.post(reverse('sportsSignUp:stripe_webhook'), payload,
+                                   content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+            result['webhook'] = time.perf_counter() - started
+            if response.status_code != 200:
+                raise RuntimeError(f"Webhook returned {response.status_code}")
+
+            started = time.perf_counter()
+            client.get(reverse('sportsSignUp:team_signup_success') + f"?session_id={session_id}")
+            result['success_page'] = time.perf_counter() - started
+        except Exception as e:
+            result['error'] = str(e)
+        return result
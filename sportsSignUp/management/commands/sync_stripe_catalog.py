@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from sportsSignUp.services import sync_stripe_products
+
+
+class Command(BaseCommand):
+    help = "Sync Stripe products and prices into the local catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help="List the whole catalog instead of replaying events since the last sync",
+        )
+
+    def handle(self, *args, **options):
+        result = sync_stripe_products(full=options['full'])
+
+        mode = 'full' if result.full else 'incremental'
+        self.stdout.write(
+            f"{mode.capitalize()} sync: "
+            f"products {result.products_created} created / {result.products_updated} updated, "
+            f"prices {result.prices_created} created / {result.prices_updated} updated, "
+            f"{result.deactivated} deactivated, {result.skipped_prices} prices skipped"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Fetched in {result.fetch_seconds:.2f}s, written in {result.write_seconds:.2f}s "
+            f"({result.fetch_seconds + result.write_seconds:.2f}s total)"
+        ))
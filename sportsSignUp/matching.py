@@ -0,0 +1,181 @@
+"""
+Free agent matching.
+
+rank_free_agents(team) scores every available free agent in the team's
+league and returns the best K. The per-agent features (division, birth
+date, membership, invitation history) are loaded for the whole league in
+one query and cached as columns until a free agent or invitation in the
+league changes (see signals). Scoring a team is then one pass over those
+columns plus two small queries for the team's roster and invitations,
+and heapq keeps only the top K, so pools of tens of thousands rank in
+milliseconds without any numeric libraries.
+"""
+import heapq
+import statistics
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .age_groups import birth_date_range
+from .lookups import LOOKUP_CACHE_TIMEOUT, bump_version, get_version
+from .models import FreeAgent, Player, TeamInvitation
+
+DEFAULT_MATCH_LIMIT = 20
+MAX_MATCH_LIMIT = 200
+
+# Score weights; a perfect match scores 100
+WEIGHT_DIVISION = 40
+WEIGHT_AGE = 25
+WEIGHT_ROSTER_AGE = 15
+WEIGHT_MEMBER = 10
+WEIGHT_MEMBER_NEED = 10
+# Penalties for agents who have turned invitations down or are weighing others
+PENALTY_PER_DECLINE = 5
+MAX_DECLINE_PENALTY = 15
+PENALTY_PER_PENDING = 3
+
+# Days outside the age group (or from the roster's average birth date)
+# after which the age scores reach zero
+AGE_TOLERANCE_DAYS = 365
+ROSTER_AGE_SPREAD_DAYS = 5 * 365
+
+
+@dataclass(frozen=True)
+class PoolFeatures:
+    """Columns of the available free agents in a league, one entry per agent"""
+    ids: tuple
+    names: tuple
+    division_ids: tuple
+    division_names: tuple
+    birth_days: tuple
+    members: tuple
+    # Invitation history penalty, which doesn't depend on the team
+    penalties: tuple
+
+    @property
+    def member_share(self):
+        return sum(self.members) / len(self.members) if self.members else 0
+
+
+def bump_free_agent_pool_version(league_id):
+    bump_version('free_agents', league_id)
+
+
+def _load_pool_features(league_id):
+    rows = FreeAgent.objects.filter(league_id=league_id, status='AVAILABLE').annotate(
+        decline_count=Count('received_invitations', filter=Q(received_invitations__status='DECLINED')),
+        pending_count=Count('received_invitations', filter=Q(received_invitations__status='PENDING')),
+    ).order_by('id').values_list(
+        'id', 'first_name', 'last_name', 'division_id', 'division__name', 'date_of_birth',
+        'is_member', 'decline_count', 'pending_count',
+    )
+    columns = list(zip(*rows)) or [()] * 9
+    ids, first_names, last_names, division_ids, division_names, births, members, declines, pendings = columns
+    return PoolFeatures(
+        ids=ids,
+        names=tuple(f"{first} {last}" for first, last in zip(first_names, last_names)),
+        division_ids=division_ids,
+        division_names=division_names,
+        birth_days=tuple(birth.toordinal() for birth in births),
+        members=members,
+        penalties=tuple(
+            min(declined * PENALTY_PER_DECLINE, MAX_DECLINE_PENALTY) + pending * PENALTY_PER_PENDING
+            for declined, pending in zip(declines, pendings)
+        ),
+    )
+
+
+def get_pool_features(league_id):
+    key = f'matching:pool:{league_id}:v{get_version("free_agents", league_id)}'
+    features = cache.get(key)
+    if features is None:
+        features = _load_pool_features(league_id)
+        cache.set(key, features, LOOKUP_CACHE_TIMEOUT)
+    return features
+
+
+def _age_window(team):
+    """The team division's age group as birth-day ordinals (exclusive low, inclusive high)"""
+    bounds = birth_date_range(team.division.age_group, team.league.league_start_date)
+    if bounds is None:
+        return None
+    born_after, born_on_or_before = bounds
+    return (
+        born_after.toordinal() if born_after else None,
+        born_on_or_before.toordinal() if born_on_or_before else None,
+    )
+
+
+def _score_components(team, features):
+    """Per-team constants the scoring pass needs"""
+    roster = list(Player.objects.filter(team=team, is_active=True).values_list('date_of_birth', 'is_member'))
+    roster_birth_day = statistics.fmean(birth.toordinal() for birth, _ in roster) if roster else None
+    roster_member_share = sum(member for _, member in roster) / len(roster) if roster else 0
+    return {
+        'age_window': _age_window(team),
+        'roster_birth_day': roster_birth_day,
+        # Favor members while the roster has fewer of them than the pool
+        'member_need': max(0.0, features.member_share - roster_member_share),
+        # Agents this team already invited can't be invited again
+        'excluded': set(TeamInvitation.objects.filter(team=team).values_list('free_agent_id', flat=True)),
+    }
+
+
+def _age_fit(birth_day, window):
+    if window is None:
+        return 1.0
+    low, high = window
+    if low is not None and birth_day <= low:
+        distance = low - birth_day + 1
+    elif high is not None and birth_day > high:
+        distance = birth_day - high
+    else:
+        return 1.0
+    return max(0.0, 1 - distance / AGE_TOLERANCE_DAYS)
+
+
+def rank_free_agents(team, limit=DEFAULT_MATCH_LIMIT):
+    """
+    The limit best available free agents for team, best first, as dicts
+    with the agent's id, name, division and score out of 100.
+    """
+    features = get_pool_features(team.league_id)
+    components = _score_components(team, features)
+    window = components['age_window']
+    roster_birth_day = components['roster_birth_day']
+    member_bonus = WEIGHT_MEMBER + WEIGHT_MEMBER_NEED * components['member_need']
+    excluded = components['excluded']
+    division_id = team.division_id
+
+    def scores():
+        for index, (agent_id, agent_division, birth_day, member, penalty) in enumerate(zip(
+            features.ids, features.division_ids, features.birth_days, features.members, features.penalties,
+        )):
+            if agent_id in excluded:
+                continue
+            score = WEIGHT_DIVISION if agent_division == division_id else 0
+            score += WEIGHT_AGE * _age_fit(birth_day, window)
+            if roster_birth_day is None:
+                score += WEIGHT_ROSTER_AGE / 2
+            else:
+                score += WEIGHT_ROSTER_AGE * max(
+                    0.0, 1 - abs(birth_day - roster_birth_day) / ROSTER_AGE_SPREAD_DAYS
+                )
+            if member:
+                score += member_bonus
+            score -= penalty
+            # The index breaks ties towards the earliest registered agent
+            yield score, -index
+
+    return [
+        {
+            'id': features.ids[position],
+            'name': features.names[position],
+            'division': features.division_names[position],
+            'is_member': features.members[position],
+            'score': round(score, 1),
+        }
+        for score, position in ((score, -negative_index)
+                                for score, negative_index in heapq.nlargest(limit, scores()))
+    ]
@@ -0,0 +1,13 @@
+from django.utils.functional import SimpleLazyObject
+
+from .capabilities import get_capabilities
+
+
+class CapabilitiesMiddleware:
+    """Attach request.capabilities, resolved on first use"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.capabilities = SimpleLazyObject(lambda: get_capabilities(request))
+        return self.get_response(request)
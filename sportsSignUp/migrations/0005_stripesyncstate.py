@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0004_stripewebhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_event_created', models.BigIntegerField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
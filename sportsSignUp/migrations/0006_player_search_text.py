@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+from sportsSignUp.search import build_search_text
+
+TRGM_INDEX_NAME = 'sportssignup_player_search_trgm'
+
+
+def backfill_search_text(apps, schema_editor):
+    Player = apps.get_model('sportsSignUp', 'Player')
+    batch = []
+    for player in Player.objects.only(
+        'first_name', 'last_name', 'parent_name', 'email', 'phone_number'
+    ).iterator(chunk_size=2000):
+        player.search_text = build_search_text(
+            player.first_name, player.last_name, player.email, player.phone_number, player.parent_name
+        )
+        batch.append(player)
+        if len(batch) >= 2000:
+            Player.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        Player.objects.bulk_update(batch, ['search_text'])
+
+
+def create_trigram_index(apps, schema_editor):
+    # Trigram GIN indexes are PostgreSQL only; other databases scan instead
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('sportsSignUp', 'Player')._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {TRGM_INDEX_NAME} ON {table} '
+        f'USING gin (search_text gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TRGM_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0005_stripesyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:38
+
+from django.db import migrations
+from django.db.models.functions import Lower, Trim
+
+
+def normalize_player_emails(apps, schema_editor):
+    # Player.save now stores emails trimmed and lowercased
+    Player = apps.get_model('sportsSignUp', 'Player')
+    normalized = Lower(Trim('email'))
+    Player.objects.exclude(email=normalized).update(email=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0006_player_search_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_player_emails, migrations.RunPython.noop),
+    ]
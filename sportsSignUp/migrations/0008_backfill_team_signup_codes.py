@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:46
+
+from django.db import migrations
+
+from sportsSignUp.models import assign_missing_signup_codes
+
+
+def backfill_signup_codes(apps, schema_editor):
+    # Teams created with bulk_create used to skip Team.save and get no code
+    Team = apps.get_model('sportsSignUp', 'Team')
+    assign_missing_signup_codes(Team.objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0007_normalize_player_emails'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_signup_codes, migrations.RunPython.noop),
+    ]
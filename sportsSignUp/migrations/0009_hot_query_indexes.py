@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0008_backfill_team_signup_codes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='freeagent',
+            index=models.Index(fields=['league', 'status', '-created_at'], name='freeagent_pool'),
+        ),
+        migrations.AddIndex(
+            model_name='league',
+            index=models.Index(fields=['registration_start_date', 'registration_end_date'], name='league_registration_window'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['email'], name='player_email'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['league', 'division', 'payment_status'], name='registration_league_division'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['stripe_checkout_session'], name='registration_checkout_session'),
+        ),
+        migrations.AddIndex(
+            model_name='teamcaptain',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['email'], name='teamcaptain_unclaimed_email'),
+        ),
+        migrations.AddIndex(
+            model_name='teaminvitation',
+            index=models.Index(fields=['free_agent', 'status'], name='teaminvitation_agent_status'),
+        ),
+    ]
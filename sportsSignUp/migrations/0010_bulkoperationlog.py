@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkOperationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(choices=[('mark_paid', 'Mark registrations paid'), ('refund', 'Refund registrations'), ('move_division', 'Move registrations to a division'), ('deactivate_players', 'Deactivate players'), ('merge_teams', 'Merge teams')], max_length=30)),
+                ('parameters', models.JSONField(default=dict)),
+                ('affected_count', models.PositiveIntegerField(default=0)),
+                ('previous_values', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('performed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bulk_operations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
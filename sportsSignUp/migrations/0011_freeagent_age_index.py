@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0010_bulkoperationlog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='freeagent',
+            index=models.Index(fields=['league', 'status', 'date_of_birth'], name='freeagent_age'),
+        ),
+    ]
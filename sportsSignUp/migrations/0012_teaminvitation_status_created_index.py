@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0011_freeagent_age_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='teaminvitation',
+            index=models.Index(fields=['status', 'created_at'], name='teaminvitation_status_created'),
+        ),
+    ]
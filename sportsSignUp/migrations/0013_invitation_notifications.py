@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sportsSignUp', '0012_teaminvitation_status_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='teaminvitationnotification',
+            name='event',
+            field=models.CharField(choices=[('sent', 'Invitation received'), ('accepted', 'Invitation accepted')], default='sent', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='teaminvitationnotification',
+            index=models.Index(fields=['user', 'read_at'], name='notification_user_read'),
+        ),
+    ]
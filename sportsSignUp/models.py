@@ -1,13 +1,15 @@
 import json
-import random
+import secrets
 import string
 from django.db.models import Q
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.utils import timezone
 
+from .search import build_search_text
+
 class CustomUser(AbstractUser):
     """
     Extended user model to distinguish between admin users and customers
@@ -20,6 +22,8 @@ class CustomUser(AbstractUser):
     user_type = models.CharField(max_length=10, choices=USER_TYPES, default='customer')
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     date_of_birth = models.DateField(blank=True, null=True)
+    # Denormalized count of unread team_notifications (see notifications.py)
+    unread_notifications = models.PositiveIntegerField(default=0, editable=False)
     
     # Add unique related_name to avoid conflicts
     groups = models.ManyToManyField(
@@ -85,6 +89,12 @@ class TeamCaptain(models.Model):
         )
         return system_captain.id
 
+    class Meta:
+        indexes = [
+            # Unclaimed captains are looked up by email on every request
+            models.Index(fields=['email'], condition=Q(user__isnull=True), name='teamcaptain_unclaimed_email'),
+        ]
+
 class Sport(models.Model):
     """
     Represents different sports offered by the organization
@@ -152,6 +162,27 @@ class League(models.Model):
     # Additional details
     description = models.TextField(blank=True)
     max_teams = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['registration_start_date', 'registration_end_date'], name='league_registration_window'),
+        ]
+
+    @property
+    def registrations_version(self):
+        """Changes whenever the league's registrations change; drives API ETags"""
+        from .lookups import get_registrations_version
+        return get_registrations_version(self.pk)
+
+    @classmethod
+    def bump_registrations_version(cls, **filters):
+        """Invalidate cached registration listings of the matching leagues"""
+        from .lookups import bump_registrations_versions
+        if set(filters) == {'pk'}:
+            league_ids = [filters['pk']]
+        else:
+            league_ids = cls.objects.filter(**filters).values_list('pk', flat=True)
+        bump_registrations_versions(league_ids)
     
     def clean(self):
         if self.registration_start_date and self.registration_end_date:
@@ -173,26 +204,52 @@ class League(models.Model):
         """
         Get the appropriate Stripe price ID based on membership status and registration timing
         """
-        if not self.stripe_product:
-            return None
+        from .stripe_utils import get_stripe_price_id
+        return get_stripe_price_id(self, is_member, is_early_registration)
 
-        prices = self.stripe_product.prices.filter(active=True)
-        
-        # Filter based on metadata
-        for price in prices.all():
-            metadata = price.metadata
-            if (metadata.get('is_member', '').lower() == str(is_member).lower() and 
-                metadata.get('is_early_registration', '').lower() == str(is_early_registration).lower()):
-                return price.stripe_id
-                
-        return None
-
-def generate_unique_signup_code():
-    """Generate a unique signup code for teams"""
+SIGNUP_CODE_ALPHABET = string.ascii_uppercase + string.digits
+SIGNUP_CODE_LENGTH = 8
+# 36^8 codes makes a collision rare enough that a few retries always suffice
+SIGNUP_CODE_ATTEMPTS = 5
+
+def generate_signup_code():
+    """Random signup code; uniqueness is enforced by the column, not checked first"""
+    return ''.join(secrets.choice(SIGNUP_CODE_ALPHABET) for _ in range(SIGNUP_CODE_LENGTH))
+
+def assign_missing_signup_codes(teams, batch_size=500):
+    """
+    Give a code to every team in the teams queryset without one, a batch at
+    a time, retrying a batch on the rare collision. Returns how many were
+    filled. Takes a plain queryset so migrations can pass historical models.
+    """
+    filled = 0
     while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        if not Team.objects.filter(signup_code=code).exists():
-            return code
+        batch = list(teams.filter(signup_code__isnull=True).only('id')[:batch_size])
+        if not batch:
+            return filled
+        for attempt in range(SIGNUP_CODE_ATTEMPTS):
+            for team in batch:
+                team.signup_code = generate_signup_code()
+            try:
+                with transaction.atomic():
+                    teams.model._base_manager.bulk_update(batch, ['signup_code'])
+                break
+            except IntegrityError:
+                if attempt == SIGNUP_CODE_ATTEMPTS - 1:
+                    raise
+        filled += len(batch)
+
+class TeamQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for team in objs:
+            if not team.signup_code:
+                team.signup_code = generate_signup_code()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def assign_missing_signup_codes(self, batch_size=500):
+        """Give a code to every team without one. Returns how many were filled"""
+        return assign_missing_signup_codes(self, batch_size)
 
 class Team(models.Model):
     """
@@ -206,6 +263,8 @@ class Team(models.Model):
                                related_name='captained_teams')
     created_at = models.DateTimeField(auto_now_add=True)
     signup_code = models.CharField(max_length=8, unique=True, null=True, blank=True)  # Make it nullable initially
+
+    objects = TeamQuerySet.as_manager()
     
     def get_signup_url(self):
         """Generate the signup URL for this team"""
@@ -213,9 +272,23 @@ class Team(models.Model):
         return reverse('sportsSignUp:team_signup', kwargs={'signup_code': self.signup_code})
         
     def save(self, *args, **kwargs):
-        if not self.signup_code:
-            self.signup_code = generate_unique_signup_code()
-        super().save(*args, **kwargs)
+        if self.signup_code:
+            return super().save(*args, **kwargs)
+
+        # Insert with a fresh code and retry on the rare collision, instead of
+        # checking for the code first (which races and costs a query)
+        for attempt in range(SIGNUP_CODE_ATTEMPTS):
+            self.signup_code = generate_signup_code()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if attempt == SIGNUP_CODE_ATTEMPTS - 1 or not Team.objects.filter(
+                    signup_code=self.signup_code
+                ).exists():
+                    self.signup_code = None
+                    raise
+
     def clean(self):
         if self.division and self.league:
             if self.division.sport != self.league.sport:
@@ -253,6 +326,28 @@ class Player(models.Model):
     
     is_active = models.BooleanField(default=True)
 
+    # Lowercased names, email and phone digits, indexed for the admin search box
+    search_text = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['email'], name='player_email'),
+        ]
+
+    SEARCH_SOURCE_FIELDS = {'first_name', 'last_name', 'parent_name', 'email', 'phone_number'}
+
+    def save(self, *args, **kwargs):
+        # Emails are normalized once here, not on every read. Forms and the
+        # checkout fulfillment validate them, where a bad one can be reported
+        self.email = (self.email or '').strip().lower()
+        self.search_text = build_search_text(
+            self.first_name, self.last_name, self.email, self.phone_number, self.parent_name
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.SEARCH_SOURCE_FIELDS & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'search_text'}
+        super().save(*args, **kwargs)
+
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}"
     
@@ -286,6 +381,11 @@ class Registration(models.Model):
     
     class Meta:
         unique_together = ('player', 'league')  # Prevent duplicate registrations
+        indexes = [
+            models.Index(fields=['league', 'division', 'payment_status'], name='registration_league_division'),
+            # Webhook fulfillment checks whether a session was already handled
+            models.Index(fields=['stripe_checkout_session'], name='registration_checkout_session'),
+        ]
     
     def __str__(self):
         return f"{self.player.get_full_name()} - {self.league.name} ({self.payment_status})"
@@ -337,6 +437,37 @@ class StripePrice(models.Model):
         return f"{self.currency} {amount} (one-time)"
     
 
+class StripeSyncState(models.Model):
+    """
+    Cursor of the Stripe catalog sync.
+    Incremental syncs replay catalog events created since last_event_created.
+    """
+    last_event_created = models.BigIntegerField(null=True, blank=True)  # Unix timestamp
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def get_state(cls):
+        state, _ = cls.objects.get_or_create(pk=1)
+        return state
+
+    def __str__(self):
+        return f"Stripe sync state (last synced {self.last_synced_at})"
+
+
+class StripeWebhookEvent(models.Model):
+    """
+    Stripe webhook events that have already been handled.
+    Stripe retries deliveries, so each event id is only processed once.
+    """
+    stripe_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.type} ({self.stripe_id})"
+
+
 class FreeAgent(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='free_agent_profiles')
     league = models.ForeignKey(League, on_delete=models.CASCADE, related_name='free_agents')
@@ -366,6 +497,12 @@ class FreeAgent(models.Model):
 
     class Meta:
         unique_together = ['user', 'league']  # One free agent profile per league per user
+        indexes = [
+            # The free agent pool: available agents of a league, newest first
+            models.Index(fields=['league', 'status', '-created_at'], name='freeagent_pool'),
+            # The pool filtered by age group, a date_of_birth range
+            models.Index(fields=['league', 'status', 'date_of_birth'], name='freeagent_age'),
+        ]
 
 
 class TeamInvitation(models.Model):
@@ -387,15 +524,33 @@ class TeamInvitation(models.Model):
 
     class Meta:
         unique_together = ['team', 'free_agent']  # Prevent duplicate invitations
+        indexes = [
+            models.Index(fields=['free_agent', 'status'], name='teaminvitation_agent_status'),
+            # Expiry scans pending invitations oldest first
+            models.Index(fields=['status', 'created_at'], name='teaminvitation_status_created'),
+        ]
 
 class TeamInvitationNotification(models.Model):
+    EVENT_CHOICES = [
+        ('sent', 'Invitation received'),
+        ('accepted', 'Invitation accepted'),
+    ]
+
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='team_notifications')
     invitation = models.ForeignKey(TeamInvitation, on_delete=models.CASCADE, related_name='notifications')
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES, default='sent')
     created_at = models.DateTimeField(auto_now_add=True)
     read_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A user's unread notifications, for marking read and recounting
+            models.Index(fields=['user', 'read_at'], name='notification_user_read'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()} for {self.user_id} ({self.invitation_id})"
 
 class DynamicForm(models.Model):
     """Model to store form configurations for league registrations"""
@@ -462,4 +617,35 @@ class FormResponse(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Response for {self.form} by {self.user}"
\ No newline at end of file
+        return f"Response for {self.form} by {self.user}"
+
+
+class BulkOperationLog(models.Model):
+    """
+    Audit trail of bulk admin operations (see services.bulk_* functions).
+    previous_values maps each affected row's id to the value it had before.
+    """
+    OPERATION_CHOICES = [
+        ('mark_paid', 'Mark registrations paid'),
+        ('refund', 'Refund registrations'),
+        ('move_division', 'Move registrations to a division'),
+        ('deactivate_players', 'Deactivate players'),
+        ('merge_teams', 'Merge teams'),
+    ]
+
+    operation = models.CharField(max_length=30, choices=OPERATION_CHOICES)
+    performed_by = models.ForeignKey(CustomUser,
+                                     on_delete=models.SET_NULL,
+                                     null=True,
+                                     blank=True,
+                                     related_name='bulk_operations')
+    parameters = models.JSONField(default=dict)
+    affected_count = models.PositiveIntegerField(default=0)
+    previous_values = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_operation_display()} ({self.affected_count} rows, {self.created_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,101 @@
+"""
+Team invitation notifications.
+
+notify_invitations fans a batch of invitation events out to everyone who
+should hear about them with one bulk_create. Each user's unread count is
+kept on CustomUser.unread_notifications, moved with F() updates as
+notifications are created and recounted when they are marked read, and
+mirrored in the cache for the navigation badge. The badge reads the cache,
+falling back to the user row the auth middleware has already loaded, so
+it never costs a query.
+
+Changes write the new counts to the cache once they commit, and the badge
+only fills a missing entry (cache.add), so a request holding a user row
+loaded before the change can't put the old count back.
+"""
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CustomUser, TeamInvitation, TeamInvitationNotification
+
+UNREAD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _recipients(invitation_ids, event):
+    """(invitation id, user id) pairs: the free agent hears about new invitations, the captain about acceptances"""
+    rows = TeamInvitation.objects.filter(pk__in=invitation_ids).values_list(
+        'pk', 'free_agent__user_id', 'team__captain__user_id'
+    )
+    for invitation_id, free_agent_user_id, captain_user_id in rows:
+        user_id = free_agent_user_id if event == 'sent' else captain_user_id
+        # Captains without an account have no one to notify yet
+        if user_id is not None:
+            yield invitation_id, user_id
+
+
+def notify_invitations(invitations, event):
+    """Create the notifications for an event ('sent' or 'accepted') on invitations"""
+    with transaction.atomic():
+        notifications = TeamInvitationNotification.objects.bulk_create([
+            TeamInvitationNotification(user_id=user_id, invitation_id=invitation_id, event=event)
+            for invitation_id, user_id in _recipients([invitation.pk for invitation in invitations], event)
+        ])
+        # One UPDATE per distinct increment rather than one per user
+        users_by_increment = defaultdict(list)
+        for user_id, increment in Counter(n.user_id for n in notifications).items():
+            users_by_increment[increment].append(user_id)
+        for increment, user_ids in users_by_increment.items():
+            CustomUser.objects.filter(pk__in=user_ids).update(
+                unread_notifications=F('unread_notifications') + increment
+            )
+        user_ids = [user_id for user_ids in users_by_increment.values() for user_id in user_ids]
+        if user_ids:
+            transaction.on_commit(lambda: _cache_unread_counts(user_ids))
+    return notifications
+
+
+def _cache_unread_counts(user_ids):
+    cache.set_many({
+        _unread_key(user_id): count
+        for user_id, count in CustomUser.objects.filter(pk__in=user_ids).values_list('pk', 'unread_notifications')
+    }, UNREAD_CACHE_TIMEOUT)
+
+
+def unread_count(user):
+    if not user.is_authenticated:
+        return 0
+    key = _unread_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = user.unread_notifications
+        cache.add(key, count, UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def mark_read(user, notification_ids=None):
+    """
+    Mark the user's unread notifications read, or only those in
+    notification_ids. Returns how many were marked.
+    """
+    unread = TeamInvitationNotification.objects.filter(user=user, read_at__isnull=True)
+    if notification_ids is not None:
+        unread = unread.filter(pk__in=notification_ids)
+    with transaction.atomic():
+        marked = unread.update(read_at=timezone.now())
+        # Recount instead of subtracting, so a counter that ever drifted heals here
+        CustomUser.objects.filter(pk=user.pk).update(unread_notifications=Coalesce(Subquery(
+            TeamInvitationNotification.objects.filter(user=OuterRef('pk'), read_at__isnull=True)
+            .order_by().values('user').annotate(count=Count('pk')).values('count')
+        ), Value(0)))
+        transaction.on_commit(lambda: _cache_unread_counts([user.pk]))
+    user.refresh_from_db(fields=['unread_notifications'])
+    return marked
@@ -0,0 +1,106 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page is fetched with a WHERE clause on the sort key
+of the last row already seen, so deep pages cost the same as the first one.
+The sort key must be unique (end it with the primary key) and non-null.
+"""
+import base64
+import binascii
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.http import Http404
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _rows_after(aliases, values):
+    """Lexicographic (a, b, c) > (x, y, z) as a Q object"""
+    condition = Q(**{f'{aliases[-1]}__gt': values[-1]})
+    for alias, value in zip(reversed(aliases[:-1]), reversed(values[:-1])):
+        condition = Q(**{f'{alias}__gt': value}) | (Q(**{alias: value}) & condition)
+    return condition
+
+
+def keyset_paginate(queryset, keys, cursor=None, page_size=50):
+    """
+    Return the page of queryset that follows cursor, ordered by keys.
+    keys are field names or expressions, all sorted ascending. Works on
+    model and values() querysets.
+    """
+    aliases = [f'keyset_{i}' for i in range(len(keys))]
+    queryset = queryset.annotate(**{
+        alias: F(key) if isinstance(key, str) else key
+        for alias, key in zip(aliases, keys)
+    }).order_by(*aliases)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(aliases):
+            raise InvalidCursor(cursor)
+        queryset = queryset.filter(_rows_after(aliases, values))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor([
+            last[alias] if isinstance(last, dict) else getattr(last, alias)
+            for alias in aliases
+        ])
+    return KeysetPage(rows, next_cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that replaces page-number pagination with keyset pagination.
+    The template gets page_obj.next_cursor for the "load more" request.
+    """
+    paginate_by = 50
+    keyset = ('id',)
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = keyset_paginate(
+                queryset, self.keyset, self.request.GET.get(self.cursor_kwarg), page_size
+            )
+        except InvalidCursor:
+            raise Http404("Invalid page cursor")
+        return None, page, page.object_list, page.has_next
@@ -0,0 +1,177 @@
+"""
+Automatic roster placement.
+
+solve_placement(league, division) assigns every unplaced, active player
+registered in the division (Player.team is NULL) to one of the division's
+teams in the league. Players are dealt out greedily in rounds, one per
+smallest team with room, each to the team whose average age and share
+of members end up closest to the division-wide averages. It
+reads three queries and runs in O(players x teams), so divisions of
+thousands of players solve in well under a second.
+
+The result is a PlacementPlan that can be previewed as is and applied
+with apply_placement, which moves everyone in one bulk transaction.
+preview_placement also keeps the plan under the league's registrations
+version, so what gets applied is exactly what was previewed.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+
+from django.core.cache import cache
+
+from .models import Player, Registration, Team
+from .services import bulk_assign_players
+
+# How much a gap in member share counts against a gap in average age (in
+# years): a 5 point share gap weighs as much as half a year
+MEMBER_MIX_WEIGHT = 10
+
+PREVIEW_CACHE_TIMEOUT = 60 * 60
+
+
+@dataclass
+class TeamRoster:
+    id: int
+    name: str
+    size: int = 0
+    birth_day_total: int = 0
+    members: int = 0
+
+    def _imbalance(self, size, birth_day_total, members, target_birth_day, target_member_share):
+        if not size:
+            return 0
+        age_gap_years = (birth_day_total / size - target_birth_day) / 365
+        member_gap = members / size - target_member_share
+        return age_gap_years ** 2 + (MEMBER_MIX_WEIGHT * member_gap) ** 2
+
+    def cost_with(self, birth_day, is_member, target_birth_day, target_member_share):
+        """How much adding the player moves the roster away from the targets"""
+        targets = (target_birth_day, target_member_share)
+        return (
+            self._imbalance(self.size + 1, self.birth_day_total + birth_day, self.members + is_member, *targets)
+            - self._imbalance(self.size, self.birth_day_total, self.members, *targets)
+        )
+
+    def add(self, birth_day, is_member):
+        self.size += 1
+        self.birth_day_total += birth_day
+        self.members += is_member
+
+
+@dataclass
+class PlacementPlan:
+    league_id: int
+    division_id: int
+    # (player_id, team_id) pairs, in the order they were placed
+    moves: list = field(default_factory=list)
+    # Players left over because every team was full
+    unplaced: list = field(default_factory=list)
+    teams: list = field(default_factory=list)
+
+    def as_dict(self):
+        return {
+            'league_id': self.league_id,
+            'division_id': self.division_id,
+            'moves': [{'player_id': player_id, 'team_id': team_id} for player_id, team_id in self.moves],
+            'unplaced': self.unplaced,
+            'teams': [{
+                'id': team.id,
+                'name': team.name,
+                'size': team.size,
+                'members': team.members,
+                'average_birth_date': _ordinal_to_iso(team.birth_day_total / team.size) if team.size else None,
+            } for team in self.teams],
+        }
+
+
+def _ordinal_to_iso(ordinal):
+    return date.fromordinal(round(ordinal)).isoformat()
+
+
+def solve_placement(league, division, team_cap=None):
+    """
+    Plan where every unplaced player in division goes. team_cap limits the
+    roster size; with league.max_teams set, only the first max_teams teams
+    (oldest first) take players.
+    """
+    teams = Team.objects.filter(league=league, division=division).order_by('created_at', 'id')
+    if league.max_teams:
+        teams = teams[:league.max_teams]
+    rosters = {team_id: TeamRoster(team_id, name) for team_id, name in teams.values_list('id', 'name')}
+
+    for team_id, birth_date, is_member in Player.objects.filter(
+        team_id__in=list(rosters), is_active=True
+    ).values_list('team_id', 'date_of_birth', 'is_member'):
+        rosters[team_id].add(birth_date.toordinal(), is_member)
+
+    players = [
+        (player_id, birth_date.toordinal(), is_member)
+        for player_id, birth_date, is_member in Registration.objects.filter(
+            league=league, division=division, player__team__isnull=True, player__is_active=True,
+        ).order_by('player__date_of_birth', 'player_id').values_list(
+            'player_id', 'player__date_of_birth', 'player__is_member'
+        )
+    ]
+
+    plan = PlacementPlan(league.pk, division.pk, teams=list(rosters.values()))
+    everyone = len(players) + sum(roster.size for roster in rosters.values())
+    if not rosters or not players:
+        plan.unplaced = [player_id for player_id, _, _ in players]
+        return plan
+
+    target_birth_day = (
+        sum(birth_day for _, birth_day, _ in players) + sum(r.birth_day_total for r in rosters.values())
+    ) / everyone
+    target_member_share = (
+        sum(is_member for _, _, is_member in players) + sum(r.members for r in rosters.values())
+    ) / everyone
+
+    open_rosters = [r for r in rosters.values() if team_cap is None or r.size < team_cap]
+    position = 0
+    while position < len(players) and open_rosters:
+        # Deal one round: the next players (close in age, as they are sorted
+        # by birth date) to the smallest teams, one each, members first so
+        # they go where the member share is lowest
+        smallest = min(roster.size for roster in open_rosters)
+        round_rosters = [roster for roster in open_rosters if roster.size == smallest]
+        batch = players[position:position + len(round_rosters)]
+        position += len(batch)
+        for player_id, birth_day, is_member in sorted(batch, key=lambda player: not player[2]):
+            roster = min(round_rosters, key=lambda r: r.cost_with(
+                birth_day, is_member, target_birth_day, target_member_share
+            ))
+            round_rosters.remove(roster)
+            roster.add(birth_day, is_member)
+            plan.moves.append((player_id, roster.id))
+            if team_cap is not None and roster.size >= team_cap:
+                open_rosters.remove(roster)
+    plan.unplaced = [player_id for player_id, _, _ in players[position:]]
+    return plan
+
+
+def _preview_key(league_id, division_id, team_cap, version):
+    return f'placement:{league_id}:{division_id}:{team_cap}:v{version}'
+
+
+def preview_placement(league, division, team_cap=None):
+    """
+    Solve a plan and keep it for previewed_plan. Returns (version, plan);
+    the version is read before solving, so any change made meanwhile
+    makes it stale.
+    """
+    version = league.registrations_version
+    plan = solve_placement(league, division, team_cap=team_cap)
+    cache.set(_preview_key(league.pk, division.pk, team_cap, version), plan, PREVIEW_CACHE_TIMEOUT)
+    return version, plan
+
+
+def previewed_plan(league, division, team_cap, version):
+    """The plan preview_placement returned for version, or None if it is gone or stale"""
+    if str(version) != str(league.registrations_version):
+        return None
+    return cache.get(_preview_key(league.pk, division.pk, team_cap, version))
+
+
+def apply_placement(plan):
+    """Apply a plan's moves in one transaction; returns bulk_assign_players' results"""
+    return bulk_assign_players(plan.moves)
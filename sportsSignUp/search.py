@@ -0,0 +1,63 @@
+"""
+Player search.
+
+Players keep a lowercased search_text column (names, email and phone digits)
+that is rebuilt on save. On PostgreSQL the column has a pg_trgm GIN index,
+so substring matches use the index and results can be ranked by trigram
+similarity. Other databases fall back to a plain substring scan ordered by
+name, which is fine for tests and small data sets.
+"""
+import re
+
+from django.db import connection
+
+MIN_PHONE_DIGITS = 3
+
+
+def normalize_phone(value):
+    """Keep only the digits of a phone number"""
+    return re.sub(r'\D', '', value or '')
+
+
+def build_search_text(first_name, last_name, email, phone_number, parent_name=None):
+    parts = [first_name, last_name, parent_name, email, normalize_phone(phone_number)]
+    return ' '.join(part for part in parts if part).lower()
+
+
+def query_terms(query):
+    """
+    Split a search box query into lowercased terms. A query made only of
+    phone punctuation and digits is collapsed into a single digit string.
+    """
+    query = (query or '').strip().lower()
+    if not query:
+        return []
+    if re.fullmatch(r'[\d\s().+-]+', query):
+        digits = normalize_phone(query)
+        if len(digits) >= MIN_PHONE_DIGITS:
+            return [digits]
+    return query.split()
+
+
+def filter_players(queryset, query, prefix=''):
+    """
+    Filter queryset to rows whose player matches every term of query.
+    prefix is the path to Player, e.g. 'player__' for Registration.
+    """
+    for term in query_terms(query):
+        queryset = queryset.filter(**{f'{prefix}search_text__contains': term})
+    return queryset
+
+
+def rank_players(queryset, query, prefix=''):
+    """Order matching rows best match first"""
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        return queryset.annotate(
+            search_rank=TrigramSimilarity(f'{prefix}search_text', ' '.join(query_terms(query)))
+        ).order_by('-search_rank', f'{prefix}last_name', f'{prefix}first_name')
+    return queryset.order_by(f'{prefix}last_name', f'{prefix}first_name')
+
+
+def search_players(queryset, query, prefix=''):
+    return rank_players(filter_players(queryset, query, prefix), query, prefix)
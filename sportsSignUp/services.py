@@ -1,59 +1,619 @@
-import stripe
-from django.conf import settings
-from .models import StripeProduct, StripePrice
-
-stripe.api_key = settings.TEST_STRIPE_SECRET_KEY
-
-def sync_stripe_products():
-    """
-    Sync all Stripe products and their prices to Django models.
-    Returns a tuple of (products_synced, prices_synced)
-    """
-    products_synced = 0
-    prices_synced = 0
-    
-    # Fetch all active products from Stripe
-    stripe_products = stripe.Product.list(active=True)
-    
-    for stripe_product in stripe_products:
-        # Create or update product
-        product, created = StripeProduct.objects.update_or_create(
-            stripe_id=stripe_product.id,
-            defaults={
-                'name': stripe_product.name,
-                'description': stripe_product.description or '',
-                'active': stripe_product.active,
-                'metadata': stripe_product.metadata,
-            }
-        )
-        if created:
-            products_synced += 1
-        
-        # Fetch all prices for this product
-        stripe_prices = stripe.Price.list(product=stripe_product.id, active=True)
-        
-        for stripe_price in stripe_prices:
-            price_data = {
-                'product': product,
-                'currency': stripe_price.currency,
-                'unit_amount': stripe_price.unit_amount,
-                'active': stripe_price.active,
-                'metadata': stripe_price.metadata,
-                'description': stripe_price.nickname or '',
-            }
-            
-            if stripe_price.recurring:
-                price_data.update({
-                    'recurring': True,
-                    'recurring_interval': stripe_price.recurring.interval,
-                    'recurring_interval_count': stripe_price.recurring.interval_count,
-                })
-            
-            _, created = StripePrice.objects.update_or_create(
-                stripe_id=stripe_price.id,
-                defaults=price_data
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import (
+    BulkOperationLog, FormResponse, FreeAgent, League, Player, Registration, StripeProduct, StripePrice,
+    StripeSyncState, StripeWebhookEvent, Team, TeamInvitation,
+)
+from .matching import bump_free_agent_pool_version
+from .notifications import notify_invitations
+from .search import filter_players
+from .stripe_client import get_stripe_client
+from .stripe_utils import invalidate_price_index
+
+logger = logging.getLogger(__name__)
+
+# Checkout events that mean the customer has paid and can be registered
+FULFILLMENT_EVENTS = (
+    'checkout.session.completed',
+    'checkout.session.async_payment_succeeded',
+)
+
+# Catalog events replayed by incremental syncs
+CATALOG_EVENT_TYPES = [
+    'product.created', 'product.updated', 'product.deleted',
+    'price.created', 'price.updated', 'price.deleted',
+]
+# Stripe keeps events for 30 days; older cursors need a full sync
+EVENT_RETENTION_SECONDS = 29 * 24 * 60 * 60
+SYNC_BATCH_SIZE = 500
+ASSIGN_BATCH_SIZE = 500
+EXPIRY_BATCH_SIZE = 1000
+
+
+@dataclass
+class CatalogSyncResult:
+    full: bool = False
+    products_created: int = 0
+    products_updated: int = 0
+    prices_created: int = 0
+    prices_updated: int = 0
+    deactivated: int = 0
+    skipped_prices: int = 0
+    fetch_seconds: float = 0.0
+    write_seconds: float = 0.0
+
+
+def sync_stripe_products(full=False, client=None):
+    """
+    Sync Stripe products and prices to the local catalog.
+
+    The first run (or full=True) lists every active product and price with
+    auto-pagination and deactivates local rows that are no longer listed.
+    Later runs only replay catalog events created since the stored cursor.
+    Rows are written with bulk upserts. Returns a CatalogSyncResult.
+    """
+    client = client or get_stripe_client()
+    state = StripeSyncState.get_state()
+    started = int(time.time())
+    result = CatalogSyncResult()
+    result.full = (
+        full
+        or state.last_event_created is None
+        or started - state.last_event_created > EVENT_RETENTION_SECONDS
+    )
+
+    fetch_start = time.perf_counter()
+    if result.full:
+        products = {p.id: p for p in client.Product.list(active=True, limit=100).auto_paging_iter()}
+        prices = {p.id: p for p in client.Price.list(active=True, limit=100).auto_paging_iter()}
+        deleted_product_ids, deleted_price_ids = set(), set()
+        cursor = started
+    else:
+        products, prices, deleted_product_ids, deleted_price_ids, cursor = _fetch_catalog_changes(
+            client, state.last_event_created
+        )
+    result.fetch_seconds = time.perf_counter() - fetch_start
+
+    write_start = time.perf_counter()
+    with transaction.atomic():
+        result.products_created, result.products_updated = _upsert_stripe_rows(
+            StripeProduct,
+            [product_from_stripe(p) for p in products.values()],
+            ['name', 'description', 'active', 'metadata', 'updated_at'],
+        )
+
+        product_pks = dict(_existing_stripe_rows(
+            StripeProduct, {p.product for p in prices.values()}, 'pk'
+        ))
+        price_rows = []
+        for stripe_price in prices.values():
+            if stripe_price.product not in product_pks:
+                result.skipped_prices += 1
+                continue
+            price_rows.append(price_from_stripe(stripe_price, product_pks[stripe_price.product]))
+        result.prices_created, result.prices_updated = _upsert_stripe_rows(
+            StripePrice,
+            price_rows,
+            ['product', 'currency', 'unit_amount', 'active', 'description', 'recurring',
+             'recurring_interval', 'recurring_interval_count', 'metadata', 'updated_at'],
+        )
+
+        if result.full:
+            # Anything active locally that Stripe no longer lists has been archived
+            result.deactivated += StripeProduct.objects.filter(active=True).exclude(
+                stripe_id__in=list(products)
+            ).update(active=False)
+            result.deactivated += StripePrice.objects.filter(active=True).exclude(
+                stripe_id__in=list(prices)
+            ).update(active=False)
+        else:
+            result.deactivated += StripeProduct.objects.filter(
+                stripe_id__in=deleted_product_ids
+            ).update(active=False)
+            result.deactivated += StripePrice.objects.filter(
+                stripe_id__in=deleted_price_ids
+            ).update(active=False)
+
+        state.last_event_created = cursor
+        state.last_synced_at = timezone.now()
+        if result.full:
+            state.last_full_sync_at = state.last_synced_at
+        state.save()
+    result.write_seconds = time.perf_counter() - write_start
+
+    invalidate_price_index()
+    return result
+
+
+def _fetch_catalog_changes(client, since):
+    """
+    Collapse catalog events created since the cursor into the latest state of
+    each product and price. Events are listed newest first.
+    """
+    events = list(client.Event.list(
+        types=CATALOG_EVENT_TYPES,
+        created={'gte': since},
+        limit=100
+    ).auto_paging_iter())
+
+    products, prices = {}, {}
+    deleted_product_ids, deleted_price_ids = set(), set()
+    cursor = since
+    for event in reversed(events):
+        obj = event.data.object
+        is_product = event.type.startswith('product.')
+        objects = products if is_product else prices
+        deleted_ids = deleted_product_ids if is_product else deleted_price_ids
+        if event.type.endswith('.deleted'):
+            objects.pop(obj.id, None)
+            deleted_ids.add(obj.id)
+        else:
+            objects[obj.id] = obj
+        cursor = max(cursor, event.created)
+
+    return products, prices, deleted_product_ids, deleted_price_ids, cursor
+
+
+def product_from_stripe(stripe_product):
+    """Unsaved StripeProduct row for a Stripe product object"""
+    return StripeProduct(
+        stripe_id=stripe_product.id,
+        name=stripe_product.name,
+        description=stripe_product.description or '',
+        active=stripe_product.active,
+        metadata=dict(stripe_product.metadata or {}),
+    )
+
+
+def price_from_stripe(stripe_price, product_pk):
+    """Unsaved StripePrice row for a Stripe price object, under the local product product_pk"""
+    recurring = stripe_price.recurring
+    return StripePrice(
+        stripe_id=stripe_price.id,
+        product_id=product_pk,
+        currency=stripe_price.currency,
+        unit_amount=stripe_price.unit_amount or 0,
+        active=stripe_price.active,
+        description=stripe_price.nickname or '',
+        recurring=bool(recurring),
+        recurring_interval=recurring.interval if recurring else None,
+        recurring_interval_count=recurring.interval_count if recurring else None,
+        metadata=dict(stripe_price.metadata or {}),
+    )
+
+
+def _existing_stripe_rows(model, stripe_ids, *fields):
+    """Yield (stripe_id, *fields) for the rows that already exist, in batches"""
+    stripe_ids = list(stripe_ids)
+    for i in range(0, len(stripe_ids), SYNC_BATCH_SIZE):
+        yield from model.objects.filter(
+            stripe_id__in=stripe_ids[i:i + SYNC_BATCH_SIZE]
+        ).values_list('stripe_id', *fields)
+
+
+def _upsert_stripe_rows(model, rows, update_fields):
+    """Insert or update rows by stripe_id. Returns (created, updated)"""
+    if not rows:
+        return 0, 0
+    existing = sum(1 for _ in _existing_stripe_rows(model, [row.stripe_id for row in rows]))
+    model.objects.bulk_create(
+        rows,
+        batch_size=SYNC_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['stripe_id'],
+        update_fields=update_fields,
+    )
+    return len(rows) - existing, existing
+
+
+def process_stripe_event(event):
+    """
+    Handle a verified Stripe webhook event.
+    Returns True if the event was processed now, False if it was ignored or
+    had already been processed by an earlier delivery.
+    """
+    if event['type'] not in FULFILLMENT_EVENTS:
+        return False
+
+    session = event['data']['object']
+    if session.get('payment_status') != 'paid':
+        # Delayed payment methods are fulfilled on async_payment_succeeded
+        return False
+
+    with transaction.atomic():
+        _, created = StripeWebhookEvent.objects.get_or_create(
+            stripe_id=event['id'],
+            defaults={'type': event['type']}
+        )
+        if not created:
+            return False
+        fulfill_checkout_session(session)
+    return True
+
+
+def fulfill_checkout_session(session):
+    """
+    Create the Player and Registration for a paid checkout session.
+    Idempotent: if the session was already fulfilled the existing
+    registration is returned.
+    """
+    existing = Registration.objects.filter(stripe_checkout_session=session['id']).first()
+    if existing:
+        return existing
+
+    metadata = session.get('metadata') or {}
+    if metadata.get('team_id'):
+        return _fulfill_team_signup(session, metadata)
+    if metadata.get('form_response_id'):
+        return _fulfill_league_registration(session, metadata)
+
+    logger.warning(f"Checkout session {session['id']} has no registration metadata")
+    return None
+
+
+def _user_id_from_metadata(metadata):
+    user_id = metadata.get('user_id')
+    return int(user_id) if user_id else None
+
+
+def _checked_email(email, session):
+    """
+    The session's player email, normalized. The payment has already been
+    taken, so an invalid email is logged for follow-up rather than failing
+    the fulfillment (and the webhook Stripe would keep retrying).
+    """
+    email = (email or '').strip().lower()
+    try:
+        validate_email(email)
+    except ValidationError:
+        logger.warning(f"Checkout session {session['id']} has an invalid player email {email!r}")
+    return email
+
+
+def _fulfill_team_signup(session, metadata):
+    player_data = json.loads(metadata['player_data'])
+    team = Team.objects.select_related('league', 'division').get(id=metadata['team_id'])
+    invitation_id = metadata.get('invitation_id')
+
+    player = Player.objects.create(
+        first_name=player_data['first_name'],
+        last_name=player_data['last_name'],
+        email=_checked_email(player_data['email'], session),
+        phone_number=player_data['phone_number'],
+        parent_name=player_data.get('parent_name'),
+        date_of_birth=datetime.strptime(player_data['date_of_birth'], '%Y-%m-%d').date(),
+        membership_number=player_data['membership_number'],
+        is_member=player_data['is_member'],
+        team=team,
+        user_id=_user_id_from_metadata(metadata)
+    )
+
+    registration = Registration.objects.create(
+        player=player,
+        league=team.league,
+        division=team.division,
+        payment_status='paid',
+        stripe_payment_intent=session.get('payment_intent'),
+        stripe_checkout_session=session['id'],
+        is_late_registration=timezone.now().date() > team.league.early_registration_deadline
+    )
+
+    # If this was from an invitation, update the invitation and free agent status
+    if invitation_id:
+        try:
+            invitation = TeamInvitation.objects.select_related('free_agent').get(id=invitation_id)
+            invitation.status = 'ACCEPTED'
+            invitation.response_at = timezone.now()
+            invitation.save()
+
+            invitation.free_agent.status = 'JOINED'
+            invitation.free_agent.save()
+            notify_invitations([invitation], 'accepted')
+
+            # Decline other pending invitations
+            TeamInvitation.objects.filter(
+                free_agent=invitation.free_agent,
+                status='PENDING'
+            ).exclude(
+                id=invitation_id
+            ).update(
+                status='DECLINED',
+                response_at=timezone.now()
+            )
+        except TeamInvitation.DoesNotExist:
+            # Log this but don't fail the registration
+            logger.warning(f"Could not find invitation {invitation_id} for successful signup")
+
+    return registration
+
+
+def _fulfill_league_registration(session, metadata):
+    form_response = FormResponse.objects.get(id=metadata['form_response_id'])
+    responses = form_response.responses
+
+    player = Player.objects.create(
+        first_name=responses.get('first_name', ''),
+        last_name=responses.get('last_name', ''),
+        email=_checked_email(responses.get('email'), session),
+        phone_number=responses.get('phone_number', ''),
+        date_of_birth=datetime.strptime(responses.get('date_of_birth', ''), '%Y-%m-%d').date(),
+        membership_number=responses.get('membership_number', ''),
+        is_member=responses.get('is_member', False),
+        user_id=_user_id_from_metadata(metadata)
+    )
+
+    registration = Registration.objects.create(
+        player=player,
+        league_id=metadata['league_id'],
+        division_id=metadata['division_id'],
+        payment_status='paid',
+        stripe_payment_intent=session.get('payment_intent'),
+        stripe_checkout_session=session['id']
+    )
+
+    # Link the form response to the registration
+    form_response.registration = registration
+    form_response.save()
+
+    return registration
+
+
+def filter_registrations(queryset, params):
+    """
+    Apply the registration management filters (league, division, team,
+    search) from a GET-style mapping. Shared by the management page and
+    the exports so both always select the same rows.
+    """
+    filters = Q()
+    if params.get('league'):
+        filters &= Q(league_id=params['league'])
+    if params.get('division'):
+        filters &= Q(division_id=params['division'])
+    if params.get('team'):
+        filters &= Q(player__team_id=params['team'])
+    queryset = queryset.filter(filters)
+
+    search_query = params.get('search', '').strip()
+    if search_query:
+        queryset = filter_players(queryset, search_query, prefix='player__')
+    return queryset
+
+
+def bulk_assign_players(moves):
+    """
+    Move players onto teams in one transaction. moves is a list of
+    (player_id, team_id); each player's registration in the team's league
+    follows the team's division. Returns one result dict per move, in order.
+    Invalid moves are reported and skipped; the valid ones are all applied,
+    or none are. The registrations and players being moved are locked while
+    the moves are checked, so a concurrent move cannot slip in between.
+    """
+    with transaction.atomic():
+        player_ids = {player_id for player_id, _ in moves}
+        teams = Team.objects.select_related('division').in_bulk({team_id for _, team_id in moves})
+        registrations = {
+            (reg.player_id, reg.league_id): reg
+            for reg in Registration.objects.filter(
+                player_id__in=player_ids,
+                league_id__in={team.league_id for team in teams.values()}
+            ).select_related('player__team', 'division').select_for_update(of=('self', 'player')).order_by('pk')
+        }
+
+        seen = set()
+        results = []
+        players_to_update = []
+        registrations_to_update = []
+        for player_id, team_id in moves:
+            result = {'player_id': player_id, 'team_id': team_id, 'status': 'error'}
+            results.append(result)
+            team = teams.get(team_id)
+            if team is None:
+                result['error'] = f"Team {team_id} not found"
+                continue
+            if player_id in seen:
+                result['error'] = f"Player {player_id} is moved more than once"
+                continue
+            seen.add(player_id)
+            registration = registrations.get((player_id, team.league_id))
+            if registration is None:
+                result['error'] = f"No registration found for player {player_id} in league {team.league_id}"
+                continue
+
+            player = registration.player
+            changes = []
+            if player.team_id != team.id:
+                old_team = player.team.name if player.team else 'Free Agent'
+                changes.append(f"Team changed from {old_team} to {team.name}")
+                player.team = team
+                players_to_update.append(player)
+            if registration.division_id != team.division_id:
+                changes.append(f"Division changed from {registration.division.name} to {team.division.name}")
+                registration.division = team.division
+                registrations_to_update.append(registration)
+            result.update(status='success', message=" and ".join(changes))
+
+        Player.objects.bulk_update(players_to_update, ['team'], batch_size=ASSIGN_BATCH_SIZE)
+        Registration.objects.bulk_update(registrations_to_update, ['division'], batch_size=ASSIGN_BATCH_SIZE)
+        # bulk_update skips the signals that normally do this
+        if players_to_update or registrations_to_update:
+            League.bump_registrations_version(pk__in={
+                team.league_id for team in teams.values()
+            })
+
+    logger.info(f"Bulk assignment: {len(players_to_update)} players and "
+                f"{len(registrations_to_update)} registrations updated from {len(moves)} moves")
+    return results
+
+
+# Bulk admin operations. Each one reads the affected rows' previous values
+# for the audit log, then changes them with a single UPDATE, all in one
+# transaction. They take querysets, so an admin "select all" over thousands
+# of rows never loads model instances.
+
+def _log_bulk_operation(operation, performed_by, previous_values, **parameters):
+    log = BulkOperationLog.objects.create(
+        operation=operation,
+        performed_by=performed_by,
+        parameters=parameters,
+        affected_count=len(previous_values),
+        previous_values=previous_values,
+    )
+    logger.info(f"Bulk {operation}: {log.affected_count} rows by {performed_by or 'system'}")
+    return log
+
+
+def _update_registration_status(operation, registrations, status, performed_by):
+    with transaction.atomic():
+        rows = list(registrations.select_for_update().values_list('pk', 'payment_status', 'league_id'))
+        registrations.update(payment_status=status)
+        # update() skips the signals that normally do this
+        League.bump_registrations_version(pk__in={league_id for _, _, league_id in rows})
+        return _log_bulk_operation(
+            operation, performed_by, {pk: previous for pk, previous, _ in rows}, payment_status=status
+        )
+
+
+def bulk_mark_paid(registrations, performed_by=None):
+    """Mark registrations paid; ones already paid are left alone"""
+    return _update_registration_status(
+        'mark_paid', registrations.exclude(payment_status='paid'), 'paid', performed_by
+    )
+
+
+def bulk_refund(registrations, performed_by=None):
+    """
+    Mark paid registrations refunded. This only records the refund; the
+    money itself is returned from the Stripe dashboard.
+    """
+    return _update_registration_status(
+        'refund', registrations.filter(payment_status='paid'), 'refunded', performed_by
+    )
+
+
+def bulk_move_division(registrations, division, performed_by=None):
+    """
+    Move registrations to division. Every league involved must offer it, and
+    players already on a team in the league stay with their team's division.
+    """
+    registrations = registrations.exclude(division=division)
+    if registrations.exclude(league__available_divisions=division).exists():
+        raise ValidationError(f"{division.name} is not offered by every selected registration's league")
+    if registrations.filter(player__team__league=F('league')).exclude(player__team__division=division).exists():
+        raise ValidationError("Some players are on a team in another division; move their team instead")
+
+    with transaction.atomic():
+        rows = list(registrations.select_for_update().values_list('pk', 'division_id', 'league_id'))
+        registrations.update(division=division)
+        League.bump_registrations_version(pk__in={league_id for _, _, league_id in rows})
+        return _log_bulk_operation(
+            'move_division', performed_by, {pk: previous for pk, previous, _ in rows}, division_id=division.pk
+        )
+
+
+def bulk_deactivate_players(players, performed_by=None):
+    players = players.filter(is_active=True)
+    with transaction.atomic():
+        player_ids = list(players.select_for_update().values_list('pk', flat=True))
+        League.bump_registrations_version(
+            pk__in=Registration.objects.filter(player__in=players.values('pk')).values('league_id')
+        )
+        players.update(is_active=False)
+        return _log_bulk_operation('deactivate_players', performed_by, dict.fromkeys(player_ids, True))
+
+
+def bulk_merge_teams(teams, target, performed_by=None):
+    """
+    Move every player and invitation of teams onto target, then delete them.
+    The teams must all be in target's league. Players' registrations follow
+    target's division, and invitations to free agents target already invited
+    are dropped.
+    """
+    teams = teams.exclude(pk=target.pk)
+    if teams.exclude(league_id=target.league_id).exists():
+        raise ValidationError(f"Only teams in {target.league.name} can be merged into {target.name}")
+
+    with transaction.atomic():
+        source_ids = list(teams.select_for_update().values_list('pk', flat=True))
+        players = Player.objects.filter(team_id__in=source_ids)
+        previous_teams = dict(players.values_list('pk', 'team_id'))
+        Registration.objects.filter(
+            player__in=players.values('pk'), league_id=target.league_id
+        ).exclude(division_id=target.division_id).update(division_id=target.division_id)
+        players.update(team=target)
+
+        # Keep the oldest invitation to each free agent
+        invited = set(target.sent_invitations.values_list('free_agent_id', flat=True))
+        duplicates = []
+        for pk, free_agent_id in TeamInvitation.objects.filter(
+            team_id__in=source_ids
+        ).order_by('created_at', 'pk').values_list('pk', 'free_agent_id'):
+            if free_agent_id in invited:
+                duplicates.append(pk)
+            invited.add(free_agent_id)
+        TeamInvitation.objects.filter(pk__in=duplicates).delete()
+        TeamInvitation.objects.filter(team_id__in=source_ids).update(team=target)
+
+        # Still sends post_delete per team, which keeps the lookup and captain caches current
+        Team.objects.filter(pk__in=source_ids).delete()
+        League.bump_registrations_version(pk=target.league_id)
+        bump_free_agent_pool_version(target.league_id)
+        return _log_bulk_operation(
+            'merge_teams', performed_by, previous_teams, target_team_id=target.pk, merged_team_ids=source_ids
+        )
+
+
+@dataclass
+class InvitationExpiryResult:
+    expired: int = 0
+    agents_reset: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+
+def expire_invitations(older_than, batch_size=EXPIRY_BATCH_SIZE, max_batches=None):
+    """
+    Expire pending invitations created before older_than, oldest first, in
+    batches of batch_size. Each batch is its own short transaction: one
+    indexed (status, created_at) read, one UPDATE of the invitations and
+    one UPDATE putting their free agents back to AVAILABLE if nothing else
+    is pending for them. Rows another worker holds are skipped, so runs
+    can overlap safely.
+    """
+    result = InvitationExpiryResult()
+    started = time.perf_counter()
+    while max_batches is None or result.batches < max_batches:
+        with transaction.atomic():
+            rows = list(
+                TeamInvitation.objects.filter(status='PENDING', created_at__lt=older_than)
+                .order_by('created_at')
+                .select_for_update(skip_locked=True, of=('self',))
+                .values_list('pk', 'free_agent_id', 'free_agent__league_id')[:batch_size]
             )
-            if created:
-                prices_synced += 1
-    
-    return products_synced, prices_synced
+            if not rows:
+                break
+            now = timezone.now()
+            result.expired += TeamInvitation.objects.filter(
+                pk__in=[pk for pk, _, _ in rows], status='PENDING'
+            ).update(status='EXPIRED', response_at=now)
+            result.agents_reset += FreeAgent.objects.filter(
+                pk__in={free_agent_id for _, free_agent_id, _ in rows}, status='INVITED'
+            ).exclude(received_invitations__status='PENDING').update(status='AVAILABLE')
+        # update() skips the signals that keep the matching pool current
+        for league_id in {league_id for _, _, league_id in rows}:
+            bump_free_agent_pool_version(league_id)
+        result.batches += 1
+        if len(rows) < batch_size:
+            break
+    result.seconds = time.perf_counter() - started
+    logger.info(f"Expired {result.expired} invitations and reset {result.agents_reset} free agents "
+                f"in {result.batches} batches ({result.seconds:.2f}s)")
+    return result
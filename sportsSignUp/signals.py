@@ -0,0 +1,117 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .capabilities import bump_captains_version
+from .lookups import bump_catalog_version, bump_division_versions, bump_league_versions
+from .matching import bump_free_agent_pool_version
+from .models import (
+    Division, FreeAgent, League, Player, Registration, Sport, StripePrice, StripeProduct, Team, TeamCaptain,
+    TeamInvitation,
+)
+from .stripe_utils import invalidate_price_index
+
+
+@receiver([post_save, post_delete], sender=StripePrice)
+@receiver([post_save, post_delete], sender=StripeProduct)
+def stripe_catalog_changed(sender, **kwargs):
+    invalidate_price_index()
+
+
+@receiver([post_save, post_delete], sender=Registration)
+def registration_changed(sender, instance, **kwargs):
+    League.bump_registrations_version(pk=instance.league_id)
+
+
+@receiver(post_save, sender=Player)
+def player_changed(sender, instance, created, **kwargs):
+    # A new player has no registrations yet
+    if not created:
+        League.bump_registrations_version(registrations__player=instance)
+
+
+@receiver(post_save, sender=Team)
+def team_changed(sender, instance, created, **kwargs):
+    if not created:
+        League.bump_registrations_version(registrations__player__team=instance)
+
+
+@receiver(post_save, sender=Division)
+def division_changed(sender, instance, created, **kwargs):
+    if not created:
+        League.bump_registrations_version(registrations__division=instance)
+
+
+# Lookup cache versions
+
+@receiver([post_save, post_delete], sender=League)
+def league_lookups_changed(sender, instance, **kwargs):
+    bump_league_versions([instance.pk])
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Division)
+@receiver(pre_delete, sender=Division)
+def division_lookups_changed(sender, instance, **kwargs):
+    # pre_delete, while the league links still exist
+    bump_division_versions([instance.pk])
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Sport)
+def sport_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=Team)
+def remember_team_placement(sender, instance, **kwargs):
+    instance._previous_placement = None
+    if instance.pk:
+        instance._previous_placement = Team.objects.filter(pk=instance.pk).values_list(
+            'league_id', 'division_id'
+        ).first()
+
+
+@receiver([post_save, post_delete], sender=Team)
+def team_lookups_changed(sender, instance, **kwargs):
+    league_ids = {instance.league_id}
+    division_ids = {instance.division_id}
+    previous = getattr(instance, '_previous_placement', None)
+    if previous:
+        league_ids.add(previous[0])
+        division_ids.add(previous[1])
+    bump_league_versions(league_ids)
+    bump_division_versions(division_ids)
+
+
+@receiver(m2m_changed, sender=League.available_divisions.through)
+def available_divisions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    bump_catalog_version()
+    if not reverse:
+        bump_league_versions([instance.pk])
+    elif action == 'pre_clear':
+        bump_league_versions(instance.league_sessions.values_list('id', flat=True))
+    else:
+        bump_league_versions(pk_set)
+
+
+# Cached capabilities
+
+@receiver([post_save, post_delete], sender=TeamCaptain)
+@receiver([post_save, post_delete], sender=Team)
+def captains_changed(sender, **kwargs):
+    bump_captains_version()
+
+
+# Cached free agent pool features for matching
+
+@receiver([post_save, post_delete], sender=FreeAgent)
+def free_agent_changed(sender, instance, **kwargs):
+    bump_free_agent_pool_version(instance.league_id)
+
+
+@receiver([post_save, post_delete], sender=TeamInvitation)
+def invitation_changed(sender, instance, **kwargs):
+    league_id = FreeAgent.objects.filter(pk=instance.free_agent_id).values_list('league_id', flat=True).first()
+    if league_id is not None:
+        bump_free_agent_pool_version(league_id)
@@ -0,0 +1,49 @@
+"""
+Stripe client selection.
+
+Payment code calls get_stripe_client() instead of using the stripe module
+directly so the backend can be swapped. STRIPE_BACKEND='live' uses the
+Stripe API; 'fake' uses the in-process FakeStripe for load testing
+without network access.
+"""
+from contextlib import contextmanager
+
+import stripe
+from django.conf import settings
+
+stripe.api_key = settings.TEST_STRIPE_SECRET_KEY
+
+_fake_client = None
+_client_override = None
+
+
+def get_fake_stripe():
+    """Return the process-wide FakeStripe instance"""
+    global _fake_client
+    if _fake_client is None:
+        from .fake_stripe import FakeStripe
+        _fake_client = FakeStripe(
+            latency=settings.FAKE_STRIPE_LATENCY_MS / 1000,
+            webhook_secret=settings.STRIPE_WEBHOOK_SECRET,
+        )
+    return _fake_client
+
+
+def get_stripe_client():
+    if _client_override is not None:
+        return _client_override
+    if settings.STRIPE_BACKEND == 'fake':
+        return get_fake_stripe()
+    return stripe
+
+
+@contextmanager
+def use_stripe_client(client):
+    """Temporarily route all Stripe calls in this process to client"""
+    global _client_override
+    previous = _client_override
+    _client_override = client
+    try:
+        yield client
+    finally:
+        _client_override = previous
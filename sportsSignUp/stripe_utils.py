@@ -1,28 +1,82 @@
-import stripe
-from django.conf import settings
+import uuid
+from django.core.cache import cache
+from django.utils import timezone
 
-stripe.api_key = settings.TEST_STRIPE_SECRET_KEY
+# Bumped whenever the local Stripe catalog changes so every process rebuilds its index
+PRICE_INDEX_VERSION_KEY = 'stripe_price_index_version'
 
-def get_stripe_price_id(league, is_member):
+# (version, {(product_id, is_member, is_early_registration, is_late): stripe_price_id})
+_price_index = (None, {})
+
+
+def _metadata_flag(metadata, key):
+    return str(metadata.get(key, '')).lower() == 'true'
+
+
+def _build_price_index():
+    from .models import StripePrice
+
+    index = {}
+    prices = StripePrice.objects.filter(
+        active=True,
+        product__active=True
+    ).order_by('id').values_list('product_id', 'stripe_id', 'metadata')
+
+    for product_id, stripe_id, metadata in prices:
+        key = (
+            product_id,
+            _metadata_flag(metadata, 'is_member'),
+            _metadata_flag(metadata, 'is_early_registration'),
+            _metadata_flag(metadata, 'is_late'),
+        )
+        # Keep the oldest price if several share the same flags
+        index.setdefault(key, stripe_id)
+    return index
+
+
+def get_price_index():
     """
-    Fetch and determine the appropriate Stripe price ID based on membership status 
+    Return the in-process price index, rebuilding it from the synced
+    StripePrice table if the catalog changed since it was built.
     """
-    try:
-        # Fetch all prices for the product
-        prices = stripe.Price.list(
-            product=league.stripe_product_id,
-            active=True
-        )
-        
-        # Find the appropriate price based on metadata
-        for price in prices.data:
-            metadata = price.metadata
-            print(metadata)
-            if metadata.get('is_member', '').lower() == str(is_member).lower():
-                return price.id
-                
-        return 'price_1Nj6w4A4CECRU4aHIDEv90eE'
-        
-    except stripe.error.StripeError as e:
-        print(f"Stripe error: {str(e)}")
-        return None
\ No newline at end of file
+    global _price_index
+    version = cache.get(PRICE_INDEX_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(PRICE_INDEX_VERSION_KEY, version, None)
+
+    built_version, index = _price_index
+    if built_version != version:
+        index = _build_price_index()
+        _price_index = (version, index)
+    return index
+
+
+def invalidate_price_index():
+    """Force every process to rebuild its price index on the next lookup"""
+    cache.set(PRICE_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_stripe_price_id(league, is_member, is_early_registration=None, is_late=False):
+    """
+    Determine the Stripe price ID for a league registration from the local catalog.
+    Falls back to the regular price when no early/late specific price exists.
+    """
+    if not league.stripe_product_id:
+        return None
+
+    if is_early_registration is None:
+        is_early_registration = timezone.now().date() <= league.early_registration_deadline
+
+    index = get_price_index()
+    product_id = league.stripe_product_id
+    for key in (
+        (product_id, is_member, is_early_registration, is_late),
+        (product_id, is_member, is_early_registration, False),
+        (product_id, is_member, False, False),
+    ):
+        price_id = index.get(key)
+        if price_id:
+            return price_id
+
+    return None
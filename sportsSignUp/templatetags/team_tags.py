@@ -4,6 +4,30 @@ from sportsSignUp.models import TeamCaptain
 
 register = template.Library()
 
+def unclaimed_captain_emails(emails):
+    """The subset of emails that belong to unclaimed captains, in one query"""
+    emails = {email for email in emails if email}
+    if not emails:
+        return frozenset()
+    return frozenset(TeamCaptain.objects.filter(
+        email__in=emails, user__isnull=True
+    ).values_list('email', flat=True))
+
+@register.simple_tag
+def preload_unclaimed_captain_emails(items, attr='email'):
+    """
+    Look up every email on a page at once:
+        {% preload_unclaimed_captain_emails players as unclaimed %}
+        {% for player in players %}{% if player.email|teamcaptain_email_exists:unclaimed %}...
+    items may be email strings or objects with an email attribute.
+    """
+    return unclaimed_captain_emails(
+        item if isinstance(item, str) else getattr(item, attr, None) for item in items
+    )
+
 @register.filter
-def teamcaptain_email_exists(email):
-    return TeamCaptain.objects.filter(email=email, user__isnull=True).exists()
\ No newline at end of file
+def teamcaptain_email_exists(email, preloaded=None):
+    # With a preloaded set this is an in-memory check; without, one query per use
+    if preloaded is not None:
+        return email in preloaded
+    return TeamCaptain.objects.filter(email=email, user__isnull=True).exists()
@@ -1,3 +1,1543 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+import zipfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import lookups, matching, placement
+from .age_groups import birth_date_range, parse_age_group
+from . import views
+from .capabilities import Capabilities, get_capabilities
+from .context_processors import capabilities as capabilities_context
+from .context_processors import notifications as notifications_context
+from .exports import EXPORT_COLUMNS, export_queryset
+from .fake_stripe import FakeStripe
+from .models import (
+    BulkOperationLog, CustomUser, Division, DynamicForm, FormField, FormResponse, FreeAgent, League, Player,
+    Registration, Sport, StripePrice, StripeProduct, StripeSyncState, StripeWebhookEvent, Team, TeamCaptain,
+    TeamInvitation, TeamInvitationNotification,
+)
+from .notifications import mark_read, notify_invitations, unread_count
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .search import filter_players, query_terms, search_players
+from .services import (
+    bulk_assign_players, bulk_deactivate_players, bulk_mark_paid, bulk_merge_teams, bulk_move_division, bulk_refund,
+    expire_invitations, filter_registrations, sync_stripe_products,
+)
+from .stripe_client import use_stripe_client
+from .stripe_utils import get_stripe_price_id
+
+def create_league(sport, name='League', **fields):
+    today = timezone.now().date()
+    return League.objects.create(**{
+        'name': name, 'sport': sport,
+        'registration_start_date': today - timedelta(days=10),
+        'registration_end_date': today + timedelta(days=10),
+        'early_registration_deadline': today,
+        'league_start_date': today + timedelta(days=20),
+        'league_end_date': today + timedelta(days=80),
+        'regular_registration_price': 100, 'early_registration_price': 80,
+        **fields,
+    })
+
+
+def create_registrations(league, division, count, team=None, start=0, **registration_fields):
+    """count players in division, registered in league and optionally on team, in two queries"""
+    today = timezone.now().date()
+    players = Player.objects.bulk_create([
+        Player(first_name='Player', last_name=f'{start + i:05d}', email=f'player{start + i}@example.com',
+               phone_number='555', date_of_birth=today - timedelta(days=4000), team=team)
+        for i in range(count)
+    ])
+    return Registration.objects.bulk_create([
+        Registration(player=player, league=league, division=division, **registration_fields)
+        for player in players
+    ])
+
+
+class TeamCaptainEmailTagTests(TestCase):
+    template = Template(
+        "{% load team_tags %}"
+        "{% preload_unclaimed_captain_emails emails as unclaimed %}"
+        "{% for email in emails %}{% if email|teamcaptain_email_exists:unclaimed %}Y{% else %}N{% endif %}{% endfor %}"
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        TeamCaptain.objects.bulk_create([
+            TeamCaptain(first_name='Cap', last_name=str(i), email=f'captain{i}@example.com', phone_number='555')
+            for i in range(0, 100, 2)
+        ])
+
+    def render(self, count):
+        emails = [f'captain{i}@example.com' for i in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            output = self.template.render(Context({'emails': emails}))
+        return output, len(queries)
+
+    def test_constant_queries_regardless_of_list_length(self):
+        short_output, short_queries = self.render(5)
+        long_output, long_queries = self.render(100)
+        self.assertEqual(short_output, 'YNYNY')
+        self.assertEqual(long_output, 'YN' * 50)
+        self.assertEqual(short_queries, 1)
+        self.assertEqual(long_queries, 1)
+
+    def test_unpreloaded_filter_still_queries(self):
+        output = Template(
+            "{% load team_tags %}{{ email|teamcaptain_email_exists }}"
+        ).render(Context({'email': 'captain2@example.com'}))
+        self.assertEqual(output, 'True')
+
+
+class HotQueryPlanTests(TestCase):
+    """
+    Seed enough rows for the planner to care, then check the hot queries are
+    served by their indexes rather than a full table scan.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        sport = Sport.objects.create(name='Soccer')
+        division = Division.objects.create(name='U12', sport=sport)
+        leagues = League.objects.bulk_create([
+            League(
+                name=f'League {i}', sport=sport,
+                registration_start_date=today - timedelta(days=30 * i + 20),
+                registration_end_date=today - timedelta(days=30 * i - 10),
+                early_registration_deadline=today - timedelta(days=30 * i),
+                league_start_date=today - timedelta(days=30 * i - 20),
+                league_end_date=today - timedelta(days=30 * i - 80),
+                regular_registration_price=100, early_registration_price=80,
+            ) for i in range(300)
+        ])
+        cls.league = leagues[0]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'user{i}', email=f'user{i}@example.com') for i in range(2000)
+        ])
+        captains = TeamCaptain.objects.bulk_create([
+            TeamCaptain(first_name='Cap', last_name=str(i), email=f'captain{i}@example.com',
+                        phone_number='555', user=users[i] if i % 2 else None)
+            for i in range(2000)
+        ])
+        teams = Team.objects.bulk_create([
+            Team(name=f'Team {i}', league=leagues[i % 300], division=division, captain=captains[i])
+            for i in range(2000)
+        ])
+        players = Player.objects.bulk_create([
+            Player(first_name='P', last_name=str(i), email=f'player{i}@example.com',
+                   phone_number='555', date_of_birth=today - timedelta(days=4000))
+            for i in range(2000)
+        ])
+        Registration.objects.bulk_create([
+            Registration(player=players[i], league=leagues[i % 300], division=division,
+                         payment_status='paid' if i % 3 else 'pending',
+                         stripe_checkout_session=f'cs_test_{i}')
+            for i in range(2000)
+        ])
+        free_agents = FreeAgent.objects.bulk_create([
+            FreeAgent(user=users[i], league=leagues[i % 300], division=division, first_name='F',
+                      last_name=str(i), email=f'user{i}@example.com', phone_number='555',
+                      date_of_birth=today - timedelta(days=4000), membership_number='',
+                      status=('AVAILABLE', 'INVITED', 'JOINED')[i % 3])
+            for i in range(2000)
+        ])
+        TeamInvitation.objects.bulk_create([
+            TeamInvitation(team=teams[i], free_agent=free_agents[i], status=('PENDING', 'DECLINED')[i % 2])
+            for i in range(2000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def query_plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Small test tables are cheap to scan; make the planner prove an index exists
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.query_plan(queryset)
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan, plan)
+        elif connection.vendor == 'sqlite':
+            full_scans = [line for line in plan.splitlines()
+                          if re.search(r'\bSCAN\b', line) and 'INDEX' not in line]
+            self.assertEqual(full_scans, [], plan)
+        self.assertIn(index_name, plan, plan)
+
+    def test_unclaimed_captain_by_email(self):
+        self.assertUsesIndex(
+            TeamCaptain.objects.filter(email='captain10@example.com', user__isnull=True),
+            'teamcaptain_unclaimed_email'
+        )
+
+    def test_player_by_email(self):
+        self.assertUsesIndex(Player.objects.filter(email='player10@example.com'), 'player_email')
+
+    def test_free_agent_pool(self):
+        self.assertUsesIndex(
+            FreeAgent.objects.filter(league=self.league, status='AVAILABLE').order_by('-created_at'),
+            'freeagent_pool'
+        )
+
+    def test_invitations_of_free_agent(self):
+        free_agent = FreeAgent.objects.first()
+        self.assertUsesIndex(
+            TeamInvitation.objects.filter(free_agent=free_agent, status='PENDING'),
+            'teaminvitation_agent_status'
+        )
+
+    def test_active_leagues(self):
+        today = timezone.now().date()
+        self.assertUsesIndex(
+            League.objects.filter(registration_start_date__lte=today, registration_end_date__gte=today),
+            'league_registration_window'
+        )
+
+    def test_registrations_by_division_and_status(self):
+        self.assertUsesIndex(
+            Registration.objects.filter(league=self.league, division_id=1, payment_status='paid'),
+            'registration_league_division'
+        )
+
+    def test_registration_by_checkout_session(self):
+        self.assertUsesIndex(
+            Registration.objects.filter(stripe_checkout_session='cs_test_123'),
+            'registration_checkout_session'
+        )
+
+
+class AdminQueryCountTests(TestCase):
+    """
+    Admin pages should cost the same number of queries with a handful of
+    rows as with 10k, i.e. nothing is looked up per row.
+    """
+    changelists = [
+        'division', 'customuser', 'league', 'registration', 'teamcaptain', 'team', 'player',
+        'stripeproduct', 'stripeprice', 'dynamicform', 'formresponse',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = CustomUser.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.sport = Sport.objects.create(name='Soccer')
+        cls.product = StripeProduct.objects.create(stripe_id='prod_0', name='Product 0')
+        cls.seed(0, 3)
+
+    @classmethod
+    def seed(cls, start, count):
+        today = timezone.now().date()
+        sport = cls.sport
+        league_count = max(count // 50, 1)
+        divisions = Division.objects.bulk_create([
+            Division(name=f'Division {start + i}', sport=sport) for i in range(league_count)
+        ])
+        leagues = League.objects.bulk_create([
+            League(name=f'League {start + i}', sport=sport,
+                   registration_start_date=today, registration_end_date=today,
+                   early_registration_deadline=today, league_start_date=today, league_end_date=today,
+                   regular_registration_price=100, early_registration_price=80)
+            for i in range(league_count)
+        ])
+        League.available_divisions.through.objects.bulk_create([
+            League.available_divisions.through(league=league, division=division)
+            for league, division in zip(leagues, divisions)
+        ])
+        forms = DynamicForm.objects.bulk_create([
+            DynamicForm(league=league, title=f'Form {league.name}') for league in leagues
+        ])
+        FormField.objects.bulk_create([
+            FormField(form=form, label=f'Question {i}', field_type='text', order=i)
+            for form in forms for i in range(3)
+        ])
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'user{start + i}', email=f'user{start + i}@example.com') for i in range(count)
+        ])
+        captains = TeamCaptain.objects.bulk_create([
+            TeamCaptain(first_name='Cap', last_name=str(start + i), email=f'captain{start + i}@example.com',
+                        phone_number='555', user=users[i])
+            for i in range(count)
+        ])
+        teams = Team.objects.bulk_create([
+            Team(name=f'Team {start + i}', league=leagues[i % league_count],
+                 division=divisions[i % league_count], captain=captains[i])
+            for i in range(count)
+        ])
+        players = Player.objects.bulk_create([
+            Player(first_name='P', last_name=str(start + i), email=f'player{start + i}@example.com',
+                   phone_number='555', date_of_birth=today - timedelta(days=4000), team=teams[i])
+            for i in range(count)
+        ])
+        registrations = Registration.objects.bulk_create([
+            Registration(player=players[i], league=leagues[i % league_count],
+                         division=divisions[i % league_count])
+            for i in range(count)
+        ])
+        FormResponse.objects.bulk_create([
+            FormResponse(form=forms[i % league_count], user=users[i], registration=registrations[i],
+                         responses={})
+            for i in range(count)
+        ])
+        StripePrice.objects.bulk_create([
+            StripePrice(stripe_id=f'price_{start + i}', product=cls.product, currency='usd', unit_amount=1000)
+            for i in range(count)
+        ])
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def admin_urls(self):
+        urls = [reverse(f'admin:sportsSignUp_{name}_changelist') for name in self.changelists]
+        # Edit pages render every FK/M2M dropdown
+        for model in (Team, Player, League, Registration, FormResponse, CustomUser):
+            obj = model.objects.order_by('pk').first()
+            urls.append(reverse(f'admin:sportsSignUp_{model._meta.model_name}_change', args=[obj.pk]))
+        return urls
+
+    def test_constant_queries_at_10k_rows(self):
+        self.client.force_login(self.admin_user)
+        urls = self.admin_urls()
+        for url in urls:
+            # Warm the content type cache
+            self.count_queries(url)
+        small = {url: self.count_queries(url) for url in urls}
+        self.seed(100, 10_000)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
+
+
+class RegistrationsVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=self.sport)
+        self.league = create_league(self.sport)
+
+    def register(self):
+        player = Player.objects.create(first_name='P', last_name='1', email='p1@example.com',
+                                       phone_number='555', date_of_birth=timezone.now().date())
+        return Registration.objects.create(player=player, league=self.league, division=self.division)
+
+    def test_registration_changes_bump_version(self):
+        before = self.league.registrations_version
+        self.register()
+        self.assertNotEqual(self.league.registrations_version, before)
+
+    def test_saving_a_stale_league_keeps_version(self):
+        stale = League.objects.get(pk=self.league.pk)
+        self.register()
+        League.bump_registrations_version(pk=self.league.pk)
+        version = self.league.registrations_version
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.league.registrations_version, version)
+
+    def test_etag_changes_with_registrations(self):
+        url = reverse('sportsSignUp:get_registrations_by_league', args=[self.league.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.register()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_player_with_legacy_email_still_saves(self):
+        player = Player.objects.create(first_name='P', last_name='1', email='', phone_number='555',
+                                       date_of_birth=timezone.now().date())
+        player.email = '  Not An Email '
+        player.save()
+        player.refresh_from_db()
+        self.assertEqual(player.email, 'not an email')
+
+
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        division = Division.objects.create(name='U12', sport=sport)
+        league = create_league(sport)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=league, division=division, captain=captain)
+        self.fake = FakeStripe(webhook_secret='whsec_test')
+        product = self.fake.add_product(name='Registration')
+        self.price = self.fake.add_price(product.id, 10000)
+        settings = override_settings(STRIPE_WEBHOOK_SECRET=self.fake.webhook_secret)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def paid_session_event(self, team_id=None):
+        session = self.fake.checkout.Session.create(
+            line_items=[{'price': self.price.id, 'quantity': 1}],
+            success_url='https://example.com/success', cancel_url='https://example.com/cancel',
+            metadata={
+                'team_id': team_id or self.team.pk,
+                'player_data': json.dumps({
+                    'first_name': 'Pat', 'last_name': 'Player', 'email': 'pat@example.com',
+                    'phone_number': '555', 'date_of_birth': '2012-05-01',
+                    'membership_number': '', 'is_member': False,
+                }),
+            },
+        )
+        return self.fake.complete_checkout_session(session.id)
+
+    def post(self, payload, signature):
+        return self.client.post(reverse('sportsSignUp:stripe_webhook'), payload,
+                                content_type='application/json', HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_duplicate_delivery_is_fulfilled_once(self):
+        payload, signature = self.paid_session_event()
+        self.assertEqual(self.post(payload, signature).status_code, 200)
+        self.assertEqual(self.post(payload, signature).status_code, 200)
+        self.assertEqual(Registration.objects.count(), 1)
+        self.assertEqual(Player.objects.get().team, self.team)
+        self.assertEqual(StripeWebhookEvent.objects.count(), 1)
+
+    def test_bad_signature_is_rejected(self):
+        payload, signature = self.paid_session_event()
+        with self.assertLogs('sportsSignUp.views', 'WARNING'):
+            self.assertEqual(self.post(payload, signature.replace('v1=', 'v1=0')).status_code, 400)
+            self.assertEqual(self.post(payload, '').status_code, 400)
+        self.assertFalse(Registration.objects.exists())
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+    def test_failed_fulfillment_rolls_back_event(self):
+        payload, signature = self.paid_session_event(team_id=self.team.pk + 1000)
+        with self.assertLogs('sportsSignUp.views', 'ERROR'):
+            self.assertEqual(self.post(payload, signature).status_code, 500)
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+        self.assertFalse(Player.objects.exists())
+
+
+class StripeCatalogSyncTests(TestCase):
+    def setUp(self):
+        self.fake = FakeStripe()
+        self.product = self.fake.add_product(name='Fall registration')
+        self.regular = self.fake.add_price(self.product.id, 10000, metadata={'is_member': False})
+        self.member = self.fake.add_price(self.product.id, 8000, metadata={'is_member': True})
+
+    def sync(self, **kwargs):
+        with use_stripe_client(self.fake):
+            return sync_stripe_products(**kwargs)
+
+    def test_first_sync_is_full(self):
+        StripeProduct.objects.create(stripe_id='prod_gone', name='Archived')
+        result = self.sync()
+        self.assertTrue(result.full)
+        self.assertEqual((result.products_created, result.prices_created, result.deactivated), (1, 2, 1))
+        price = StripePrice.objects.get(stripe_id=self.member.id)
+        self.assertEqual((price.product.stripe_id, price.unit_amount), (self.product.id, 8000))
+        self.assertEqual(price.metadata, {'is_member': 'true'})
+        self.assertFalse(StripeProduct.objects.get(stripe_id='prod_gone').active)
+        self.assertIsNotNone(StripeSyncState.get_state().last_full_sync_at)
+
+    def test_incremental_sync_replays_events_since_cursor(self):
+        self.sync()
+        late = self.fake.add_price(self.product.id, 12000)
+        result = self.sync()
+        self.assertFalse(result.full)
+        self.assertEqual(result.prices_created, 1)
+        self.assertEqual(StripePrice.objects.get(stripe_id=late.id).unit_amount, 12000)
+        # Replaying the same events again changes nothing new
+        self.assertEqual(self.sync().prices_created, 0)
+        self.assertEqual(StripePrice.objects.count(), 3)
+
+    def test_deleted_prices_are_deactivated(self):
+        self.sync()
+        self.fake.delete_price(self.member.id)
+        result = self.sync()
+        self.assertFalse(result.full)
+        self.assertEqual(result.deactivated, 1)
+        self.assertFalse(StripePrice.objects.get(stripe_id=self.member.id).active)
+        self.assertTrue(StripePrice.objects.get(stripe_id=self.regular.id).active)
+
+    def test_full_sync_deactivates_prices_stripe_no_longer_lists(self):
+        self.sync()
+        self.fake.prices[self.regular.id]['active'] = False
+        result = self.sync(full=True)
+        self.assertEqual(result.deactivated, 1)
+        self.assertFalse(StripePrice.objects.get(stripe_id=self.regular.id).active)
+
+
+class BulkOperationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin_user = CustomUser.objects.create(username='admin', is_staff=True, is_superuser=True)
+        sport = Sport.objects.create(name='Soccer')
+        self.u12 = Division.objects.create(name='U12', sport=sport)
+        self.u14 = Division.objects.create(name='U14', sport=sport)
+        self.other = Division.objects.create(name='U16', sport=sport)
+        self.league = create_league(sport)
+        self.league.available_divisions.add(self.u12, self.u14)
+        self.teams = [
+            Team.objects.create(
+                name=f'Team {i}', league=self.league, division=self.u12 if i < 2 else self.u14,
+                captain=TeamCaptain.objects.create(first_name='Cap', last_name=str(i),
+                                                   email=f'cap{i}@example.com', phone_number='555'),
+            ) for i in range(3)
+        ]
+        self.players = [
+            Player.objects.create(first_name='P', last_name=str(i), email=f'p{i}@example.com',
+                                  phone_number='555', date_of_birth=timezone.now().date(),
+                                  team=self.teams[i % 3] if i < 3 else None)
+            for i in range(6)
+        ]
+        self.registrations = [
+            Registration.objects.create(player=player, league=self.league,
+                                        division=player.team.division if player.team else self.u12,
+                                        payment_status='paid' if i % 2 else 'pending')
+            for i, player in enumerate(self.players)
+        ]
+
+    def free_agent(self, i):
+        user = CustomUser.objects.create(username=f'agent{i}', email=f'f{i}@example.com')
+        return FreeAgent.objects.create(
+            user=user, league=self.league, division=self.u12, first_name='F', last_name=str(i),
+            email=f'f{i}@example.com', phone_number='555', date_of_birth=timezone.now().date(),
+        )
+
+    def test_mark_paid_logs_previous_status(self):
+        log = bulk_mark_paid(Registration.objects.all(), performed_by=self.admin_user)
+        log.refresh_from_db()
+        pending = [r.pk for r in self.registrations if r.payment_status == 'pending']
+        self.assertEqual(log.operation, 'mark_paid')
+        self.assertEqual(log.performed_by, self.admin_user)
+        self.assertEqual(log.affected_count, len(pending))
+        self.assertEqual(log.previous_values, {str(pk): 'pending' for pk in pending})
+        self.assertEqual(log.parameters, {'payment_status': 'paid'})
+        self.assertFalse(Registration.objects.exclude(payment_status='paid').exists())
+
+    def test_refund_only_touches_paid(self):
+        paid = [r.pk for r in self.registrations if r.payment_status == 'paid']
+        log = bulk_refund(Registration.objects.all())
+        log.refresh_from_db()
+        self.assertEqual(log.previous_values, {str(pk): 'paid' for pk in paid})
+        self.assertEqual(set(Registration.objects.filter(payment_status='refunded').values_list('pk', flat=True)),
+                         set(paid))
+        self.assertEqual(Registration.objects.filter(payment_status='pending').count(), 3)
+
+    def test_move_division(self):
+        unplaced = Registration.objects.filter(player__team__isnull=True)
+        log = bulk_move_division(unplaced, self.u14)
+        log.refresh_from_db()
+        self.assertEqual(log.affected_count, 3)
+        self.assertEqual(set(log.previous_values.values()), {self.u12.pk})
+        self.assertEqual(log.parameters, {'division_id': self.u14.pk})
+        self.assertFalse(unplaced.exclude(division=self.u14).exists())
+
+    def test_move_division_rejects_division_outside_league(self):
+        with self.assertRaises(ValidationError):
+            bulk_move_division(Registration.objects.filter(player__team__isnull=True), self.other)
+        self.assertFalse(Registration.objects.filter(division=self.other).exists())
+        self.assertFalse(BulkOperationLog.objects.exists())
+
+    def test_move_division_rejects_players_on_teams(self):
+        with self.assertRaises(ValidationError):
+            bulk_move_division(Registration.objects.filter(player=self.players[0]), self.u14)
+
+    def test_deactivate_players(self):
+        log = bulk_deactivate_players(Player.objects.filter(team__isnull=True))
+        log.refresh_from_db()
+        self.assertEqual(log.affected_count, 3)
+        self.assertEqual(Player.objects.filter(is_active=False).count(), 3)
+        # Already inactive players are not logged again
+        self.assertEqual(bulk_deactivate_players(Player.objects.all()).affected_count, 3)
+
+    def test_merge_moves_players_and_invitations(self):
+        target, source, other_division = self.teams
+        agents = [self.free_agent(i) for i in range(3)]
+        TeamInvitation.objects.create(team=target, free_agent=agents[0])
+        TeamInvitation.objects.create(team=source, free_agent=agents[0])
+        TeamInvitation.objects.create(team=source, free_agent=agents[1])
+        TeamInvitation.objects.create(team=other_division, free_agent=agents[1])
+        TeamInvitation.objects.create(team=other_division, free_agent=agents[2])
+
+        log = bulk_merge_teams(Team.objects.filter(pk__in=[source.pk, other_division.pk]), target,
+                               performed_by=self.admin_user)
+        log.refresh_from_db()
+
+        self.assertEqual(list(Team.objects.values_list('pk', flat=True)), [target.pk])
+        self.assertEqual(Player.objects.filter(team=target).count(), 3)
+        self.assertEqual(log.previous_values, {
+            str(self.players[1].pk): source.pk, str(self.players[2].pk): other_division.pk,
+        })
+        self.assertEqual(log.parameters, {'target_team_id': target.pk,
+                                          'merged_team_ids': [source.pk, other_division.pk]})
+        # Registrations follow the target's division
+        self.assertEqual(Registration.objects.get(player=self.players[2]).division, self.u12)
+        # One invitation per free agent survives
+        self.assertEqual(sorted(target.sent_invitations.values_list('free_agent_id', flat=True)),
+                         [agent.pk for agent in agents])
+
+    def test_merge_rejects_teams_from_other_leagues(self):
+        other_league = create_league(self.league.sport, name='Other')
+        outsider = Team.objects.create(name='Outsider', league=other_league, division=self.u12,
+                                       captain=self.teams[0].captain)
+        with self.assertRaises(ValidationError):
+            bulk_merge_teams(Team.objects.filter(pk=outsider.pk), self.teams[0])
+        self.assertTrue(Team.objects.filter(pk=outsider.pk).exists())
+
+
+class PlacementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=self.sport)
+        self.league = create_league(self.sport)
+        self.league.available_divisions.add(self.division)
+        self.teams = [self.create_team(i) for i in range(4)]
+
+    def create_team(self, i):
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name=str(i), email=f'cap{i}@example.com',
+                                             phone_number='555')
+        return Team.objects.create(name=f'Team {i}', league=self.league, division=self.division, captain=captain)
+
+    def register_players(self, count, team=None):
+        today = timezone.now().date()
+        players = Player.objects.bulk_create([
+            Player(first_name='P', last_name=str(i), email=f'p{i}@example.com', phone_number='555',
+                   date_of_birth=today - timedelta(days=4000 + 37 * i), is_member=i % 3 == 0, team=team)
+            for i in range(count)
+        ])
+        Registration.objects.bulk_create([
+            Registration(player=player, league=self.league, division=self.division) for player in players
+        ])
+        return players
+
+    def test_places_everyone_evenly(self):
+        self.register_players(3, team=self.teams[0])
+        self.register_players(22)
+        plan = placement.solve_placement(self.league, self.division)
+        self.assertEqual(len(plan.moves), 22)
+        self.assertEqual(plan.unplaced, [])
+        sizes = [team.size for team in plan.teams]
+        self.assertEqual(sum(sizes), 25)
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_team_cap_leaves_the_rest_unplaced(self):
+        players = self.register_players(30)
+        plan = placement.solve_placement(self.league, self.division, team_cap=5)
+        self.assertEqual([team.size for team in plan.teams], [5, 5, 5, 5])
+        self.assertEqual(len(plan.unplaced), 10)
+        self.assertEqual(set(plan.unplaced) | {player_id for player_id, _ in plan.moves},
+                         {player.pk for player in players})
+
+    def test_max_teams_uses_oldest_teams(self):
+        self.league.max_teams = 2
+        self.league.save()
+        self.register_players(10)
+        plan = placement.solve_placement(self.league, self.division)
+        self.assertEqual({team_id for _, team_id in plan.moves}, {self.teams[0].pk, self.teams[1].pk})
+
+    def test_apply_uses_the_previewed_plan(self):
+        admin_user = CustomUser.objects.create(username='admin', is_staff=True)
+        self.client.force_login(admin_user)
+        self.register_players(8)
+        url = reverse('sportsSignUp:league_placement', args=[self.league.pk])
+        preview = self.client.get(url, {'division': self.division.pk}).json()
+        # A team created after the preview isn't part of the previewed plan
+        self.create_team(4)
+
+        response = self.client.post(url, {'division': self.division.pk, 'version': preview['version']})
+        self.assertEqual(response.json()['updated'], 8)
+        self.assertEqual(
+            sorted(Player.objects.values_list('pk', 'team_id')),
+            sorted((move['player_id'], move['team_id']) for move in preview['plan']['moves']),
+        )
+        # The moves changed the registrations, so the same preview is now stale
+        response = self.client.post(url, {'division': self.division.pk, 'version': preview['version']})
+        self.assertEqual(response.status_code, 409)
+
+
+class FreeAgentMatchingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.u12 = Division.objects.create(name='U12', sport=sport, age_group='U12')
+        self.u14 = Division.objects.create(name='U14', sport=sport, age_group='U14')
+        self.league = create_league(sport)
+        self.league.available_divisions.add(self.u12, self.u14)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.u12, captain=captain)
+        self.in_age = self.league.league_start_date - timedelta(days=10 * 365)
+
+    def free_agent(self, name, division=None, date_of_birth=None):
+        user = CustomUser.objects.create(username=name, email=f'{name}@example.com')
+        return FreeAgent.objects.create(
+            user=user, league=self.league, division=division or self.u12, first_name=name, last_name='Agent',
+            email=f'{name}@example.com', phone_number='555', date_of_birth=date_of_birth or self.in_age,
+        )
+
+    def ranked_ids(self):
+        return [match['id'] for match in matching.rank_free_agents(self.team)]
+
+    def test_division_fit_ranks_first(self):
+        other = self.free_agent('other', division=self.u14)
+        same = self.free_agent('same')
+        self.assertEqual(self.ranked_ids(), [same.pk, other.pk])
+
+    def test_age_fit_ranks_first(self):
+        too_old = self.free_agent('old', date_of_birth=self.in_age - timedelta(days=5 * 365))
+        in_age = self.free_agent('young')
+        self.assertEqual(self.ranked_ids(), [in_age.pk, too_old.pk])
+
+    def test_already_invited_agents_are_excluded(self):
+        invited = self.free_agent('invited')
+        available = self.free_agent('available')
+        TeamInvitation.objects.create(team=self.team, free_agent=invited)
+        self.assertEqual(self.ranked_ids(), [available.pk])
+
+    def test_free_agent_changes_refresh_cached_pool(self):
+        first = self.free_agent('first')
+        self.assertEqual(self.ranked_ids(), [first.pk])
+        second = self.free_agent('second')
+        self.assertEqual(self.ranked_ids(), [first.pk, second.pk])
+        first.status = 'JOINED'
+        first.save()
+        self.assertEqual(self.ranked_ids(), [second.pk])
+
+    def test_invitation_changes_refresh_cached_pool(self):
+        first = self.free_agent('first')
+        second = self.free_agent('second')
+        self.assertEqual(self.ranked_ids(), [first.pk, second.pk])
+        other_team = Team.objects.create(name='Blues', league=self.league, division=self.u12,
+                                         captain=self.team.captain)
+        invitation = TeamInvitation.objects.create(team=other_team, free_agent=first)
+        # Weighing another team's invitation costs a little
+        self.assertEqual(self.ranked_ids(), [second.pk, first.pk])
+        invitation.status = 'DECLINED'
+        invitation.save()
+        penalty = matching.get_pool_features(self.league.pk).penalties[0]
+        self.assertEqual(penalty, matching.PENALTY_PER_DECLINE)
+
+
+class InvitationNotificationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        division = Division.objects.create(name='U12', sport=sport)
+        self.league = create_league(sport)
+        self.captain_user = CustomUser.objects.create(username='captain', email='cap@example.com')
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555', user=self.captain_user)
+        self.teams = [
+            Team.objects.create(name=f'Team {i}', league=self.league, division=division, captain=captain)
+            for i in range(3)
+        ]
+        self.agents = []
+        for i in range(2):
+            user = CustomUser.objects.create(username=f'agent{i}', email=f'agent{i}@example.com')
+            self.agents.append(FreeAgent.objects.create(
+                user=user, league=self.league, division=division, first_name='F', last_name=str(i),
+                email=user.email, phone_number='555', date_of_birth=timezone.now().date(),
+            ))
+
+    def invite(self, team, agent):
+        return TeamInvitation.objects.create(team=team, free_agent=agent)
+
+    def counter(self, user):
+        return CustomUser.objects.get(pk=user.pk).unread_notifications
+
+    def test_fan_out_counts(self):
+        first, second = self.agents
+        invitations = [self.invite(team, first) for team in self.teams] + [self.invite(self.teams[0], second)]
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_invitations(invitations, 'sent')
+        self.assertEqual(self.counter(first.user), 3)
+        self.assertEqual(self.counter(second.user), 1)
+        self.assertEqual(self.counter(self.captain_user), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_invitations(invitations[:2], 'accepted')
+        self.assertEqual(self.counter(self.captain_user), 2)
+        self.assertEqual(TeamInvitationNotification.objects.filter(user=self.captain_user, event='accepted').count(), 2)
+
+    def test_mark_read_recounts(self):
+        user = self.agents[0].user
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_invitations([self.invite(team, self.agents[0]) for team in self.teams], 'sent')
+        # A drifted counter is corrected by the recount
+        CustomUser.objects.filter(pk=user.pk).update(unread_notifications=99)
+        first = TeamInvitationNotification.objects.filter(user=user).order_by('pk').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_read(user, [first.pk]), 1)
+        self.assertEqual(self.counter(user), 2)
+        self.assertEqual(unread_count(user), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_read(user), 2)
+        self.assertEqual((self.counter(user), unread_count(user)), (0, 0))
+
+    def test_stale_user_row_does_not_overwrite_new_count(self):
+        user = self.agents[0].user
+        stale = CustomUser.objects.get(pk=user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_invitations([self.invite(self.teams[0], self.agents[0])], 'sent')
+        self.assertEqual(stale.unread_notifications, 0)
+        self.assertEqual(unread_count(stale), 1)
+
+    def test_context_processor_runs_no_queries(self):
+        request = RequestFactory().get('/')
+        request.user = CustomUser.objects.get(pk=self.agents[0].user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications_context(request), {'unread_notifications': 0})
+            # Served from the cache the second time
+            self.assertEqual(notifications_context(request), {'unread_notifications': 0})
+
+
+class InvitationExpiryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        division = Division.objects.create(name='U12', sport=sport)
+        league = create_league(sport)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=league, division=division, captain=captain)
+        self.other_team = Team.objects.create(name='Blues', league=league, division=division, captain=captain)
+        self.agents = []
+        for i in range(5):
+            user = CustomUser.objects.create(username=f'agent{i}', email=f'agent{i}@example.com')
+            self.agents.append(FreeAgent.objects.create(
+                user=user, league=league, division=division, first_name='F', last_name=str(i),
+                email=user.email, phone_number='555', date_of_birth=timezone.now().date(), status='INVITED',
+            ))
+        self.now = timezone.now()
+        self.old = [TeamInvitation.objects.create(team=self.team, free_agent=agent) for agent in self.agents]
+        TeamInvitation.objects.filter(pk__in=[i.pk for i in self.old]).update(
+            created_at=self.now - timedelta(days=30)
+        )
+        # Still waiting on a recent invitation from another team
+        self.recent = TeamInvitation.objects.create(team=self.other_team, free_agent=self.agents[0])
+
+    def test_expires_old_invitations_in_batches(self):
+        result = expire_invitations(self.now - timedelta(days=14), batch_size=2)
+        self.assertEqual((result.expired, result.batches), (5, 3))
+        self.assertEqual(TeamInvitation.objects.filter(status='EXPIRED').count(), 5)
+        self.assertEqual(TeamInvitation.objects.get(pk=self.recent.pk).status, 'PENDING')
+
+    def test_agents_with_other_pending_invitations_stay_invited(self):
+        result = expire_invitations(self.now - timedelta(days=14), batch_size=2)
+        self.assertEqual(result.agents_reset, 4)
+        statuses = dict(FreeAgent.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses.pop(self.agents[0].pk), 'INVITED')
+        self.assertEqual(set(statuses.values()), {'AVAILABLE'})
+
+    def test_max_batches_stops_early(self):
+        result = expire_invitations(self.now - timedelta(days=14), batch_size=2, max_batches=1)
+        self.assertEqual((result.expired, result.batches), (2, 1))
+        # The oldest go first; a later run picks up the rest
+        self.assertEqual(expire_invitations(self.now - timedelta(days=14), batch_size=2).expired, 3)
+
+
+class AgeGroupTests(TestCase):
+    def test_parse_age_group(self):
+        cases = {
+            'U12': (None, 11), '12U': (None, 11), 'u-10': (None, 9), '14 U': (None, 13), 'Under 14': (None, 13),
+            '10-12': (10, 12), '12 to 10': (10, 12), '18+': (18, None), 'O35': (35, None),
+            'Over 40': (40, None), 'Adult': None, '': None, None: None,
+        }
+        for age_group, expected in cases.items():
+            with self.subTest(age_group=age_group):
+                self.assertEqual(parse_age_group(age_group), expected)
+
+    def test_birth_date_range(self):
+        season_start = date(2025, 9, 1)
+        self.assertEqual(birth_date_range('U12', season_start), (date(2013, 9, 1), None))
+        self.assertEqual(birth_date_range('12U', season_start), (date(2013, 9, 1), None))
+        self.assertEqual(birth_date_range('10-12', season_start), (date(2012, 9, 1), date(2015, 9, 1)))
+        self.assertEqual(birth_date_range('18+', season_start), (None, date(2007, 9, 1)))
+        self.assertIsNone(birth_date_range('Open', season_start))
+
+    def test_birth_date_range_on_leap_day(self):
+        self.assertEqual(birth_date_range('U10', date(2024, 2, 29)), (date(2014, 2, 28), None))
+
+
+class FreeAgentPoolFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.u12 = Division.objects.create(name='U12', sport=sport, age_group='12U')
+        self.u14 = Division.objects.create(name='U14', sport=sport, age_group='U14')
+        self.league = create_league(sport)
+        self.league.available_divisions.add(self.u12, self.u14)
+        captain_user = CustomUser.objects.create(username='captain', email='cap@example.com')
+        TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                   phone_number='555', user=captain_user)
+        self.client.force_login(captain_user)
+
+        start = self.league.league_start_date
+        age_10, age_13 = start - timedelta(days=10 * 365 + 30), start - timedelta(days=13 * 365 + 30)
+        agents = [
+            # division, member, date of birth
+            (self.u12, True, age_10), (self.u12, False, age_10), (self.u12, False, age_13),
+            (self.u14, True, age_13), (self.u14, True, age_13), (self.u14, False, age_10),
+        ]
+        for i, (division, is_member, date_of_birth) in enumerate(agents):
+            user = CustomUser.objects.create(username=f'agent{i}', email=f'agent{i}@example.com')
+            FreeAgent.objects.create(
+                user=user, league=self.league, division=division, first_name='F', last_name=str(i),
+                email=user.email, phone_number='555', date_of_birth=date_of_birth, is_member=is_member,
+            )
+
+    def facets(self, **params):
+        response = self.client.get(reverse('sportsSignUp:free_agent_pool', args=[self.league.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        facets = response.context['facets']
+        return (
+            facets['total'],
+            {division.name: count for division, count in facets['divisions']},
+            {value: count for value, _, count in facets['membership']},
+            len(response.context['free_agents']),
+        )
+
+    def test_unfiltered(self):
+        self.assertEqual(self.facets(), (6, {'U12': 3, 'U14': 3}, {'member': 3, 'non_member': 3}, 6))
+
+    def test_each_facet_ignores_its_own_filter(self):
+        self.assertEqual(self.facets(division=self.u12.pk),
+                         (3, {'U12': 3, 'U14': 3}, {'member': 1, 'non_member': 2}, 3))
+        self.assertEqual(self.facets(membership='member'),
+                         (3, {'U12': 1, 'U14': 2}, {'member': 3, 'non_member': 3}, 3))
+        self.assertEqual(self.facets(division=self.u14.pk, membership='non_member'),
+                         (1, {'U12': 2, 'U14': 1}, {'member': 2, 'non_member': 1}, 1))
+
+    def test_age_group_narrows_every_facet(self):
+        self.assertEqual(self.facets(age_group='12U'),
+                         (3, {'U12': 2, 'U14': 1}, {'member': 1, 'non_member': 2}, 3))
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=self.sport)
+        self.league = create_league(self.sport)
+        self.league.available_divisions.add(self.division)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.division, captain=captain)
+
+    def lookups(self):
+        return (
+            lookups.divisions_by_league(self.league.pk),
+            lookups.teams_by_league(self.league.pk),
+            lookups.teams_by_division(self.division.pk),
+        )
+
+    def assertWarm(self):
+        """Fill the caches, then check a second read costs nothing"""
+        self.lookups()
+        with self.assertNumQueries(0):
+            return self.lookups()
+
+    def test_warm_lookups_run_no_queries(self):
+        divisions, teams, division_teams = self.assertWarm()
+        self.assertEqual(divisions, [{'id': self.division.pk, 'name': 'U12'}])
+        self.assertEqual(teams[0]['teams'], [{'id': self.team.pk, 'name': 'Reds'}])
+        self.assertEqual(division_teams, [{'id': self.team.pk, 'name': 'Reds'}])
+
+    def test_team_save_invalidates(self):
+        self.assertWarm()
+        self.team.name = 'Blues'
+        self.team.save()
+        _, teams, division_teams = self.lookups()
+        self.assertEqual(teams[0]['teams'][0]['name'], 'Blues')
+        self.assertEqual(division_teams[0]['name'], 'Blues')
+
+    def test_division_save_invalidates(self):
+        self.assertWarm()
+        self.division.name = 'Under 12'
+        self.division.save()
+        divisions, teams, _ = self.lookups()
+        self.assertEqual(divisions[0]['name'], 'Under 12')
+        self.assertEqual(teams[0]['name'], 'Under 12')
+
+    def test_league_changes_invalidate(self):
+        self.assertWarm()
+        version = lookups.get_version('league', self.league.pk)
+        self.league.name = 'Spring'
+        self.league.save()
+        self.assertNotEqual(lookups.get_version('league', self.league.pk), version)
+        u14 = Division.objects.create(name='U14', sport=self.sport)
+        self.league.available_divisions.add(u14)
+        self.assertEqual([d['name'] for d in lookups.divisions_by_league(self.league.pk)], ['U12', 'U14'])
+
+
+class RegistrationManagementQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.divisions = [Division.objects.create(name=f'U{10 + 2 * i}', sport=sport) for i in range(2)]
+        self.league = create_league(sport)
+        self.league.available_divisions.add(*self.divisions)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.teams = [
+            Team.objects.create(name=f'Team {i}', league=self.league, division=self.divisions[i % 2],
+                                captain=captain)
+            for i in range(4)
+        ]
+        self.client.force_login(CustomUser.objects.create(username='admin', is_staff=True))
+
+    def seed(self, per_team, free_agents, start):
+        for i, team in enumerate(self.teams):
+            create_registrations(self.league, team.division, per_team, team=team, start=start + i * per_team)
+        create_registrations(self.league, self.divisions[0], free_agents, start=start + 10_000)
+
+    def get(self):
+        url = reverse('sportsSignUp:registration_management')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'league': self.league.pk, 'division': self.divisions[0].pk})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_the_league(self):
+        self.seed(per_team=2, free_agents=1, start=0)
+        self.get()
+        response, small = self.get()
+        self.assertEqual(response.context['stats'], {
+            'total_registrations': 5, 'total_free_agents': 1, 'divisions_count': 1, 'teams_count': 2,
+        })
+
+        self.seed(per_team=150, free_agents=100, start=1000)
+        response, large = self.get()
+        self.assertEqual(large, small)
+        self.assertEqual(response.context['stats']['total_registrations'], 405)
+        self.assertEqual(len(response.context['registrations']), 100)
+
+
+class LeagueSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=sport)
+        self.league = create_league(sport)
+        self.league.available_divisions.add(self.division)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.division, captain=captain)
+        self.admin_user = CustomUser.objects.create(username='admin', is_staff=True)
+
+    def get(self, league_id=None, user=None, **params):
+        request = RequestFactory().get('/', params)
+        request.user = user or self.admin_user
+        response = views.get_league_snapshot(request, league_id or self.league.pk)
+        return response, json.loads(response.content)
+
+    def test_miss_then_hit(self):
+        create_registrations(self.league, self.division, 30, team=self.team)
+        create_registrations(self.league, self.division, 20, start=100)
+        with self.assertNumQueries(6):
+            _, snapshot = self.get(limit=25)
+        with self.assertNumQueries(1):
+            _, cached = self.get(limit=25)
+        self.assertEqual(cached, snapshot)
+        self.assertEqual(snapshot['stats']['total_registrations'], 50)
+        division = snapshot['divisions'][0]
+        self.assertEqual((division['registration_count'], division['free_agent_count']), (50, 20))
+        self.assertEqual(division['teams'][0]['player_count'], 30)
+        self.assertEqual(len(snapshot['registrations']['results']), 25)
+        self.assertIsNotNone(snapshot['registrations']['next_cursor'])
+
+    def test_miss_query_count_is_fixed(self):
+        create_registrations(self.league, self.division, 500, team=self.team)
+        with self.assertNumQueries(6):
+            self.get()
+
+    def test_registration_change_misses(self):
+        _, before = self.get()
+        create_registrations(self.league, self.division, 1)
+        # bulk_create skips the signals, so bump as the services do
+        League.bump_registrations_version(pk=self.league.pk)
+        _, after = self.get()
+        self.assertEqual((before['stats']['total_registrations'], after['stats']['total_registrations']), (0, 1))
+
+    def test_non_staff_is_forbidden(self):
+        response, _ = self.get(user=CustomUser.objects.create(username='player'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_missing_league(self):
+        response, _ = self.get(league_id=self.league.pk + 1000)
+        self.assertEqual(response.status_code, 404)
+
+
+class HttpCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=sport)
+        self.league = create_league(sport)
+        self.league.available_divisions.add(self.division)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.division, captain=captain)
+        self.active_leagues = reverse('sportsSignUp:active_leagues')
+        self.signup = reverse('sportsSignUp:team_signup', args=[self.team.signup_code])
+
+    def test_public_page_revalidates_to_304(self):
+        response = self.client.get(self.active_leagues)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        response = self.client.get(self.active_leagues, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_catalog_change_invalidates_etag(self):
+        etag = self.client.get(self.active_leagues)['ETag']
+        self.league.name = 'Renamed'
+        self.league.save()
+        response = self.client.get(self.active_leagues, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Renamed')
+
+    def test_authenticated_requests_are_not_cached(self):
+        self.client.force_login(CustomUser.objects.create(username='player'))
+        response = self.client.get(self.active_leagues)
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_session_requests_are_not_cached(self):
+        session = self.client.session
+        session['team_signup_data'] = {'first_name': 'Pat'}
+        session.save()
+        response = self.client.get(self.active_leagues)
+        self.assertNotIn('ETag', response)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_private_page_etag_follows_csrf_cookie(self):
+        self.client.cookies['csrftoken'] = 'a' * 32
+        response = self.client.get(self.signup)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.signup, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.cookies['csrftoken'] = 'b' * 32
+        response = self.client.get(self.signup, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_private_page_team_change_invalidates_etag(self):
+        self.client.cookies['csrftoken'] = 'a' * 32
+        etag = self.client.get(self.signup)['ETag']
+        self.team.name = 'Blues'
+        self.team.save()
+        self.assertEqual(self.client.get(self.signup, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_signup_code_is_404(self):
+        response = self.client.get(reverse('sportsSignUp:team_signup', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_registrations_etag(self):
+        url = reverse('sportsSignUp:get_registrations_by_league', args=[self.league.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Each filter gets its own tag
+        self.assertNotEqual(self.client.get(url, {'search': 'pat'})['ETag'], etag)
+        League.bump_registrations_version(pk=self.league.pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        missing = reverse('sportsSignUp:get_registrations_by_league', args=[self.league.pk + 1000])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+
+class PlayerSearchTests(TestCase):
+    def setUp(self):
+        people = [
+            ('Alex', 'Morgan', 'Alex.Morgan@Example.com', '(555) 123-4567', None),
+            ('Sam', 'Kerr', 'skerr@example.com', '555.987.6543', 'Pat Kerr'),
+            ('Alexa', 'Adams', 'aadams@example.com', '+1 555 000 1111', None),
+        ]
+        self.players = {
+            last_name: Player.objects.create(
+                first_name=first_name, last_name=last_name, email=email, phone_number=phone,
+                parent_name=parent_name, date_of_birth=timezone.now().date(),
+            )
+            for first_name, last_name, email, phone, parent_name in people
+        }
+
+    def search(self, query):
+        return [player.last_name for player in search_players(Player.objects.all(), query)]
+
+    def test_search_text_is_normalized(self):
+        self.assertEqual(self.players['Morgan'].search_text, 'alex morgan alex.morgan@example.com 5551234567')
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms('  Alex  MORGAN '), ['alex', 'morgan'])
+        self.assertEqual(query_terms('(555) 123-4567'), ['5551234567'])
+        self.assertEqual(query_terms('12'), ['12'])
+        self.assertEqual(query_terms(''), [])
+
+    def test_by_name(self):
+        self.assertEqual(self.search('alex'), ['Adams', 'Morgan'])
+        self.assertEqual(self.search('Alex Morgan'), ['Morgan'])
+        self.assertEqual(self.search('pat kerr'), ['Kerr'])
+
+    def test_by_email(self):
+        self.assertEqual(self.search('ALEX.MORGAN@example'), ['Morgan'])
+        self.assertEqual(self.search('skerr@'), ['Kerr'])
+
+    def test_by_formatted_phone(self):
+        self.assertEqual(self.search('555-123-4567'), ['Morgan'])
+        self.assertEqual(self.search('(555) 987'), ['Kerr'])
+        self.assertEqual(self.search('000 1111'), ['Adams'])
+
+    def test_updates_rebuild_search_text(self):
+        player = self.players['Kerr']
+        player.last_name = 'Lloyd'
+        player.save(update_fields=['last_name'])
+        self.assertEqual(self.search('lloyd'), ['Lloyd'])
+        self.assertEqual(self.search('kerr'), ['Lloyd'])  # still the parent's name
+
+    def test_filter_through_registration(self):
+        sport = Sport.objects.create(name='Soccer')
+        division = Division.objects.create(name='U12', sport=sport)
+        league = create_league(sport)
+        for player in self.players.values():
+            Registration.objects.create(player=player, league=league, division=division)
+        registrations = filter_players(Registration.objects.all(), '555 987 6543', prefix='player__')
+        self.assertEqual([r.player.last_name for r in registrations], ['Kerr'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        divisions = [Division.objects.create(name=f'U{10 + 2 * i}', sport=sport) for i in range(2)]
+        self.league = create_league(sport)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        registrations = []
+        for i, division in enumerate(divisions):
+            for j in range(2):
+                team = Team.objects.create(name=f'Team {i}{j}', league=self.league, division=division,
+                                           captain=captain)
+                registrations += create_registrations(self.league, division, 6, team=team, start=len(registrations))
+            # Free agents sort under team 0 through the Coalesce key
+            registrations += create_registrations(self.league, division, 5, start=len(registrations))
+        # Ties on last name fall through to the id
+        Player.objects.filter(pk__in=[r.player_id for r in registrations[::3]]).update(last_name='Same')
+        self.url = reverse('sportsSignUp:get_registrations_by_league', args=[self.league.pk])
+        self.expected = list(
+            Registration.objects.filter(league=self.league)
+            .order_by(*views.RegistrationManagementView.keyset).values_list('id', flat=True)
+        )
+
+    def test_cursor_round_trip(self):
+        values = [3, 0, 'Same', 17]
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+        for cursor in ('not base64!', encode_cursor({'a': 1})[:-2], 'eyJhIjogMX0='):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            params = {'limit': 7, **({'cursor': cursor} if cursor else {})}
+            data = self.client.get(self.url, params).json()
+            seen += [row['id'] for row in data['results']]
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual((len(self.expected), pages), (34, 5))
+        self.assertEqual(seen, self.expected)
+        # The unpaged stream uses the same order
+        streamed = json.loads(b''.join(self.client.get(self.url).streaming_content))
+        self.assertEqual([row['id'] for row in streamed], self.expected)
+
+    def test_malformed_cursor_is_400(self):
+        for cursor in ('garbage', encode_cursor([1, 2])):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid pagination parameters'})
+        self.assertEqual(self.client.get(self.url, {'limit': 'ten'}).status_code, 400)
+
+    def test_management_page_malformed_cursor_is_404(self):
+        self.client.force_login(CustomUser.objects.create(username='admin', is_staff=True))
+        response = self.client.get(reverse('sportsSignUp:registration_management'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RegistrationExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.u12 = Division.objects.create(name='U12', sport=sport)
+        self.u14 = Division.objects.create(name='U14', sport=sport)
+        self.league = create_league(sport)
+        other_league = create_league(sport, name='Other')
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.u12, captain=captain)
+        create_registrations(self.league, self.u12, 4, team=self.team)
+        create_registrations(self.league, self.u12, 3, start=10)
+        create_registrations(self.league, self.u14, 2, start=20)
+        create_registrations(other_league, self.u12, 2, start=30)
+
+        form = DynamicForm.objects.create(league=self.league, title='Registration')
+        self.shirt = FormField.objects.create(form=form, label='Shirt size', field_type='text', order=1)
+        user = CustomUser.objects.create(username='parent')
+        FormResponse.objects.create(form=form, user=user, registration=Registration.objects.order_by('pk').first(),
+                                    responses={f'field_{self.shirt.pk}': 'M'})
+        self.client.force_login(CustomUser.objects.create(username='admin', is_staff=True))
+        self.url = reverse('sportsSignUp:registration_export')
+
+    def export_csv(self, **params):
+        response = self.client.get(self.url, {'format': 'csv', **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="registrations-', response['Content-Disposition'])
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+
+    def test_csv(self):
+        header, *rows = self.export_csv(league=self.league.pk)
+        self.assertEqual(header, [column for column, _ in EXPORT_COLUMNS] + ['Shirt size'])
+        self.assertEqual(len(rows), 9)
+        # Free agents come before the team within a division, as on the page
+        self.assertEqual([row[14] for row in rows], [''] * 3 + ['Reds'] * 4 + [''] * 2)
+        answered = dict(zip(header, next(row for row in rows if row[-1])))
+        self.assertEqual((answered['Team'], answered['Shirt size'], answered['Member']), ('Reds', 'M', 'No'))
+
+    def test_filters_match_the_management_page(self):
+        for params in ({'league': self.league.pk, 'division': self.u12.pk},
+                       {'team': self.team.pk}, {'search': 'player2'}, {}):
+            with self.subTest(params=params):
+                params = {key: str(value) for key, value in params.items()}
+                expected = filter_registrations(Registration.objects.all(), params)
+                rows = self.export_csv(**params)[1:]
+                self.assertEqual(sorted(int(row[0]) for row in rows),
+                                 sorted(expected.values_list('id', flat=True)))
+                self.assertEqual(list(export_queryset(params).values_list('id', flat=True)),
+                                 [int(row[0]) for row in rows])
+
+    def test_rosters_scope_leaves_out_free_agents(self):
+        rows = self.export_csv(league=self.league.pk, scope='rosters')[1:]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row[14] for row in rows}, {'Reds'})
+
+    def test_xlsx(self):
+        response = self.client.get(self.url, {'format': 'xlsx', 'league': self.league.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Disposition'].endswith('.xlsx"'))
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 10)
+        self.assertIn('<t xml:space="preserve">Shirt size</t>', sheet)
+
+    def test_unsupported_format(self):
+        response = self.client.get(self.url, {'format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Unsupported export format'})
+
+    def test_admins_only(self):
+        self.client.force_login(CustomUser.objects.create(username='player'))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class TeamSignupCodeTests(TestCase):
+    def setUp(self):
+        sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=sport)
+        self.league = create_league(sport)
+        self.captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                                  phone_number='555')
+        self.existing = self.team('Existing')
+        self.existing.save()
+
+    def team(self, name):
+        return Team(name=name, league=self.league, division=self.division, captain=self.captain)
+
+    def test_save_retries_a_colliding_code(self):
+        team = self.team('New')
+        with mock.patch('sportsSignUp.models.generate_signup_code',
+                        side_effect=[self.existing.signup_code, 'FRESH001']) as generate:
+            team.save()
+        self.assertEqual(generate.call_count, 2)
+        team.refresh_from_db()
+        self.assertEqual(team.signup_code, 'FRESH001')
+
+    def test_save_gives_up_after_repeated_collisions(self):
+        team = self.team('New')
+        with mock.patch('sportsSignUp.models.generate_signup_code', return_value=self.existing.signup_code):
+            with self.assertRaises(IntegrityError):
+                team.save()
+        self.assertIsNone(team.signup_code)
+        self.assertEqual(Team.objects.count(), 1)
+
+    def test_backfill_retries_a_colliding_batch(self):
+        Team.objects.bulk_create([self.team('A'), self.team('B')])
+        Team.objects.exclude(pk=self.existing.pk).update(signup_code=None)
+        codes = [self.existing.signup_code, 'FRESH001', 'FRESH002', 'FRESH003']
+        with mock.patch('sportsSignUp.models.generate_signup_code', side_effect=codes):
+            self.assertEqual(Team.objects.assign_missing_signup_codes(), 2)
+        self.assertEqual(set(Team.objects.exclude(pk=self.existing.pk).values_list('signup_code', flat=True)),
+                         {'FRESH002', 'FRESH003'})
+
+
+class CapabilitiesTests(TestCase):
+    template = Template(
+        '{% if capabilities.is_captain %}captain{% endif %}'
+        '{% if capabilities.is_admin %} admin{% endif %}'
+        '{% for team_id in capabilities.captained_team_ids %} {{ team_id }}{% endfor %}'
+    )
+
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.division = Division.objects.create(name='U12', sport=sport)
+        self.league = create_league(sport)
+        self.user = CustomUser.objects.create(username='cap', email='cap@example.com')
+        self.captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='other@example.com',
+                                                  phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.division,
+                                        captain=self.captain)
+        self.session = {}
+
+    def render(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.session
+        return self.template.render(Context(capabilities_context(request)))
+
+    @override_settings(CAPABILITIES_SESSION_CACHE=False)
+    def test_one_query_per_request(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(), '')
+
+    def test_session_cache_skips_the_query(self):
+        with self.assertNumQueries(1):
+            self.render()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), '')
+
+    def test_assigning_a_captain_invalidates_the_session_cache(self):
+        self.assertEqual(self.render(), '')
+        self.captain.user = self.user
+        self.captain.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(), f'captain {self.team.pk}')
+
+    def test_invite_from_a_deleted_team_is_rejected(self):
+        user = CustomUser.objects.create(username='agent', email='agent@example.com')
+        free_agent = FreeAgent.objects.create(
+            user=user, league=self.league, division=self.division, first_name='Free', last_name='Agent',
+            email='agent@example.com', phone_number='555', date_of_birth=date(2014, 1, 1),
+        )
+        stale = Capabilities(is_authenticated=True, is_captain=True, captained_teams={self.team.pk + 1: self.league.pk})
+        self.client.force_login(self.user)
+        with mock.patch('sportsSignUp.views.get_capabilities', return_value=stale):
+            response = self.client.post(reverse('sportsSignUp:invite_free_agent', args=[free_agent.pk]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TeamInvitation.objects.exists())
+
+
+class StripePriceIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        fake = FakeStripe()
+        product = fake.add_product(name='Fall registration')
+        self.regular = fake.add_price(product.id, 10000, metadata={'is_member': False})
+        self.member = fake.add_price(product.id, 8000, metadata={'is_member': True})
+        self.early = fake.add_price(product.id, 9000, metadata={'is_early_registration': True})
+        self.late = fake.add_price(product.id, 12000, metadata={'is_late': True})
+        with use_stripe_client(fake):
+            sync_stripe_products()
+        sport = Sport.objects.create(name='Soccer')
+        self.league = create_league(sport, stripe_product=StripeProduct.objects.get(stripe_id=product.id))
+
+    def price_id(self, *args, **kwargs):
+        with mock.patch('stripe.Price.list', side_effect=AssertionError('Stripe called')), \
+                mock.patch('stripe.Price.retrieve', side_effect=AssertionError('Stripe called')):
+            return get_stripe_price_id(self.league, *args, **kwargs)
+
+    def test_resolves_prices_from_synced_rows(self):
+        self.assertEqual(self.price_id(False, is_early_registration=False), self.regular.id)
+        self.assertEqual(self.price_id(True, is_early_registration=False), self.member.id)
+        self.assertEqual(self.price_id(False, is_early_registration=True), self.early.id)
+        self.assertEqual(self.price_id(False, is_early_registration=False, is_late=True), self.late.id)
+
+    def test_falls_back_to_the_regular_price(self):
+        self.assertEqual(self.price_id(True, is_early_registration=True), self.member.id)
+        self.assertEqual(self.price_id(True, is_early_registration=False, is_late=True), self.member.id)
+
+    def test_index_is_built_once_until_the_catalog_changes(self):
+        with self.assertNumQueries(1):
+            self.price_id(False, is_early_registration=False)
+        with self.assertNumQueries(0):
+            self.price_id(True, is_early_registration=False)
+        StripePrice.objects.filter(stripe_id=self.regular.id).update(active=False)
+        StripePrice.objects.get(stripe_id=self.late.id).save()
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.price_id(False, is_early_registration=False))
+
+
+class TeamAssignmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        sport = Sport.objects.create(name='Soccer')
+        self.u12 = Division.objects.create(name='U12', sport=sport)
+        self.u14 = Division.objects.create(name='U14', sport=sport)
+        self.league = create_league(sport)
+        captain = TeamCaptain.objects.create(first_name='Cap', last_name='Tain', email='cap@example.com',
+                                             phone_number='555')
+        self.team = Team.objects.create(name='Reds', league=self.league, division=self.u14, captain=captain)
+        self.players = [registration.player for registration in create_registrations(self.league, self.u12, 3)]
+        self.client.force_login(CustomUser.objects.create(username='admin', is_staff=True))
+
+    def moved(self):
+        return set(Player.objects.filter(team=self.team).values_list('pk', flat=True))
+
+    def test_valid_moves_apply_and_invalid_ones_are_reported(self):
+        first, second, _ = self.players
+        results = bulk_assign_players([(first.pk, self.team.pk), (second.pk, 0), (first.pk, self.team.pk)])
+        self.assertEqual([result['status'] for result in results], ['success', 'error', 'error'])
+        self.assertEqual(self.moved(), {first.pk})
+        self.assertEqual(Registration.objects.get(player=first).division, self.u14)
+
+    def test_failed_write_rolls_back_every_move(self):
+        moves = [(player.pk, self.team.pk) for player in self.players]
+        with mock.patch.object(Registration.objects, 'bulk_update', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                bulk_assign_players(moves)
+        self.assertEqual(self.moved(), set())
+        self.assertFalse(Registration.objects.filter(division=self.u14).exists())
+
+    def test_too_many_moves_are_rejected(self):
+        moves = [{'player_id': player.pk, 'team_id': self.team.pk} for player in self.players]
+        with mock.patch('sportsSignUp.views.MAX_BULK_MOVES', 2):
+            response = self.client.post(reverse('sportsSignUp:bulk_assign_teams'), json.dumps({'moves': moves}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        self.assertEqual(self.moved(), set())
+
+    def test_single_assignment_reports_errors_under_one_key(self):
+        url = reverse('sportsSignUp:assign_team', args=[self.players[0].pk])
+        self.assertIn('error', self.client.post(url).json())
+        self.assertIn('error', self.client.post(url, {'team_id': 0}).json())
+        response = self.client.post(url, {'team_id': self.team.pk})
+        self.assertEqual(response.json()['status'], 'success')
+        self.assertEqual(self.moved(), {self.players[0].pk})
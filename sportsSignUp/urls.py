@@ -17,7 +17,12 @@ urlpatterns = [
      path("leagues/", views.LeagueListView.as_view(), name="league_list"),
      path("registration/success/", views.registration_success, name="registration_success"),
      path("registration/cancel/", views.registration_cancel, name="registration_cancel"),
+     path("stripe/webhook/", views.stripe_webhook, name="stripe_webhook"),
      path("registrations/manage/", views.RegistrationManagementView.as_view(), name="registration_management"),
+     path("registrations/export/", views.RegistrationExportView.as_view(), name="registration_export"),
+     path("registrations/assign-team/<int:player_id>/", views.assign_team, name="assign_team"),
+     path("registrations/assign-teams/", views.bulk_assign_teams, name="bulk_assign_teams"),
+     path("registrations/placement/<int:league_id>/", views.league_placement, name="league_placement"),
 
      #free agent registration
      path("leagues/<int:league_id>/register/free-agent/", views.FreeAgentRegistrationView.as_view(), name="free_agent_registration"),
@@ -31,12 +36,19 @@ urlpatterns = [
      path("teams/sent-invitations/", views.SentInvitationsView.as_view(), name="sent_invitations"),
      path("teams/cancel-invitation/<int:invitation_id>/", views.CancelInvitationView.as_view(), name="cancel_invitation"),
 
+     # Notifications
+     path("notifications/", views.NotificationListView.as_view(), name="notifications"),
+     path("notifications/mark-read/", views.mark_notifications_read, name="mark_notifications_read"),
+
      # API Endpoints
      path("api/teams-by-league/<int:league_id>/", views.get_teams_by_league, name="get_teams_by_league"),
      path("api/registrations-by-league/<int:league_id>/", views.get_registrations_by_league, name="get_registrations_by_league"),
      path("api/divisions-by-league/<int:league_id>/", views.get_divisions_by_league, name="get_divisions_by_league"),
      path("api/teams-by-division/<int:division_id>/", views.get_teams_by_division, name="get_teams_by_division"),
      path("api/divisions-and-teams-by-league/<int:league_id>/", views.divisions_and_teams_by_league, name="divisions_and_teams_by_league"),
+     path("api/league-snapshot/<int:league_id>/", views.get_league_snapshot, name="league_snapshot"),
+     path("api/players/search/", views.player_search, name="player_search"),
+     path("api/teams/<int:team_id>/free-agent-matches/", views.free_agent_matches, name="free_agent_matches"),
 
      # Teams
      path('teams/create/<int:league_id>/', views.TeamCreationView.as_view(), name='team_create'),
@@ -1,10 +1,12 @@
 import datetime
+import hashlib
 import json
 import logging
 from urllib import request
 from django import forms
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.generic.edit import UpdateView
 from django.views.generic import ListView, CreateView, FormView, DetailView, TemplateView
@@ -17,6 +19,13 @@ from django.urls import reverse, reverse_lazy
 from django.views.generic.edit import CreateView
 
 from sportsSignUp.stripe_utils import get_stripe_price_id
+from . import lookups, matching, placement
+from .notifications import mark_read, notify_invitations
+from .age_groups import birth_date_filter, parse_age_group
+from .capabilities import get_capabilities
+from .http_cache import catalog_cache
+from .services import bulk_assign_players, filter_registrations, process_stripe_event
+from .stripe_client import get_stripe_client
 from .forms import CustomUserCreationForm, FreeAgentRegistrationForm, ProfileUpdateForm, TeamCreationForm, TeamSignupForm
 from django.contrib import messages
 from django.utils import timezone
@@ -24,16 +33,21 @@ from .models import CustomUser, FormResponse, Sport, Team, Player, Division, Lea
 import stripe
 from django.views.generic import ListView
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.db.models import Count, Q
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q, Value
+from django.db.models.functions import Coalesce
 from collections import defaultdict
 from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import user_passes_test
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
-from django.core.validators import validate_email
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 logger = logging.getLogger(__name__)
-stripe.api_key = settings.TEST_STRIPE_SECRET_KEY
 
 
 def index(request):
@@ -43,90 +57,66 @@ def index(request):
     }
     return render(request, "index.html", context)
 def get_teams_by_league(request, league_id):
-        """API endpoint to get all teams organized by division for a league"""
-        league = get_object_or_404(League, id=league_id)
-        divisions = league.available_divisions.all()
-    
-        data = []
-        for division in divisions:
-            teams = Team.objects.filter(
-                league=league,
-                division=division
-            ).values('id', 'name')
-        
-            data.append({
-                'id': division.id,
-                'name': division.name,
-                'teams': list(teams)
-            })
-    
-        return JsonResponse(data, safe=False)
+    """API endpoint to get all teams organized by division for a league"""
+    data = lookups.teams_by_league(league_id)
+    if data is None:
+        raise Http404("League not found")
+    return JsonResponse(data, safe=False)
 
-@require_POST
-def assign_team(request, player_id):
-    """Handle team assignment for a player"""
-    print("Received POST data:", request.POST)  # Debug print
-    print("team_id from POST:", request.POST.get('team_id'))  # Debug print
-    
+def _assignment_permission_error(request):
     if not request.user.is_authenticated:
         return JsonResponse({'error': 'Authentication required'}, status=401)
-    
     if not request.user.is_staff:
         return JsonResponse({'error': 'Admin privileges required'}, status=403)
+    return None
 
-    try:
-        team_id = request.POST.get('team_id')
-        if not team_id:
-            return JsonResponse({'error': 'No team_id provided in form data'}, status=400)
+@require_POST
+def assign_team(request, player_id):
+    """Handle team assignment for a player"""
+    error = _assignment_permission_error(request)
+    if error:
+        return error
 
-        print(f"Looking up team with ID: {team_id}")  # Debug print
-        team = get_object_or_404(Team, id=team_id)
-        player = get_object_or_404(Player, id=player_id)
-        
-        # Get the player's registration for this league
-        registration = Registration.objects.filter(
-            player=player,
-            league=team.league
-        ).first()
-        
-        if registration:
-            # Store old values for messaging
-            old_division = registration.division
-            old_team = player.team
-            
-            # Update registration with new division
-            registration.division = team.division
-            registration.save()
-            
-            # Update player's team
-            player.team = team
-            player.save()
-            
-            # Prepare message about changes
-            changes = []
-            if old_team != team:
-                changes.append(f"Team changed from {old_team.name if old_team else 'Free Agent'} to {team.name}")
-            if old_division != team.division:
-                changes.append(f"Division changed from {old_division.name} to {team.division.name}")
-            
-            message = " and ".join(changes)
-        else:
-            return JsonResponse({
-                'error': f"No registration found for player {player.get_full_name()} in league {team.league.name}"
-            }, status=400)
-        
-        return JsonResponse({
-            'status': 'success',
-            'message': message
-        })
-        
-    except Exception as e:
-        print(f"Error in assign_team: {str(e)}")  # Debug print
-        return JsonResponse({
-            'status': 'error',
-            'error': str(e)
-        }, status=400)
+    team_id = request.POST.get('team_id')
+    if not team_id or not str(team_id).isdigit():
+        return JsonResponse({'error': 'No team_id provided in form data'}, status=400)
+
+    result = bulk_assign_players([(player_id, int(team_id))])[0]
+    if result['status'] != 'success':
+        return JsonResponse({'status': 'error', 'error': result['error']}, status=400)
+    return JsonResponse({'status': 'success', 'message': result['message']})
+
+MAX_BULK_MOVES = 2000
+
+@require_POST
+def bulk_assign_teams(request):
+    """
+    Apply many team assignments at once.
+    Body: {"moves": [{"player_id": 1, "team_id": 2}, ...]}
+    Returns a result per move; valid moves are applied in one transaction.
+    """
+    error = _assignment_permission_error(request)
+    if error:
+        return error
+
+    try:
+        moves = [
+            (int(move['player_id']), int(move['team_id']))
+            for move in json.loads(request.body)['moves']
+        ]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"moves": [{"player_id": ..., "team_id": ...}]}'}, status=400)
+    if len(moves) > MAX_BULK_MOVES:
+        return JsonResponse({'error': f'At most {MAX_BULK_MOVES} moves per request'}, status=400)
+
+    results = bulk_assign_players(moves)
+    return JsonResponse({
+        'updated': sum(1 for result in results if result['status'] == 'success'),
+        'failed': sum(1 for result in results if result['status'] != 'success'),
+        'results': results,
+    })
     
+@catalog_cache()
 def active_leagues(request):
     """
     View to display currently active leagues
@@ -186,6 +176,7 @@ class ProfileManagementView(LoginRequiredMixin, UpdateView):
         messages.success(self.request, 'Your profile has been updated successfully!')
         return super().form_valid(form)
     
+@method_decorator(catalog_cache(), name='dispatch')
 class LeagueListView(ListView):
     template_name = 'leagues/league_list.html'
     context_object_name = 'sports'
@@ -193,18 +184,26 @@ class LeagueListView(ListView):
     def get_queryset(self):
         # Get current date
         today = timezone.now().date()
-        
-        # Get all sports and their active leagues
-        sports = Sport.objects.prefetch_related('leagues').all()
-        
-        # Filter for active leagues
-        for sport in sports:
-            sport.active_leagues = sport.leagues.filter(
-                registration_start_date__lte=today,
-                registration_end_date__gte=today
-            ).select_related('sport').prefetch_related('available_divisions')
-            
-        return sports
+
+        # Sports with their active leagues and divisions, in three queries.
+        # Nothing runs when the template's fragment cache is warm.
+        active_leagues = League.objects.filter(
+            registration_start_date__lte=today,  # Registration has started
+            registration_end_date__gte=today     # Registration has not ended
+        ).order_by('registration_end_date', 'name').prefetch_related(
+            Prefetch('available_divisions', queryset=Division.objects.order_by('name'))
+        )
+        return Sport.objects.order_by('name').prefetch_related(
+            Prefetch('leagues', queryset=active_leagues, to_attr='active_leagues')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Fragment cache key: the active set changes daily and with the catalog
+        context['today'] = timezone.now().date()
+        context['catalog_version'] = lookups.get_catalog_version()
+        return context
+
 class TeamCreationView(LoginRequiredMixin, CreateView):
     form_class = TeamCreationForm
     template_name = 'teams/team_create.html'
@@ -348,26 +347,30 @@ class InviteFreeAgentView(LoginRequiredMixin, View):
         free_agent = get_object_or_404(FreeAgent, id=free_agent_id)
         
         # First, check if the user is a captain
-        if not request.user.is_team_captain():
+        capabilities = get_capabilities(request)
+        if not capabilities.is_captain:
             return JsonResponse({
                 'status': 'error',
                 'message': 'You must be a team captain to invite free agents'
             }, status=403)
             
-        # Get the team(s) where this user is captain
-        captained_teams = Team.objects.filter(
-            captain__user=request.user,
-            league=free_agent.league  # Make sure the team is in the same league
-        )
+        # Get the team(s) in the free agent's league where this user is captain
+        team_ids = capabilities.captained_team_ids_in_league(free_agent.league_id)
         
-        if not captained_teams.exists():
+        if not team_ids:
             return JsonResponse({
                 'status': 'error',
                 'message': 'No team found in this league where you are captain'
             }, status=400)
         
-        # Use the first team if there are multiple (you might want to handle this differently)
-        team = captained_teams.first()
+        # Use the first team if there are multiple (you might want to handle this differently).
+        # Capabilities can be a moment stale, so the team may be gone by now
+        team = Team.objects.filter(pk__in=team_ids).order_by('pk').first()
+        if team is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'No team found in this league where you are captain'
+            }, status=400)
         
         # Check if an invitation already exists
         existing_invitation = TeamInvitation.objects.filter(
@@ -393,6 +396,7 @@ class InviteFreeAgentView(LoginRequiredMixin, View):
                 free_agent=free_agent,
                 team=team
             )
+            notify_invitations([invitation], 'sent')
             
             # Update free agent status
             free_agent.status = 'INVITED'
@@ -415,17 +419,12 @@ class SentInvitationsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     context_object_name = 'invitations'
     
     def test_func(self):
-        return self.request.user.is_team_captain()
+        return get_capabilities(self.request).is_captain
     
     def get_queryset(self):
-        # Get all teams where user is captain
-        captained_teams = Team.objects.filter(
-            captain__user=self.request.user
-        )
-        
-        # Get all invitations for these teams
+        # Get all invitations for the teams where user is captain
         return TeamInvitation.objects.filter(
-            team__in=captained_teams
+            team_id__in=get_capabilities(self.request).captained_team_ids
         ).select_related(
             'team',
             'team__league',
@@ -437,8 +436,8 @@ class SentInvitationsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         context = super().get_context_data(**kwargs)
         # Get captained teams
         captained_teams = Team.objects.filter(
-            captain__user=self.request.user
-        ).select_related('league')
+            id__in=get_capabilities(self.request).captained_team_ids
+        ).select_related('league').order_by('id')
         
         context['captained_teams'] = captained_teams
         
@@ -450,7 +449,7 @@ class SentInvitationsView(LoginRequiredMixin, UserPassesTestMixin, ListView):
             'EXPIRED': []
         }
         
-        for invitation in self.get_queryset():
+        for invitation in self.object_list:
             grouped_invitations[invitation.status].append(invitation)
             
         context['grouped_invitations'] = grouped_invitations
@@ -528,42 +527,96 @@ class FreeAgentPoolView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = FreeAgent
     template_name = 'leagues/free_agent_pool.html'
     context_object_name = 'free_agents'
-    
+    paginate_by = 24
+
     def test_func(self):
-        return self.request.user.is_team_captain()
-    
-    def get_queryset(self):
-        # Get the league from the URL
-        league_id = self.kwargs.get('league_id')
-        
-        # Filter free agents by league and available status
-        queryset = FreeAgent.objects.filter(
-            league_id=league_id,
-            status='AVAILABLE'
-        ).order_by('-created_at')
-        
-        # Apply filters from query parameters
+        return get_capabilities(self.request).is_captain
+
+    def get_filters(self):
+        """Q objects for the division and membership filters in the query string"""
+        filters = {}
         division = self.request.GET.get('division')
-        if division:
-            queryset = queryset.filter(division_id=division)
-            
-        age_group = self.request.GET.get('age_group')
-        if age_group:
-            # You might want to implement age group logic based on date_of_birth
-            pass
-            
-        return queryset
-        
+        if division and division.isdigit():
+            filters['division'] = Q(division_id=int(division))
+        membership = self.request.GET.get('membership')
+        if membership in ('member', 'non_member'):
+            filters['membership'] = Q(is_member=membership == 'member')
+        return filters
+
+    def get_queryset(self):
+        self.league = get_object_or_404(League, id=self.kwargs.get('league_id'))
+        self.divisions = list(self.league.available_divisions.order_by('name'))
+
+        # Available agents of the league, within the age group's birth dates
+        # as of the season start; served by the freeagent_age index
+        self.base_queryset = FreeAgent.objects.filter(league=self.league, status='AVAILABLE')
+        self.age_group = self.request.GET.get('age_group', '')
+        if self.age_group:
+            birth_dates = birth_date_filter(self.age_group, self.league.league_start_date)
+            if birth_dates is not None:
+                self.base_queryset = self.base_queryset.filter(**birth_dates)
+
+        self.filters = self.get_filters()
+        queryset = self.base_queryset
+        for condition in self.filters.values():
+            queryset = queryset.filter(condition)
+        return queryset.select_related('division').order_by('-created_at', '-id')
+
+    def get_facets(self):
+        """
+        Result counts per division and per membership status, in one
+        aggregate. Each facet counts with the other facet's filter applied
+        but not its own, so every option shows what picking it would return.
+        """
+        if hasattr(self, '_facets'):
+            return self._facets
+        division_q = self.filters.get('division', Q())
+        membership_q = self.filters.get('membership', Q())
+        counts = self.base_queryset.aggregate(
+            total=Count('id', filter=division_q & membership_q),
+            members=Count('id', filter=Q(is_member=True) & division_q),
+            non_members=Count('id', filter=Q(is_member=False) & division_q),
+            **{
+                f'division_{division.id}': Count('id', filter=Q(division_id=division.id) & membership_q)
+                for division in self.divisions
+            }
+        )
+        self._facets = {
+            'total': counts['total'],
+            'divisions': [(division, counts[f'division_{division.id}']) for division in self.divisions],
+            'membership': [('member', 'Members', counts['members']),
+                           ('non_member', 'Non-members', counts['non_members'])],
+        }
+        return self._facets
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        paginator = super().get_paginator(queryset, per_page, orphans, allow_empty_first_page, **kwargs)
+        # The facet aggregate already counted the results
+        paginator.count = self.get_facets()['total']
+        return paginator
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        league = get_object_or_404(League, id=self.kwargs.get('league_id'))
-        context['league'] = league
-        context['divisions'] = league.available_divisions.all()
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context.update({
+            'league': self.league,
+            'divisions': self.divisions,
+            'facets': self.get_facets(),
+            'age_groups': sorted({
+                division.age_group for division in self.divisions
+                if parse_age_group(division.age_group) is not None
+            }),
+            'selected_division': self.request.GET.get('division', ''),
+            'selected_membership': self.request.GET.get('membership', ''),
+            'selected_age_group': self.age_group,
+            'filter_query': query.urlencode(),
+        })
         return context
     
 class FreeAgentDetailView(LoginRequiredMixin, UserPassesTestMixin, View):
     def test_func(self):
-        return hasattr(self.request.user, 'team') and self.request.user.team.is_captain(self.request.user)
+        return get_capabilities(self.request).is_captain
         
     def get(self, request, agent_id):
         agent = get_object_or_404(FreeAgent, id=agent_id)
@@ -606,15 +659,12 @@ class TeamDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     context_object_name = 'team'
     
     def test_func(self):
-        team = self.get_object()
-        return (team.captain.user == self.request.user or 
-                (team.captain.email == self.request.user.email and team.captain.user is None))
+        return get_capabilities(self.request).can_manage_team(self.kwargs['pk'])
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        team = self.get_object()
-        is_captain = (team.captain.user == self.request.user or 
-                     (team.captain.email == self.request.user.email and team.captain.user is None))
+        team = self.object
+        is_captain = get_capabilities(self.request).can_manage_team(team.pk)
             
         context.update({
             'is_captain': is_captain,
@@ -644,64 +694,59 @@ class ClaimTeamCaptainView(LoginRequiredMixin, View):
         return redirect('sportsSignUp:team_dashboard')
 
 def registration_success(request):
+    """
+    Landing page after Stripe checkout. Fulfillment happens in stripe_webhook,
+    so this only reports what has been recorded locally.
+    """
     session_id = request.GET.get('session_id')
     if not session_id:
         messages.error(request, 'No session ID provided')
         return redirect('sportsSignUp:league_list')
 
+    if Registration.objects.filter(stripe_checkout_session=session_id).exists():
+        messages.success(request, 'Registration completed successfully!')
+    else:
+        messages.info(request, 'Payment received. Your registration is being finalized and will appear shortly.')
+    return redirect('sportsSignUp:league_list')
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Receive signed Stripe webhook events and fulfill paid checkout sessions"""
     try:
-        # Retrieve the Stripe session
-        session = stripe.checkout.Session.retrieve(session_id)
-        
-        # Get form response from session
-        form_response_id = session.metadata.get('form_response_id')
-        if form_response_id:
-            form_response = FormResponse.objects.get(id=form_response_id)
-            
-            # Create the Player using form response data
-            player = Player.objects.create(
-                first_name=form_response.responses.get('first_name', ''),
-                last_name=form_response.responses.get('last_name', ''),
-                email=form_response.responses.get('email', ''),
-                phone_number=form_response.responses.get('phone_number', ''),
-                date_of_birth=datetime.strptime(
-                    form_response.responses.get('date_of_birth', ''), 
-                    '%Y-%m-%d'
-                ).date(),
-                membership_number=form_response.responses.get('membership_number', ''),
-                is_member=form_response.responses.get('is_member', False),
-                user=request.user if request.user.is_authenticated else None
-            )
-            
-            # Create the Registration
-            registration = Registration.objects.create(
-                player=player,
-                league_id=session.metadata['league_id'],
-                payment_status='paid',
-                stripe_payment_intent=session.payment_intent,
-                division_id=session.metadata['division_id']
-            )
-            
-            # Link the form response to the registration
-            form_response.registration = registration
-            form_response.save()
+        event = get_stripe_client().Webhook.construct_event(
+            request.body,
+            request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+            settings.STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.warning(f"Rejected Stripe webhook: {str(e)}")
+        return HttpResponse(status=400)
+
+    try:
+        process_stripe_event(event)
+    except Exception:
+        # A non-2xx response makes Stripe retry the delivery later
+        logger.exception(f"Error processing Stripe event {event['id']}")
+        return HttpResponse(status=500)
+
+    return HttpResponse(status=200)
 
-        messages.success(request, 'Registration completed successfully!')
-        return redirect('sportsSignUp:league_list')
-        
-    except Exception as e:
-        messages.error(request, f'Error processing registration: {str(e)}')
-        return redirect('sportsSignUp:league_list')
 def registration_cancel(request, league_id):
     messages.error(request, 'Registration canceled')
     return redirect('sportsSignUp:league_list')
 from django.views.generic import ListView
 from .mixins import AdminRequiredMixin
+from .pagination import InvalidCursor, KeysetPaginationMixin, keyset_paginate
+from .search import filter_players, search_players
+from .exports import export_queryset, export_rows, stream_csv, stream_xlsx
 
-class RegistrationManagementView(AdminRequiredMixin, ListView):
+class RegistrationManagementView(AdminRequiredMixin, KeysetPaginationMixin, ListView):
     template_name = 'registration/registration_management.html'
     model = Registration
     context_object_name = 'registrations'
+    paginate_by = 100
+    keyset = ('division_id', Coalesce('player__team_id', Value(0)), 'player__last_name', 'id')
 
     def get_queryset(self):
         queryset = Registration.objects.select_related(
@@ -710,37 +755,7 @@ class RegistrationManagementView(AdminRequiredMixin, ListView):
             'division',
             'player__team'
         ).order_by('division', 'player__team', 'player__last_name')
-        
-        # Apply filters
-        filters = Q()
-        
-        # League filter
-        league_id = self.request.GET.get('league')
-        if league_id:
-            filters &= Q(league_id=league_id)
-            
-        # Division filter
-        division_id = self.request.GET.get('division')
-        if division_id:
-            filters &= Q(division_id=division_id)
-            
-        # Team filter
-        team_id = self.request.GET.get('team')
-        if team_id:
-            filters &= Q(player__team_id=team_id)
-            
-        # Search filter
-        search_query = self.request.GET.get('search', '').strip()
-        if search_query:
-            search_filters = (
-                Q(player__first_name__icontains=search_query) |
-                Q(player__last_name__icontains=search_query) |
-                Q(player__email__icontains=search_query) |
-                Q(player__phone_number__icontains=search_query)
-            )
-            filters &= search_filters
-            
-        return queryset.filter(filters)
+        return filter_registrations(queryset, self.request.GET)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -776,11 +791,11 @@ class RegistrationManagementView(AdminRequiredMixin, ListView):
         # Keep the search query
         context['search_query'] = search_query
         
-        # Organize registrations
+        # Organize the current page of registrations in a single pass
         organized_data = defaultdict(lambda: defaultdict(list))
         free_agents = defaultdict(list)
         
-        for registration in self.get_queryset():
+        for registration in context['object_list']:
             if registration.player.team:
                 organized_data[registration.division][registration.player.team].append(registration)
             else:
@@ -793,173 +808,270 @@ class RegistrationManagementView(AdminRequiredMixin, ListView):
         }
         context['free_agents'] = dict(free_agents)
         
-        # Stats for current filter
-        current_queryset = self.get_queryset()
-        context['stats'] = {
-            'total_registrations': current_queryset.count(),
-            'total_free_agents': current_queryset.filter(player__team__isnull=True).count(),
-            'divisions_count': current_queryset.values('division').distinct().count(),
-            'teams_count': current_queryset.exclude(player__team__isnull=True)
-                .values('player__team').distinct().count(),
-        }
+        # Stats for current filter, computed in a single aggregate query
+        context['stats'] = registration_stats(self.object_list)
         
         return context
     
 
-def get_registrations_by_league(request, league_id):
+class RegistrationExportView(AdminRequiredMixin, View):
     """
-    Retrieve registrations for a specific league with error handling and validation.
-    Includes team information through the Player model relationship.
+    Download the registrations selected by the management page filters as
+    CSV or XLSX. Add scope=rosters to leave out free agents.
     """
-    try:
-        # Validate league_id
-        if not isinstance(league_id, int) and not str(league_id).isdigit():
-            logger.error(f"Invalid league_id format: {league_id}")
-            return JsonResponse({
-                'error': 'Invalid league ID format'
-            }, status=400)
+    formats = {
+        'csv': (stream_csv, 'text/csv'),
+        'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    }
 
-        # Verify league exists
-        league = get_object_or_404(League, id=league_id)
-        
-        try:
-            # Updated query to include player and their team information
-            registrations = Registration.objects.filter(
-                league_id=league_id
-            ).select_related(
-                'division',
-                'player',
-                'player__team'  # Include team data through player
-            ).values(
-                # Registration fields
-                'id',
-                'division_id',
-                'division__name',
-                'is_late_registration',
-                'payment_status',
-                'registered_at',
-                'notes',
-                # Player fields
-                'player__id',
-                'player__first_name',
-                'player__last_name',
-                'player__parent_name',
-                'player__email',
-                'player__phone_number',
-                'player__is_member',
-                # Team fields (through player)
-                'player__team__id',
-                'player__team__name',
-                'player__team__division__id',
-                'player__team__division__name'
-            )
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in self.formats:
+            return JsonResponse({'error': 'Unsupported export format'}, status=400)
+        stream, content_type = self.formats[export_format]
 
-            data = []
-            for reg in registrations:
-                try:
-                    # Basic validation of required fields
-                    if not reg['player__first_name'] or not reg['player__email']:
-                        logger.warning(f"Registration {reg['id']} has missing required fields")
-                        continue
-
-                    # Validate email format
-                    validate_email(reg['player__email'])
-
-                    # Combine first and last name
-                    full_name = f"{reg['player__first_name']} {reg['player__last_name']}".strip()
-
-                    # Transform the registration data
-                    registration_data = {
-                        'id': reg['id'],
-                        'player_id': reg['player__id'],
-                        'player_name': full_name,
-                        'parent_name': reg['player__parent_name'].strip() if reg['player__parent_name'] else None,
-                        'email': reg['player__email'].lower(),
-                        'phone': reg['player__phone_number'],
-                        'division_id': reg['division_id'],
-                        'division_name': reg['division__name'],
-                        # Team information (null if free agent)
-                        'team_id': reg['player__team__id'],
-                        'team_name': reg['player__team__name'],
-                        'team_division_id': reg['player__team__division__id'],
-                        'team_division_name': reg['player__team__division__name'],
-                        # Status information
-                        'is_late_registration': reg['is_late_registration'],
-                        'payment_status': reg['payment_status'],
-                        'is_member': reg['player__is_member'],
-                        'registered_at': reg['registered_at'].isoformat() if reg['registered_at'] else None,
-                        'notes': reg['notes']
-                    }
+        rows = export_rows(export_queryset(request.GET))
+        response = StreamingHttpResponse(stream(rows), content_type=content_type)
+        filename = f"registrations-{timezone.now():%Y%m%d-%H%M}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
 
-                    data.append(registration_data)
 
-                except forms.ValidationError as ve:
-                    logger.error(f"Validation error for registration {reg['id']}: {str(ve)}")
-                    continue
-                except KeyError as ke:
-                    logger.error(f"Missing key in registration data: {str(ke)}")
-                    continue
+def registration_stats(queryset):
+    """Registration totals for a filtered queryset in one aggregate query"""
+    return queryset.order_by().aggregate(
+        total_registrations=Count('id'),
+        total_free_agents=Count('id', filter=Q(player__team__isnull=True)),
+        divisions_count=Count('division', distinct=True),
+        teams_count=Count('player__team', distinct=True),
+    )
+
+def _serialize_registration(reg):
+    """Flatten a registration values() row for the management API"""
+    return {
+        'id': reg['id'],
+        'player_id': reg['player__id'],
+        'player_name': f"{reg['player__first_name']} {reg['player__last_name']}".strip(),
+        'parent_name': reg['player__parent_name'].strip() if reg['player__parent_name'] else None,
+        'email': reg['player__email'],
+        'phone': reg['player__phone_number'],
+        'division_id': reg['division_id'],
+        'division_name': reg['division__name'],
+        # Team information (null if free agent)
+        'team_id': reg['player__team__id'],
+        'team_name': reg['player__team__name'],
+        'team_division_id': reg['player__team__division__id'],
+        'team_division_name': reg['player__team__division__name'],
+        # Status information
+        'is_late_registration': reg['is_late_registration'],
+        'payment_status': reg['payment_status'],
+        'is_member': reg['player__is_member'],
+        'registered_at': reg['registered_at'].isoformat() if reg['registered_at'] else None,
+        'notes': reg['notes']
+    }
 
-            # Log success
-            logger.info(f"Successfully retrieved {len(data)} registrations for league {league_id}")
 
-            return JsonResponse(data, safe=False)
+def _registration_rows(league_id):
+    """values() rows of a league's registrations, as serialized by the management API"""
+    # Players without a name or email are left out, as they always were
+    return Registration.objects.filter(
+        league_id=league_id
+    ).exclude(
+        player__first_name=''
+    ).exclude(
+        player__email=''
+    ).values(
+        # Registration fields
+        'id',
+        'division_id',
+        'division__name',
+        'is_late_registration',
+        'payment_status',
+        'registered_at',
+        'notes',
+        # Player fields
+        'player__id',
+        'player__first_name',
+        'player__last_name',
+        'player__parent_name',
+        'player__email',
+        'player__phone_number',
+        'player__is_member',
+        # Team fields (through player)
+        'player__team__id',
+        'player__team__name',
+        'player__team__division__id',
+        'player__team__division__name'
+    )
+
+
+def _stream_json_array(rows):
+    """Yield a JSON array one serialized row at a time"""
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(_serialize_registration(row), cls=DjangoJSONEncoder)
+        separator = ','
+    yield ']'
+
+
+def registrations_etag(request, league_id):
+    """
+    The league's registrations version plus a hash of the query string, so
+    every filter and page gets its own tag. One indexed lookup by primary key.
+    """
+    if not League.objects.filter(pk=league_id).exists():
+        return None
+    version = lookups.get_registrations_version(league_id)
+    query_hash = hashlib.sha1(request.META.get('QUERY_STRING', '').encode('utf-8')).hexdigest()[:12]
+    return f"league-{league_id}-v{version}-{query_hash}"
 
-        except Exception as e:
-            logger.error(f"Database error while fetching registrations: {str(e)}")
+
+@condition(etag_func=registrations_etag)
+def get_registrations_by_league(request, league_id):
+    """
+    Retrieve registrations for a specific league.
+    Includes team information through the Player model relationship.
+    Pass limit (and then the returned next_cursor as cursor) to fetch the
+    registrations one keyset page at a time, and search to narrow them down
+    by player name, email or phone. Without limit the whole league is
+    streamed as a JSON array. Responses carry an ETag, so polling an
+    unchanged league gets a 304.
+    """
+    get_object_or_404(League, id=league_id)
+    registrations = _registration_rows(league_id)
+
+    search_query = request.GET.get('search', '').strip()
+    if search_query:
+        registrations = filter_players(registrations, search_query, prefix='player__')
+
+    if 'cursor' in request.GET or 'limit' in request.GET:
+        try:
+            page_size = min(max(int(request.GET.get('limit', 100)), 1), 500)
+            page = keyset_paginate(
+                registrations,
+                RegistrationManagementView.keyset,
+                request.GET.get('cursor'),
+                page_size
+            )
+        except (ValueError, InvalidCursor):
             return JsonResponse({
-                'error': 'Error retrieving registrations'
-            }, status=500)
+                'error': 'Invalid pagination parameters'
+            }, status=400)
 
-    except League.DoesNotExist:
-        logger.error(f"League {league_id} not found")
-        return JsonResponse({
-            'error': 'League not found'
-        }, status=404)
+        response_data = {
+            'results': [_serialize_registration(reg) for reg in page.object_list],
+            'next_cursor': page.next_cursor,
+        }
+        if not request.GET.get('cursor'):
+            response_data['stats'] = registration_stats(
+                Registration.objects.filter(league_id=league_id)
+            )
+        response = JsonResponse(response_data)
+    else:
+        rows = registrations.order_by(*RegistrationManagementView.keyset).iterator(chunk_size=2000)
+        response = StreamingHttpResponse(_stream_json_array(rows), content_type='application/json')
 
-    except Exception as e:
-        logger.error(f"Unexpected error in get_registrations_by_league: {str(e)}")
-        return JsonResponse({
-            'error': 'An unexpected error occurred'
-        }, status=500)
+    # Let the browser keep the response but revalidate it with the ETag every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
     
+SNAPSHOT_PAGE_SIZE = 200
+SNAPSHOT_CACHE_TIMEOUT = 60 * 60
+
+def _build_league_snapshot(league, page_size):
+    """Everything the registration management page needs to render a league"""
+    divisions = {
+        division['id']: dict(division, teams=[], registration_count=0, free_agent_count=0)
+        for division in Division.objects.filter(
+            league_sessions__id=league['id']
+        ).order_by('name', 'id').values('id', 'name')
+    }
+
+    teams = Team.objects.filter(league_id=league['id']).annotate(
+        player_count=Count('players')
+    ).order_by('name', 'id').values('id', 'name', 'division_id', 'player_count')
+    for team in teams:
+        if team['division_id'] in divisions:
+            divisions[team['division_id']]['teams'].append(team)
+
+    counts = Registration.objects.filter(league_id=league['id']).order_by().values('division_id').annotate(
+        registrations=Count('id'),
+        free_agents=Count('id', filter=Q(player__team__isnull=True)),
+    )
+    for row in counts:
+        if row['division_id'] in divisions:
+            divisions[row['division_id']]['registration_count'] = row['registrations']
+            divisions[row['division_id']]['free_agent_count'] = row['free_agents']
+
+    page = keyset_paginate(
+        _registration_rows(league['id']), RegistrationManagementView.keyset, None, page_size
+    )
+    return {
+        'league': league,
+        'divisions': list(divisions.values()),
+        'stats': registration_stats(Registration.objects.filter(league_id=league['id'])),
+        'registrations': {
+            'results': [_serialize_registration(reg) for reg in page.object_list],
+            'next_cursor': page.next_cursor,
+        },
+    }
+
+def get_league_snapshot(request, league_id):
+    """
+    One-shot state for the registration management page: the league, its
+    divisions and teams with counts, registration totals and the first page
+    of registrations (continue with get_registrations_by_league and
+    next_cursor). Built from a fixed handful of queries and cached until the
+    league's registrations or lookups change, so a hit costs one query.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Admin privileges required'}, status=403)
+
+    try:
+        page_size = min(max(int(request.GET.get('limit', SNAPSHOT_PAGE_SIZE)), 1), 500)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    league = League.objects.filter(pk=league_id).values(
+        'id', 'name', 'registration_start_date', 'registration_end_date',
+        'early_registration_deadline', 'league_start_date', 'league_end_date',
+    ).first()
+    if league is None:
+        return JsonResponse({'error': 'League not found'}, status=404)
+
+    cache_key = (
+        f"league_snapshot:{league_id}:{page_size}:r{lookups.get_registrations_version(league_id)}"
+        f":l{lookups.get_version('league', league_id)}"
+    )
+    snapshot = cache.get(cache_key)
+    if snapshot is None:
+        snapshot = _build_league_snapshot(league, page_size)
+        cache.set(cache_key, snapshot, SNAPSHOT_CACHE_TIMEOUT)
+    return JsonResponse(snapshot)
+
 def get_divisions_by_league(request, league_id):
-    divisions = Division.objects.filter(
-        league_sessions__id=league_id
-    ).distinct().values('id', 'name')
-    return JsonResponse(list(divisions), safe=False)
+    return JsonResponse(lookups.divisions_by_league(league_id), safe=False)
 
 def divisions_and_teams_by_league(request, league_id):
-    # Get divisions through league sessions
-    divisions = Division.objects.filter(
-        league_sessions__id=league_id
-    ).distinct().prefetch_related('teams')
-    
-    data = [{
-        'id': division.id,
-        'name': division.name,
-        'teams': [{
-            'id': team.id,
-            'name': team.name
-        } for team in division.teams.all()]
-    } for division in divisions]
-    
-    return JsonResponse(data, safe=False)
+    return JsonResponse(lookups.divisions_and_teams_by_league(league_id), safe=False)
+
 def get_teams_by_division(request, division_id):
-    teams = Team.objects.filter(
-        division_id=division_id
-    ).values('id', 'name')
-    return JsonResponse(list(teams), safe=False)
+    return JsonResponse(lookups.teams_by_division(division_id), safe=False)
 
-class TeamManagementView(AdminRequiredMixin, ListView):
+class TeamManagementView(AdminRequiredMixin, KeysetPaginationMixin, ListView):
     model = Team
     template_name = 'teams/team_management.html'  # This tells ListView to use this template
     context_object_name = 'teams'
+    paginate_by = 50
+    keyset = ('league_id', 'division_id', 'name', 'id')
 
     def get_queryset(self):
         queryset = Team.objects.select_related(
             'league',
             'division'
+        ).annotate(
+            player_count=Count('players')
         ).order_by('league', 'division', 'name')
         
         # Apply filters
@@ -1033,9 +1145,17 @@ class TeamEditView(AdminRequiredMixin, UpdateView):
         context['title'] = f"Edit Team: {self.object.name}"
         return context
 
+def _team_signup_version(request, signup_code):
+    """Team changes bump the league's lookup version"""
+    league_id = Team.objects.filter(signup_code=signup_code).values_list('league_id', flat=True).first()
+    if league_id is None:
+        return None
+    return f"team-{lookups.get_version('league', league_id)}"
+
+@catalog_cache(private=True, extra_version=_team_signup_version)
 def team_signup_page(request, signup_code):
     """Public page for team signups"""
-    team = get_object_or_404(Team, signup_code=signup_code)
+    team = get_object_or_404(Team.objects.select_related('league'), signup_code=signup_code)
 
     # Get prefilled data from session if coming from invitation
     initial_data = request.session.get('team_signup_data', {})
@@ -1049,6 +1169,7 @@ def team_signup_page(request, signup_code):
                 price_id = get_stripe_price_id(
                     league=team.league,
                     is_member=form.cleaned_data['is_member'],
+                    is_late=timezone.now().date() > team.league.registration_end_date,
                 )
                 
                 if not price_id:
@@ -1056,7 +1177,7 @@ def team_signup_page(request, signup_code):
                     return redirect('sportsSignUp:team_signup', signup_code=signup_code)
 
                 # Create Stripe checkout session
-                checkout_session = stripe.checkout.Session.create(
+                checkout_session = get_stripe_client().checkout.Session.create(
                     payment_method_types=['card'],
                     line_items=[{
                         'price': price_id,
@@ -1071,7 +1192,8 @@ def team_signup_page(request, signup_code):
                     ),
                     metadata={
                         'team_id': team.id,
-                        'invitation_id': invitation_id,
+                        'invitation_id': invitation_id or '',
+                        'user_id': request.user.id if request.user.is_authenticated else '',
                         'player_data': json.dumps({
                             'first_name': form.cleaned_data['first_name'],
                             'last_name': form.cleaned_data['last_name'],
@@ -1104,77 +1226,26 @@ def team_signup_page(request, signup_code):
     })
 
 def team_signup_success(request):
-    """Handle successful team signup after payment"""
+    """
+    Landing page after a team signup payment. The player and registration
+    are created by stripe_webhook; this view only reads local state.
+    """
     session_id = request.GET.get('session_id')
     if not session_id:
         messages.error(request, 'No session ID provided')
-        return redirect('')
+        return redirect('sportsSignUp:index')
 
-    try:
-        # Retrieve the session and metadata
-        session = stripe.checkout.Session.retrieve(session_id)
-        player_data = json.loads(session.metadata['player_data'])
-        team = get_object_or_404(Team, id=session.metadata['team_id'])
-        invitation_id = session.metadata.get('invitation_id')
-        
-        with transaction.atomic():
-            # Create the player
-            player = Player.objects.create(
-                first_name=player_data['first_name'],
-                last_name=player_data['last_name'],
-                email=player_data['email'],
-                phone_number=player_data['phone_number'],
-                parent_name=player_data.get('parent_name'),
-                date_of_birth=datetime.strptime(player_data['date_of_birth'], '%Y-%m-%d').date(),
-                membership_number=player_data['membership_number'],
-                is_member=player_data['is_member'],
-                team=team,
-                user=request.user if request.user.is_authenticated else None
-            )
-            
-            # Create registration
-            registration = Registration.objects.create(
-                player=player,
-                league=team.league,
-                division=team.division,
-                payment_status='paid',
-                stripe_payment_intent=session.payment_intent,
-                stripe_checkout_session=session_id,
-                is_late_registration=timezone.now().date() > team.league.early_registration_deadline
-            )
-            
-            # If this was from an invitation, update the invitation and free agent status
-            if invitation_id:
-                try:
-                    invitation = TeamInvitation.objects.get(id=invitation_id)
-                    invitation.status = 'ACCEPTED'
-                    invitation.response_at = timezone.now()
-                    invitation.save()
-                    
-                    # Update free agent status
-                    invitation.free_agent.status = 'JOINED'
-                    invitation.free_agent.save()
-                    
-                    # Decline other pending invitations
-                    TeamInvitation.objects.filter(
-                        free_agent=invitation.free_agent,
-                        status='PENDING'
-                    ).exclude(
-                        id=invitation_id
-                    ).update(
-                        status='DECLINED',
-                        response_at=timezone.now()
-                    )
-                except TeamInvitation.DoesNotExist:
-                    # Log this but don't fail the registration
-                    logger.warning(f"Could not find invitation {invitation_id} for successful signup")
-        
+    registration = Registration.objects.filter(
+        stripe_checkout_session=session_id
+    ).select_related('player').first()
+
+    if registration and registration.player.team_id:
         messages.success(request, 'Registration completed successfully!')
-        return redirect('sportsSignUp:team_detail', pk=team.id)
-        
-    except Exception as e:
-        messages.error(request, f'Error processing registration: {str(e)}')
-        return redirect('/')
+        return redirect('sportsSignUp:team_detail', pk=registration.player.team_id)
+
+    return render(request, 'teams/team_signup_success.html', {
+        'is_pending': registration is None
+    })
 
 def send_team_email(request, team_id):
     """Send email to all team members"""
@@ -1462,4 +1533,147 @@ class RegistrationFormView(CreateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['league'] = get_object_or_404(League, id=self.kwargs['league_id'])
-        return context
\ No newline at end of file
+        return context
+
+PLAYER_SEARCH_LIMIT = 10
+
+def player_search(request):
+    """Typeahead search over players by name, email or phone, best matches first"""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'Admin privileges required'}, status=403)
+
+    query = request.GET.get('q', '').strip()
+    if len(query) < 2:
+        return JsonResponse([], safe=False)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', PLAYER_SEARCH_LIMIT)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    players = Player.objects.all()
+    league_id = request.GET.get('league')
+    if league_id:
+        if not league_id.isdigit():
+            return JsonResponse({'error': 'Invalid league ID format'}, status=400)
+        players = players.filter(
+            id__in=Registration.objects.filter(league_id=league_id).values('player_id')
+        )
+
+    players = search_players(players, query).values(
+        'id', 'first_name', 'last_name', 'email', 'phone_number', 'team_id', 'team__name'
+    )[:limit]
+
+    return JsonResponse([{
+        'id': player['id'],
+        'name': f"{player['first_name']} {player['last_name']}",
+        'email': player['email'],
+        'phone': player['phone_number'],
+        'team_id': player['team_id'],
+        'team_name': player['team__name'],
+    } for player in players], safe=False)
+
+def free_agent_matches(request, team_id):
+    """The available free agents in the team's league that best fit the team"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Login required'}, status=403)
+    capabilities = get_capabilities(request)
+    if not (capabilities.can_manage_team(team_id) or capabilities.is_admin):
+        return JsonResponse({'error': 'You are not the captain of this team'}, status=403)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', matching.DEFAULT_MATCH_LIMIT)), 1),
+                    matching.MAX_MATCH_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    team = Team.objects.select_related('league', 'division').filter(pk=team_id).first()
+    if team is None:
+        return JsonResponse({'error': 'Team not found'}, status=404)
+
+    return JsonResponse({
+        'team': {'id': team.id, 'name': team.name, 'league_id': team.league_id},
+        'matches': matching.rank_free_agents(team, limit),
+    })
+
+def league_placement(request, league_id):
+    """
+    Automatic placement of a division's unplaced players.
+    GET ?division=<id>[&team_cap=<n>] previews the plan along with the
+    league's registrations version; POST the same fields plus that version
+    to apply that plan. A changed version means the preview is stale (409).
+    """
+    error = _assignment_permission_error(request)
+    if error:
+        return error
+    if request.method not in ('GET', 'POST'):
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    params = request.POST if request.method == 'POST' else request.GET
+    league = League.objects.filter(pk=league_id).first()
+    if league is None:
+        return JsonResponse({'error': 'League not found'}, status=404)
+    division_id = params.get('division', '')
+    if not division_id.isdigit():
+        return JsonResponse({'error': 'division is required'}, status=400)
+    division = league.available_divisions.filter(pk=division_id).first()
+    if division is None:
+        return JsonResponse({'error': 'Division not found in this league'}, status=404)
+    team_cap = params.get('team_cap') or None
+    if team_cap is not None:
+        if not team_cap.isdigit() or int(team_cap) < 1:
+            return JsonResponse({'error': 'Invalid team_cap'}, status=400)
+        team_cap = int(team_cap)
+
+    if request.method == 'GET':
+        version, plan = placement.preview_placement(league, division, team_cap=team_cap)
+        return JsonResponse({'version': version, 'plan': plan.as_dict()})
+
+    with transaction.atomic():
+        # Holding the league row serializes applies, so two posts of one
+        # preview can't both pass the version check
+        league = League.objects.select_for_update().get(pk=league.pk)
+        plan = placement.previewed_plan(league, division, team_cap, params.get('version'))
+        if plan is None:
+            return JsonResponse({'error': 'Registrations changed since the preview; preview again'}, status=409)
+        results = placement.apply_placement(plan)
+    return JsonResponse({
+        'updated': sum(1 for result in results if result['status'] == 'success'),
+        'failed': sum(1 for result in results if result['status'] != 'success'),
+        'unplaced': plan.unplaced,
+        'results': [result for result in results if result['status'] != 'success'],
+    })
+
+class NotificationListView(LoginRequiredMixin, ListView):
+    template_name = 'notifications/list.html'
+    context_object_name = 'notifications'
+    paginate_by = 25
+
+    def get_queryset(self):
+        return self.request.user.team_notifications.select_related(
+            'invitation__team__league',
+            'invitation__free_agent',
+        )
+
+@require_POST
+def mark_notifications_read(request):
+    """
+    Mark notifications read. A JSON body {"ids": [...]} marks those, an
+    empty body or form post marks all of them. Form posts go back to the
+    notification list; JSON requests get the new unread count.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    is_json = request.content_type == 'application/json'
+    notification_ids = None
+    if is_json and request.body:
+        try:
+            notification_ids = [int(pk) for pk in json.loads(request.body)['ids']]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Expected {"ids": [...]}'}, status=400)
+
+    marked = mark_read(request.user, notification_ids)
+    if not is_json:
+        return redirect('sportsSignUp:notifications')
+    return JsonResponse({'marked': marked, 'unread': request.user.unread_notifications})